@@ -18,42 +18,119 @@
 # Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 # Boston, MA 02111-1307, USA.
 
-from consts import AFK_COUNT
+import time
+
+from consts import AFK_COUNT, AFK_TICK
 from gi.repository import GObject
 
 
 class AFKManager(GObject.GObject):
+    """
+    Tracks the last activity of every nickname with a single periodic
+    timer.  Deadlines are grouped in buckets of AFK_TICK miliseconds, and
+    every tick expires the buckets that are due.
+
+    Nicknames are tracked folded by the MemberRegistry, so the ones that
+    differ only in case (as in a case-only rename) are the same user.
+    """
 
     __gsignals__ = {
-        "user-afk": (GObject.SIGNAL_RUN_FIRST, None, [str]),  # Nickname
-        "user-back": (GObject.SIGNAL_RUN_FIRST, None, [str]),  # Nickname
+        "user-afk": (GObject.SIGNAL_RUN_FIRST, None, [object]),  # List of folded nicknames
+        "user-back": (GObject.SIGNAL_RUN_FIRST, None, [object]),  # List of folded nicknames
     }
 
-    def __init__(self):
+    def __init__(self, members):
         GObject.GObject.__init__(self)
 
-        self.timeout_ids = { }  # Nickname: id
+        self.members = members  # MemberRegistry
+
+        self.buckets = { }  # Bucket number: set of keys
+        self.deadlines = { }  # Key: bucket number
+        self.afk = set()  # Keys
+        self.back = [ ]  # Keys waiting for the "user-back" emission
+
+        self.tick_id = None
+        self.back_id = None
+
+    def get_bucket(self, ms):
+        return int(ms // AFK_TICK)
+
+    def now(self):
+        return time.time() * 1000
 
     def stop_counting(self, nickname):
-        if nickname in self.timeout_ids.keys() and self.timeout_ids[nickname] != None:
-            GObject.source_remove(self.timeout_ids[nickname])
+        key = self.members.fold(nickname)
+        if key in self.deadlines:
+            bucket = self.deadlines.pop(key)
+            self.buckets[bucket].discard(key)
+
+            if not self.buckets[bucket]:
+                del self.buckets[bucket]
 
     def start_counting(self, nickname, restart=True):
-        if not nickname in self.timeout_ids.keys() or restart:
-            if nickname in self.timeout_ids.keys():
-                self.emit("user-back", nickname)
+        key = self.members.fold(nickname)
+        known = key in self.deadlines or key in self.afk
+        if known and not restart:
+            return
+
+        if key in self.afk:
+            self.afk.remove(key)
+            self.back.append(key)
+
+            if self.back_id is None:
+                self.back_id = GObject.idle_add(self._back_cb)
+
+        bucket = self.get_bucket(self.now() + AFK_COUNT)
+        if self.deadlines.get(key) == bucket:
+            return
 
-            self.stop_counting(nickname)
-            id = GObject.timeout_add(AFK_COUNT, self._afk_cb, nickname)
-            self.timeout_ids[nickname] = id
+        self.stop_counting(key)
+        self.deadlines[key] = bucket
+        self.buckets.setdefault(bucket, set()).add(key)
+
+        if self.tick_id is None:
+            self.tick_id = GObject.timeout_add(AFK_TICK, self._tick_cb)
+
+    def rename_nickname(self, old_nick, new_nick):
+        """
+        Counts a nick change as activity of new_nick, and forgets old_nick
+        unless they only differ in case.
+        """
+        if self.members.fold(old_nick) != self.members.fold(new_nick):
+            self.remove_nickname(old_nick)
+
+        self.start_counting(new_nick)
 
     def remove_nickname(self, nickname):
-        if nickname in self.timeout_ids.keys():
-            self.stop_counting(nickname)
-            self.timeout_ids.pop(nickname)
+        self.stop_counting(nickname)
+        self.afk.discard(self.members.fold(nickname))
+
+    def _tick_cb(self):
+        current = self.get_bucket(self.now())
+        keys = []
+
+        for bucket in [bucket for bucket in self.buckets.keys() if bucket <= current]:
+            for key in self.buckets.pop(bucket):
+                del self.deadlines[key]
+
+                if self.members.get_channels(key):
+                    self.afk.add(key)
+                    keys.append(key)
+
+        if keys:
+            self.emit("user-afk", keys)
+
+        if not self.buckets:
+            self.tick_id = None
+            return False
+
+        return True
+
+    def _back_cb(self):
+        keys = self.back
+        self.back = [ ]
+        self.back_id = None
 
-    def _afk_cb(self, nickname):
-        self.emit("user-afk", nickname)
-        self.timeout_ids[nickname] = None
+        self.emit("user-back", keys)
 
         return False
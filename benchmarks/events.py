@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014-2016, Cristian García <cristian99garcia@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""
+Events per second delivered from the IRC client to the canvas, as in a
+netsplit: the EventBus, against the signals it replaced, where the
+Client emitted every event and the ClientFactory emitted it again.
+
+The events are posted CHUNK at a time from an idle callback, like the
+lines read at once from the socket in a main loop iteration.  No display
+is needed.  Run it from the top of the tree:
+
+    PYTHONPATH=. python benchmarks/events.py
+"""
+
+import timeit
+
+from event_bus import EventBus
+
+from gi.repository import GLib
+from gi.repository import GObject
+
+EVENTS = 100000
+CHUNK = 50
+REPEAT = 5
+
+USER_QUIT = "user-quit"
+
+
+class OldClient(GObject.GObject):
+
+    __gsignals__ = {
+        "user-quit": (GObject.SIGNAL_RUN_FIRST, None, [str, str]),  # Nickname, Message
+    }
+
+
+class OldClientFactory(GObject.GObject):
+
+    __gsignals__ = {
+        "user-quit": (GObject.SIGNAL_RUN_FIRST, None, [str, str]),  # Nickname, Message
+    }
+
+    def __init__(self, client):
+        GObject.GObject.__init__(self)
+
+        client.connect("user-quit", self._client_user_quit)
+
+    def _client_user_quit(self, client, nickname, message):
+        self.emit("user-quit", nickname, message)
+
+
+class Canvas(object):
+
+    def __init__(self):
+        self.handled = 0
+        self.event_handlers = {
+            USER_QUIT: self._user_quit,
+        }
+
+    def _user_quit(self, nickname, message):
+        self.handled += 1
+
+    def _old_user_quit(self, factory, nickname, message):
+        self._user_quit(nickname, message)
+
+    def _events(self, bus, events):
+        for event in events:
+            handler = self.event_handlers.get(event.type, None)
+            if handler is not None:
+                handler(*event.args)
+
+
+def run(post):
+    """
+    Posts EVENTS events, a chunk per main loop iteration, with post(i),
+    and returns when they are all handled.
+    """
+    loop = GLib.MainLoop()
+    posted = [0]
+
+    def read_cb():
+        for i in range(posted[0], posted[0] + CHUNK):
+            post(i)
+
+        posted[0] += CHUNK
+        if posted[0] < EVENTS:
+            return True
+
+        GObject.idle_add(loop.quit)  # After the last delivery
+        return False
+
+    GObject.idle_add(read_cb)
+    loop.run()
+
+
+def run_signals():
+    client = OldClient()
+    factory = OldClientFactory(client)
+    canvas = Canvas()
+    factory.connect("user-quit", canvas._old_user_quit)
+
+    run(lambda i: client.emit("user-quit", "nickname%d" % (i % 1000), "*.net *.split"))
+    assert canvas.handled == EVENTS
+
+
+def run_bus():
+    bus = EventBus()
+    canvas = Canvas()
+    bus.connect("events", canvas._events)
+
+    run(lambda i: bus.post("network", USER_QUIT, "nickname%d" % (i % 1000), "*.net *.split"))
+    assert canvas.handled == EVENTS
+
+
+def measure(function):
+    return EVENTS / min(timeit.repeat(function, number=1, repeat=REPEAT))
+
+
+def main():
+    print("%d events, %d per main loop iteration:" % (EVENTS, CHUNK))
+    print("  Client and ClientFactory signals %8.0f events/s" % measure(run_signals))
+    print("  EventBus                         %8.0f events/s" % measure(run_bus))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014-2016, Cristian García <cristian99garcia@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""
+Messages per second marked by the Highlighter, against the scan it
+replaced: a search for every watched word, and then for every URL found
+by get_urls, from the start of the message to its end (what
+search_and_mark did with TextIter.forward_search, without the cost of
+searching a GtkTextBuffer).  A single pattern alternating the URLs and
+the words is measured too.
+
+Run it from the top of the tree:
+
+    PYTHONPATH=. python benchmarks/highlighting.py
+"""
+
+import re
+import timeit
+
+from utils import get_urls, URL_REGEX
+from highlighter import Highlighter
+
+MESSAGES = 20000
+REPEAT = 5
+
+TEXTS = [
+    u"hello everybody, how is it going?",
+    u"nickname: have a look at https://example.com/some/page?id=42",
+    u"I pushed the fix, nickname, can you review it?",
+    u"see http://wiki.sugarlabs.org/go/Activities and https://github.com/sugarlabs",
+    u"a longer message without anything special in it, just some chatting " * 3,
+]
+
+WORDS = [u"nickname", u"sugar", u"polari", u"review", u"activity"]
+
+
+def make_messages(count):
+    return [TEXTS[i % len(TEXTS)] for i in range(count)]
+
+
+def find_all(text, word, tag, spans):
+    start = text.find(word)
+    while start != -1:
+        spans.append((start, start + len(word), tag))
+        start = text.find(word, start + len(word))
+
+
+def old_spans(text, words):
+    spans = []
+    for word in words:
+        find_all(text, word, "mention", spans)
+
+    for url in get_urls(text):
+        find_all(text, url, "url", spans)
+
+    return spans
+
+
+def combined_pattern(words):
+    pattern = "(?P<url>%s)|(?P<mention>%s)" % (URL_REGEX, "|".join(re.escape(word) for word in words))
+    return re.compile(pattern, re.UNICODE)
+
+
+def combined_spans(text, pattern):
+    return [(match.start(), match.end(), match.lastgroup) for match in pattern.finditer(text)]
+
+
+def measure(function):
+    return MESSAGES / min(timeit.repeat(function, number=1, repeat=REPEAT))
+
+
+def main():
+    messages = make_messages(MESSAGES)
+
+    for count in (1, len(WORDS)):
+        words = WORDS[:count]
+        highlighter = Highlighter(words)
+        pattern = combined_pattern(words)
+
+        print "%d word(s):" % count
+        print "  per-word scan    %8.0f messages/s" % measure(lambda: [old_spans(text, words) for text in messages])
+        print "  combined pattern %8.0f messages/s" % measure(lambda: [combined_spans(text, pattern) for text in messages])
+        print "  Highlighter      %8.0f messages/s" % measure(lambda: [highlighter.get_spans(text) for text in messages])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Benchmark of the parsing of the lines received by
+L{twisted.words.protocols.irc.IRCClient}: the number of lines per second
+parsed alone, and parsed and dispatched to the client's handlers.
+
+Trees without IRCv3 message tags only run the untagged traffic.  Run it
+from the top of the tree, with the interpreter to measure::
+
+    PYTHONPATH=. python benchmarks/irc_parse.py
+"""
+
+from __future__ import division, print_function
+
+import sys
+import timeit
+
+from twisted.test.proto_helpers import StringTransport
+from twisted.words.protocols import irc
+
+LINES = 100000
+CHUNK_SIZE = 4096
+REPEAT = 5
+
+TRAFFIC = [
+    ':nick%d!user@host.example.com PRIVMSG #channel :hello there, how are '
+    'you doing today?',
+    ':nick%d!user@host.example.com JOIN #channel',
+    ':nick%d!user@host.example.com PART #channel :Leaving',
+    ':irc.example.com 353 me = #channel :nick%d @op +voice other another',
+    ':irc.example.com 332 me #channel :The topic of the channel',
+    ':nick%d!user@host.example.com NOTICE me :a notice',
+    'PING :irc.example.com',
+    ':nick%d!user@host.example.com QUIT :Quit: bye',
+]
+
+TAGS = '@time=2016-01-01T00:00:00.000Z;account=nick%d '
+
+
+
+def makeLines(lines, tagged):
+    """
+    Build C{lines} lines of IRC traffic, with message tags if C{tagged}.
+    """
+    result = []
+    for i in range(lines):
+        line = TRAFFIC[i % len(TRAFFIC)]
+        if tagged:
+            line = TAGS + line
+        if '%d' in line:
+            line = line.replace('%d', str(i % 97))
+        result.append(line)
+    return result
+
+
+
+def getParser():
+    """
+    Return the function parsing a line as L{irc.IRCClient.lineReceived}
+    does, without dispatching it, in this tree.
+    """
+    if hasattr(irc, '_splitMessage'):
+        def parse(line):
+            if line[0:1] != '@':
+                return irc._splitMessage(line)
+            return irc._parseMessage(line)
+        return parse
+    if hasattr(irc, '_parseMessage'):
+        return irc._parseMessage
+    if hasattr(irc, '_splitTags'):
+        def parse(line):
+            tags, line = irc._splitTags(line)
+            prefix, command, params = irc.parsemsg(line)
+            return tags, prefix, irc.numeric_to_symbolic.get(command, command)
+        return parse
+    def parse(line):
+        prefix, command, params = irc.parsemsg(line)
+        return prefix, irc.numeric_to_symbolic.get(command, command)
+    return parse
+
+
+
+def parseAll(parse, lines):
+    for line in lines:
+        parse(line)
+
+
+
+def receiveAll(chunks):
+    """
+    Deliver all the chunks to a new connected L{irc.IRCClient}.
+    """
+    client = irc.IRCClient()
+    client.performLogin = False
+    client.makeConnection(StringTransport())
+    for chunk in chunks:
+        client.dataReceived(chunk)
+
+
+
+def measure(function):
+    seconds = min(timeit.repeat(function, number=1, repeat=REPEAT))
+    return LINES / seconds
+
+
+
+def main():
+    print(sys.version.split()[0])
+    parse = getParser()
+    variants = [('untagged', False)]
+    if hasattr(irc, '_parseTags'):
+        variants.append(('tagged', True))
+    for name, tagged in variants:
+        lines = makeLines(LINES, tagged)
+        data = ''.join(line + '\r\n' for line in lines).encode('utf-8')
+        chunks = [data[i:i + CHUNK_SIZE]
+                  for i in range(0, len(data), CHUNK_SIZE)]
+        print('%-8s parse:    %10.0f lines/s'
+              % (name, measure(lambda: parseAll(parse, lines))))
+        print('%-8s dispatch: %10.0f lines/s'
+              % (name, measure(lambda: receiveAll(chunks))))
+
+
+
+if __name__ == '__main__':
+    main()
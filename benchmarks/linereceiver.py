@@ -0,0 +1,76 @@
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Benchmark of L{twisted.protocols.basic.LineReceiver}: the number of lines
+per second it delivers, replaying IRC traffic split into chunks of several
+sizes.
+
+Run it from the top of the tree, with the interpreter to measure::
+
+    PYTHONPATH=. python benchmarks/linereceiver.py
+"""
+
+from __future__ import division, print_function
+
+import sys
+import timeit
+
+from twisted.protocols.basic import LineReceiver
+
+LINES = 200000
+CHUNK_SIZES = (512, 4096, 65536)
+REPEAT = 5
+
+
+
+class Receiver(LineReceiver):
+    """
+    Line receiver counting the lines it gets.
+    """
+    count = 0
+
+    def lineReceived(self, line):
+        self.count += 1
+
+
+
+def makeTraffic(lines):
+    """
+    Build C{lines} lines of IRC traffic, of the usual lengths.
+    """
+    data = []
+    for i in range(lines):
+        data.append(
+            b':nick%d!user@host.example.com PRIVMSG #channel%d :'
+            % (i % 97, i % 13))
+        data.append(b'x' * (i % 120))
+        data.append(b'\r\n')
+    return b''.join(data)
+
+
+
+def replay(chunks, lines):
+    """
+    Deliver all the chunks to a new receiver, and check it got every line.
+    """
+    receiver = Receiver()
+    for chunk in chunks:
+        receiver.dataReceived(chunk)
+    assert receiver.count == lines, receiver.count
+
+
+
+def main():
+    traffic = makeTraffic(LINES)
+    print(sys.version.split()[0])
+    for size in CHUNK_SIZES:
+        chunks = [traffic[i:i + size] for i in range(0, len(traffic), size)]
+        seconds = min(timeit.repeat(
+            lambda: replay(chunks, LINES), number=1, repeat=REPEAT))
+        print('%6d byte chunks: %10.0f lines/s' % (size, LINES / seconds))
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+# Copyright (c) Twisted Matrix Laboratories.
+# See LICENSE for details.
+
+"""
+Load generator for the IRC server of L{twisted.words.service}: 10000
+simulated clients, connected over in-memory transports to an
+L{twisted.words.service.InMemoryWordsRealm}, log in, join three of 1000
+channels each, talk in them, and ask for their names, the list of
+channels and each other's whois.  The rate of every phase is printed.
+
+Run it from the top of the tree, with the interpreter to measure::
+
+    PYTHONPATH=. python benchmarks/words_load.py [clients [channels]]
+"""
+
+from __future__ import division, print_function
+
+import sys
+import time
+
+from twisted.cred import checkers, portal
+from twisted.internet import address
+from twisted.test.proto_helpers import StringTransport
+from twisted.words import service
+
+CLIENTS = 10000
+CHANNELS = 1000
+JOINS = 3
+LISTS = 200
+
+
+
+def channelsOf(client, channels):
+    """
+    Return the names of the channels joined by the client numbered
+    C{client}.
+    """
+    return ['channel%d' % ((client + i * channels // JOINS) % channels,)
+            for i in range(JOINS)]
+
+
+
+class Load(object):
+    """
+    A server and its connected clients.
+
+    @ivar clients: The protocol of every client, and the channels it joins.
+    @type clients: L{list} of (L{service.IRCUser}, L{list} of L{str})
+    """
+
+    def __init__(self, clients, channels):
+        self.realm = service.InMemoryWordsRealm("loadrealm")
+        self.realm.createGroupOnRequest = True
+        checker = checkers.InMemoryUsernamePasswordDatabaseDontUse()
+        self.factory = service.IRCFactory(
+            self.realm, portal.Portal(self.realm, [checker]))
+        self.clients = []
+        self.lines = 0
+        for i in range(clients):
+            checker.addUser(u'user%d' % (i,), u'password')
+            self.clients.append((None, channelsOf(i, channels)))
+
+
+    def send(self, protocol, line):
+        protocol.dataReceived(line.encode('utf-8') + b'\r\n')
+
+
+    def drain(self):
+        """
+        Count and discard the lines written to every client.
+        """
+        for protocol, channels in self.clients:
+            value = protocol.transport.value()
+            self.lines += value.count(b'\n')
+            protocol.transport.clear()
+
+
+    def connect(self):
+        clients = []
+        peer = address.IPv4Address('TCP', '127.0.0.1', 54321)
+        for i, (protocol, channels) in enumerate(self.clients):
+            protocol = self.factory.buildProtocol(peer)
+            # The clients send their commands faster than flood control
+            # lets them.
+            protocol.commandRate = None
+            protocol.makeConnection(StringTransport())
+            self.send(protocol, u'PASS password')
+            self.send(protocol, u'NICK user%d' % (i,))
+            for channel in channels:
+                self.send(protocol, u'JOIN #' + channel)
+            protocol.transport.clear()
+            clients.append((protocol, channels))
+        self.clients = clients
+
+
+    def talk(self):
+        for i, (protocol, channels) in enumerate(self.clients):
+            self.send(protocol, u'PRIVMSG #%s :message number %d'
+                      % (channels[i % JOINS], i))
+        self.drain()
+
+
+    def names(self):
+        for protocol, channels in self.clients:
+            for channel in channels:
+                self.send(protocol, u'NAMES #' + channel)
+            protocol.transport.clear()
+
+
+    def list(self):
+        for protocol, channels in self.clients[:LISTS]:
+            self.send(protocol, u'LIST')
+            protocol.transport.clear()
+
+
+    def whois(self):
+        for i, (protocol, channels) in enumerate(self.clients):
+            self.send(protocol, u'WHOIS user%d' % ((i * 31) % len(self.clients),))
+            protocol.transport.clear()
+
+
+    def quit(self):
+        for protocol, channels in self.clients:
+            protocol.transport.loseConnection()
+            protocol.connectionLost(None)
+
+
+
+def measure(name, function, count, unit):
+    start = time.time()
+    function()
+    seconds = time.time() - start
+    print('%-8s %10.0f %s/s' % (name, count / seconds, unit))
+
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else CLIENTS
+    channels = int(sys.argv[2]) if len(sys.argv) > 2 else CHANNELS
+    print(sys.version.split()[0], '%d clients, %d channels'
+          % (clients, channels))
+    load = Load(clients, channels)
+    measure('connect', load.connect, clients, 'clients')
+    load.lines = 0
+    start = time.time()
+    load.talk()
+    print('%-8s %10.0f lines/s'
+          % ('privmsg', load.lines / (time.time() - start)))
+    measure('names', load.names, clients * JOINS, 'commands')
+    measure('list', load.list, min(LISTS, clients), 'commands')
+    measure('whois', load.whois, clients, 'commands')
+    measure('quit', load.quit, clients, 'clients')
+
+
+
+if __name__ == '__main__':
+    main()
@@ -35,10 +35,11 @@ class ChannelItem(Gtk.EventBox):
         "removed": (GObject.SIGNAL_RUN_FIRST, None, []),
     }
 
-    def __init__(self, channel, show=None, close_button=False):
+    def __init__(self, network, channel, show=None, close_button=False):
         Gtk.EventBox.__init__(self)
 
         self.selected = False
+        self.network = network
         self.channel = channel
         self.use_close_button = close_button
 
@@ -110,8 +111,8 @@ class ChannelItem(Gtk.EventBox):
 class ChannelsListBox(Gtk.ScrolledWindow):
 
     __gsignals__ = {
-        "channel-selected": (GObject.SIGNAL_RUN_FIRST, None, [str]),
-        "channel-removed": (GObject.SIGNAL_RUN_FIRST, None, [str]),
+        "channel-selected": (GObject.SIGNAL_RUN_FIRST, None, [str, str]),  # Network, channel
+        "channel-removed": (GObject.SIGNAL_RUN_FIRST, None, [str, str]),  # Network, channel
     }
 
     def __init__(self):
@@ -126,14 +127,13 @@ class ChannelsListBox(Gtk.ScrolledWindow):
             self.modify_bg(Gtk.StateType.NORMAL, Color.WHITE)
 
         self.add(self.vbox)
-        self.add_status_tab()
         self.show_all()
 
-    def add_status_tab(self):
-        self.add_channel(STATUS_CHANNEL, show="Status", close_button=False)
+    def add_network(self, network):
+        self.add_channel(network, STATUS_CHANNEL, show=network, close_button=False)
 
-    def add_channel(self, channel, show=None, close_button=True):
-        item = ChannelItem(channel, show=show, close_button=close_button)
+    def add_channel(self, network, channel, show=None, close_button=True):
+        item = ChannelItem(network, channel, show=show, close_button=close_button)
         item.connect("selected", self.select_item)
         item.connect("removed", self.remove_item)
         self.vbox.pack_start(item, False, False, 0)
@@ -148,7 +148,7 @@ class ChannelsListBox(Gtk.ScrolledWindow):
         self.items.remove(item)
         self.vbox.remove(item)
 
-        self.emit("channel-removed", item.channel)
+        self.emit("channel-removed", item.network, item.channel)
         item.destroy()
 
         if idx > 0:
@@ -161,17 +161,17 @@ class ChannelsListBox(Gtk.ScrolledWindow):
         for i in self.items:
             i.set_selected(i == item)
 
-        self.emit("channel-selected", item.channel)
+        self.emit("channel-selected", item.network, item.channel)
 
-    def select_item_from_string(self, channel):
+    def select_item_from_string(self, network, channel):
         for item in self.items:
-            if item.channel == channel:
+            if item.network == network and item.channel == channel:
                 self.select_item(item)
                 break
 
-    def change_spinner(self, channel, active):
+    def change_spinner(self, network, channel, active):
         for item in self.items:
-            if item.channel == channel:
+            if item.network == network and item.channel == channel:
                 if active:
                     item.start_spinner()
 
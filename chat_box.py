@@ -18,14 +18,23 @@
 # Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 # Boston, MA 02111-1307, USA.
 
+import os
+import time
+import urllib
+import shutil
+import tempfile
+from collections import deque
 from gettext import gettext as _
 
 from consts import CONNECTION_ERROR, NICKNAME_USED, SUGAR, CHAT_FONT, Color, \
-                   Key, STATUS_CHANNEL
+                   Key, STATUS_CHANNEL, SCROLLBACK_LINES, COMPLETION_SPEAKERS, UserType, \
+                   SEARCH_MORE, SEARCH_NO_RESULTS, LATE_MESSAGE_DELAY, ACTION_PREFIX
 
-from utils import get_urls, beep, remove_usertypes
+from utils import beep, to_unicode, split_lines
 from nicknames_listbox import NicknamesListBox
 from topic_label import TopicLabel
+from scrollback import Scrollback
+from highlighter import Highlighter
 
 import gi
 gi.require_version("Gtk", "3.0")
@@ -47,18 +56,32 @@ class ChatBox(Gtk.VBox):
         "change-topic": (GObject.SIGNAL_RUN_FIRST, None, [str, str]),  # Channel, Topic
     }
 
-    def __init__(self):
+    def __init__(self, members, log_store):
         Gtk.VBox.__init__(self)
 
+        self.members = members  # MemberRegistry
+        self.log_store = log_store  # LogStore
+        self.log_search = None  # LogSearch shown with /search
         self.nick = None
+        self.echo_message = False  # The server echoes our own messages
         self.current_channel = None
         self.channels = [ ]
         self.last_nick = { }  # channel: str
-        self.nicks = { }  # channel: list
         self.views = { }  # channel: GtkTextView
         self.buffers = { }  # channel: GtkTextBuffer
         self.nicks_listboxs = { }  # channel: NicknamesListBox
         self.topic_labels = { }  # channel: TopicLabel
+        self.scrollbacks = { }  # channel: Scrollback
+        self.pending = { }  # channel: list of lines waiting to be rendered
+        self.held = { }  # channel: list of lines of a channel not shown yet
+        self.usertypes = { }  # channel: {nickname: UserType}
+        self.topics = { }  # channel: str
+        self.afk = set()  # Folded nicknames
+        self.speakers = { }  # channel: deque of folded nicknames, the most recent last
+        self.completion = None  # (channel, text, cursor, start, after, candidates, index)
+        self.flush_id = None
+        self.highlighter = Highlighter()
+        self.scrollback_dir = tempfile.mkdtemp(prefix="polari-")
 
         self._last_tag = "message2"
 
@@ -67,6 +90,7 @@ class ChatBox(Gtk.VBox):
         self.add_events(Gdk.EventMask.KEY_PRESS_MASK)
 
         self.connect("key-press-event", self.__key_press_cb)
+        self.connect("destroy", self._destroy_cb)
 
         vbox = Gtk.VBox()
         self.pack_start(vbox, True, True, 0)
@@ -79,6 +103,7 @@ class ChatBox(Gtk.VBox):
         vbox.pack_start(hbox, True, True, 5)
 
         self.scroll = Gtk.ScrolledWindow()
+        self.scroll.get_vadjustment().connect("value-changed", self._scroll_changed)
         hbox.pack_start(self.scroll, True, True, 0)
 
         self.nicks_box = Gtk.VBox()
@@ -108,18 +133,77 @@ class ChatBox(Gtk.VBox):
 
     def __key_press_cb(self, widget, event):
         if event.keyval == Key.TAB and self.entry.has_focus():
-            pos = self.entry.props.cursor_position
-            text = self.entry.get_text()[:pos].split(" ")[-1]
-
-            for nick in self.nicks[self.current_channel]:
-                if nick.startswith(text):
-                    # TODO: Autocomplete
-                    pass
-
+            self.complete()
             return True
 
         return False
 
+    def complete(self):
+        """
+        Completes the word before the cursor with a nickname of the current
+        channel, or with a channel if it starts with "#".  Pressing TAB again
+        without changing the text cycles through the candidates.
+        """
+        channel = self.current_channel
+        text = to_unicode(self.entry.get_text())
+        pos = self.entry.props.cursor_position
+
+        if self.completion is not None and self.completion[:3] == (channel, text, pos):
+            channel, text, pos, start, after, candidates, index = self.completion
+            index = (index + 1) % len(candidates)
+
+        else:
+            start = text.rfind(" ", 0, pos) + 1
+            after = text[pos:]
+            candidates = self.get_completions(channel, text[start:pos], start == 0)
+            index = 0
+
+            if not candidates:
+                self.completion = None
+                return
+
+        text = text[:start] + candidates[index] + after
+        pos = start + len(candidates[index])
+        self.completion = (channel, text, pos, start, after, candidates, index)
+
+        self.entry.set_text(text)
+        self.entry.set_position(pos)
+
+    def get_completions(self, channel, prefix, first_word):
+        """
+        Returns the completions of prefix, with the separator to add after
+        them.  Nicknames are ranked by how recently they spoke.
+        """
+        if not prefix:
+            return [ ]
+
+        if prefix.startswith("#"):
+            prefix = self.members.fold(prefix)
+            return [to_unicode(name) + " " for name in self.channels
+                    if self.members.fold(name).startswith(prefix)]
+
+        nicknames = self.members.get_members_with_prefix(channel, prefix)
+        if self.nick in nicknames:
+            nicknames.remove(self.nick)
+
+        speakers = self.speakers.get(channel, ())
+        ranks = dict((key, rank) for rank, key in enumerate(speakers))
+        nicknames.sort(key=lambda nickname: -ranks.get(self.members.fold(nickname), -1))
+
+        separator = ": " if first_word else " "
+        return [to_unicode(nickname) + separator for nickname in nicknames]
+
+    def add_speaker(self, channel, nickname):
+        if channel not in self.speakers:
+            self.speakers[channel] = deque(maxlen=COMPLETION_SPEAKERS)
+
+        speakers = self.speakers[channel]
+        key = self.members.fold(nickname)
+        if key in speakers:
+            speakers.remove(key)
+
+        speakers.append(key)
+
     def _change_nickname(self, widget):
         self.emit("change-nickname", self.nicker.get_text())
         self.nicker.set_text("")
@@ -128,29 +212,61 @@ class ChatBox(Gtk.VBox):
         self.add_channel(STATUS_CHANNEL)
 
     def add_channel(self, channel):
+        """
+        Adds the model of a channel: its lines, members and topic.  The
+        widgets are created when the channel is shown for the first time.
+        """
         if channel not in self.channels:
             self.channels.append(channel)
-            self.views[channel] = self.make_textview_for_channel(channel)
-            self.buffers[channel] = self.views[channel].get_buffer()
             self.last_nick[channel] = None
-            self.nicks[channel] = []
-            self.nicks_listboxs[channel] = NicknamesListBox()
-            self.nicks_listboxs[channel].connect("query", self._query)
+            self.members.add_channel(channel)
+            self.usertypes[channel] = { }
+            self.topics[channel] = None
+
+            path = os.path.join(self.scrollback_dir, urllib.quote(channel, safe="") + ".log")
+            self.scrollbacks[channel] = Scrollback(path)
+
+    def create_view(self, channel):
+        self.views[channel] = self.make_textview_for_channel(channel)
+        self.buffers[channel] = self.views[channel].get_buffer()
+        self.create_tags(channel)
+
+        if channel.startswith("#"):  # Is a channel, not a nickname
+            listbox = NicknamesListBox()
+            listbox.connect("query", self._query)
+            listbox.set_list(self.usertypes[channel].items())
+            for nickname in self.members.get_members(channel):
+                if self.members.fold(nickname) in self.afk:
+                    listbox.set_afk(nickname, True)
+
+            self.nicks_listboxs[channel] = listbox
+
+            if self.topics[channel] is None:
+                self.topic_labels[channel] = TopicLabel()
+
+            else:
+                self.topic_labels[channel] = TopicLabel(self.topics[channel])
 
-            self.topic_labels[channel] = TopicLabel()
             self.topic_labels[channel].connect("change-topic", self._change_topic)
 
-            self.create_tags(channel)
+        lines = self.held.pop(channel, [])
+        if lines:
+            self.render_lines(channel, lines, notify=False)
 
     def remove_channel(self, channel):
         if channel in self.channels:
-            idx = self.channels.index(channel)
             self.channels.remove(channel)
-            self.views.pop(channel)
-            self.buffers.pop(channel)
-            self.nicks.pop(channel)
-            self.nicks_listboxs.pop(channel)
-            self.topic_labels.pop(channel)
+            self.views.pop(channel, None)
+            self.buffers.pop(channel, None)
+            self.members.remove_channel(channel)
+            self.usertypes.pop(channel)
+            self.topics.pop(channel)
+            self.nicks_listboxs.pop(channel, None)
+            self.topic_labels.pop(channel, None)
+            self.scrollbacks.pop(channel).close()
+            self.pending.pop(channel, None)
+            self.held.pop(channel, None)
+            self.speakers.pop(channel, None)
 
     def switch_channel(self, channel):
         if channel == self.current_channel:
@@ -166,6 +282,9 @@ class ChatBox(Gtk.VBox):
             self.nicks_box.remove(self.nicks_box.get_children()[0])
 
         self.current_channel = channel
+        if channel not in self.views:
+            self.create_view(channel)
+
         self.scroll.add(self.views[self.current_channel])
 
         if channel.startswith("#"):  # Is a channel, not a nickname
@@ -185,6 +304,7 @@ class ChatBox(Gtk.VBox):
 
     def set_nickname(self, nick):
         self.nick = nick
+        self.highlighter.set_words([to_unicode(nick)])
         self.nicker.set_placeholder_text(self.nick)
 
     def send_message(self, widget):
@@ -192,7 +312,8 @@ class ChatBox(Gtk.VBox):
 
         if not message.startswith("/"):
             self.emit("send-message", self.current_channel, message)
-            self.add_message_to_view(self.current_channel, self.nick, message, force=True)
+            if not self.echo_message:
+                self.add_message_to_view(self.current_channel, self.nick, message, force=True)
 
         else:
             command = message.split(" ")[0]
@@ -201,18 +322,174 @@ class ChatBox(Gtk.VBox):
 
         self.entry.set_text("")
 
-    def add_text_with_tag(self, channel, text, tag):
+    def add_line(self, channel, segments, highlight=False, mention=False):
+        """
+        Queues a line, made of (text, tag) segments, to be rendered on the
+        next flush.  If highlight is True, URLs in the last segment are
+        marked, and mentions of the nickname too when mention is True.
+        """
         if not channel in self.channels and channel[1:] in self.channels:
             channel = channel[1:]
 
-        end = self.buffers[channel].get_end_iter()
-        self.buffers[channel].insert_with_tags_by_name(end, text, tag)
+        if channel not in self.pending:
+            self.pending[channel] = []
+
+        # The scrollback counts a buffer line per line, so a message with
+        # line breaks (a traceback, a dequoted "\n") is split in several
+        segments = [(to_unicode(text), tag) for text, tag in segments]
+        for line in split_lines(segments):
+            self.pending[channel].append((line, highlight, mention))
+
+        if self.flush_id is None:
+            self.flush_id = GObject.idle_add(self._flush_cb)
+
+    def flush(self):
+        if self.flush_id is not None:
+            GObject.source_remove(self.flush_id)
+
+        self._flush_cb()
+
+    def flush_channel(self, channel):
+        lines = self.pending.pop(channel, [])
+        if not lines or channel not in self.scrollbacks:
+            return
+
+        if channel in self.buffers:
+            self.render_lines(channel, lines)
+
+        else:
+            self.hold_lines(channel, lines)
+
+    def hold_lines(self, channel, lines):
+        """
+        Keeps the lines of a channel which wasn't shown yet, until its view
+        is created.  Only the last SCROLLBACK_LINES are kept, the older
+        ones are written to the scrollback log.
+        """
+        for segments, highlight, mention in lines:
+            if highlight and mention and self.has_mention(segments[-1][0]):
+                beep()
+                break
+
+        held = self.held.setdefault(channel, [])
+        held.extend(lines)
+
+        overflow = len(held) - SCROLLBACK_LINES
+        if overflow > 0:
+            scrollback = self.scrollbacks[channel]
+            for segments, highlight, mention in held[:overflow]:
+                scrollback.spill(segments)
+
+            del held[:overflow]
+
+    def has_mention(self, text):
+        for start, end, tag in self.highlighter.get_spans(to_unicode(text)):
+            if tag == "mention":
+                return True
+
+        return False
+
+    def render_lines(self, channel, lines, notify=True):
+        """
+        Renders lines in the buffer of a channel with a single insertion,
+        then applies the tags by offset.
+        """
+        buffer = self.buffers[channel]
+        offset = buffer.get_end_iter().get_offset()
+
+        chunks = []
+        ranges = []  # [tag, start offset, end offset]
+        mentioned = False
+
+        for segments, highlight, mention in lines:
+            for text, tag in segments:
+                text = to_unicode(text)
+                chunks.append(text)
+
+                if ranges and ranges[-1][0] == tag and ranges[-1][2] == offset:
+                    ranges[-1][2] += len(text)
+
+                else:
+                    ranges.append([tag, offset, offset + len(text)])
+
+                offset += len(text)
+
+            if highlight:
+                start = offset - len(text)
+                for span_start, span_end, tag in self.highlighter.get_spans(text, mention):
+                    ranges.append([tag, start + span_start, start + span_end])
+                    mentioned = mentioned or tag == "mention"
+
+        buffer.insert(buffer.get_end_iter(), u"".join(chunks))
+
+        for tag, start, end in ranges:
+            buffer.apply_tag_by_name(tag, buffer.get_iter_at_offset(start), buffer.get_iter_at_offset(end))
+
+        if mentioned and notify:
+            beep()
+
+        for segments, highlight, mention in lines:
+            self.store_line(channel, segments)
+
+    def store_line(self, channel, segments):
+        if self.scrollbacks[channel].add(segments):
+            self.trim_scrollback(channel)
+
+    def trim_scrollback(self, channel):
+        scrollback = self.scrollbacks[channel]
+        if channel == self.current_channel and scrollback.is_paged():
+            return  # The user is reading old lines
 
-    def add_system_message(self, channel, message):
+        lines = scrollback.trim()
+        if lines > 0:
+            buffer = self.buffers[channel]
+            buffer.delete(buffer.get_start_iter(), buffer.get_iter_at_line(lines))
+
+    def page_back_scrollback(self, channel):
+        scrollback = self.scrollbacks[channel]
+        if not scrollback.can_page_back():
+            return
+
+        buffer = self.buffers[channel]
+        view = self.views[channel]
+        mark = buffer.create_mark(None, buffer.get_start_iter(), False)
+
+        for segments in scrollback.page_back():
+            for text, tag in segments:
+                buffer.insert_with_tags_by_name(buffer.get_iter_at_mark(mark), text, tag)
+
+        view.scroll_to_mark(mark, 0, True, 0, 0)
+        buffer.delete_mark(mark)
+
+    def get_time_segments(self, timestamp):
+        """
+        Returns the segments showing the server time of a message, if it
+        was sent LATE_MESSAGE_DELAY seconds ago or more, as the history
+        played back by a bouncer.
+        """
+        if timestamp is None or time.time() - timestamp < LATE_MESSAGE_DELAY:
+            return [ ]
+
+        return [(time.strftime("[%H:%M] ", time.localtime(timestamp)), "sys-msg")]
+
+    def add_system_message(self, channel, message, timestamp=None):
         self.last_nick[channel] = "<SYSTEM>"
-        self.add_text_with_tag(channel, message + "\n", "sys-msg")
+        self.add_line(channel, self.get_time_segments(timestamp) + [(message + "\n", "sys-msg")])
+
+    def add_action(self, channel, nickname, message, timestamp=None):
+        """
+        Shows a /me action, and logs it as a CTCP ACTION so the search
+        results tell it from a message.
+        """
+        if channel != STATUS_CHANNEL:
+            self.log_store.append(channel, nickname, ACTION_PREFIX + message + u"\x01", timestamp)
+
+        self.add_system_message(channel, _(" * {nickname} {message}").format(nickname=nickname, message=message), timestamp)
+
+    def add_message_to_view(self, channel, user, message, force=False, timestamp=None):
+        if channel != STATUS_CHANNEL:
+            self.log_store.append(channel, user, message, timestamp)
 
-    def add_message_to_view(self, channel, user, message, force=False):
         if user != self.nick or force:
             if user == self.last_nick[channel]:
                 user = " "  * (len(user) + 2)
@@ -221,39 +498,19 @@ class ChatBox(Gtk.VBox):
                 self.last_nick[channel] = user
                 user += ": "
 
-        self.add_text_with_tag(channel, user, "nick")
-
-        end = self.buffers[channel].get_end_iter()
-        offset = end.get_offset()
-
         tag = "message1" if self._last_tag == "message2" else "message2"
         self._last_tag = tag
-        self.add_text_with_tag(channel, message + "\n", tag)
-        end = self.buffers[channel].get_iter_at_offset(offset)
-
-        if self.last_nick[channel] != self.nick:
-            self.search_and_mark(channel, self.nick, end, "mention")
 
-        offset = end.get_offset()
+        mention = self.last_nick[channel] != self.nick
+        segments = self.get_time_segments(timestamp) + [(user, "nick"), (message + "\n", tag)]
+        self.add_line(channel, segments, True, mention)
 
-        for url in get_urls(message):
-            end = self.buffers[channel].get_iter_at_offset(offset)
-            self.search_and_mark(channel, url, end, "url")
+    def message_recived(self, channel, nick, message, timestamp=None):
+        if nick != self.nick:
+            self.add_speaker(channel, nick)
 
-    def search_and_mark(self, channel, text, start, tag):
-        end = self.buffers[channel].get_end_iter()
-        match = start.forward_search(text, 0, end)
-
-        if match != None:
-            match_start, match_end = match
-            self.buffers[channel].apply_tag_by_name(tag, match_start, match_end)
-            self.search_and_mark(channel, text, match_end, tag)
-
-            if tag == "mention":
-                beep()
-
-    def message_recived(self, channel, nick, message):
-        self.add_message_to_view(channel, nick, message)
+        # Our own messages come back from the server with echo-message
+        self.add_message_to_view(channel, nick, message, force=nick == self.nick, timestamp=timestamp)
 
     def set_entries_theme(self):
         theme_entry = "GtkEntry {border-radius:0px 30px 30px 0px;}"
@@ -289,27 +546,163 @@ class ChatBox(Gtk.VBox):
     def get_entry(self):
         return self.entry
 
-    def set_nicknames(self, channel, nicknames):
-        if channel in self.channels:  # twisted factory add a hash to nicks too
-            self.nicks_listboxs[channel].set_list(nicknames)
-            self.nicks[channel] = remove_usertypes(nicknames)
+    def set_nicknames(self, channel, members):
+        """
+        Sets the members of a channel from a NAMES reply.  If the channel
+        already had members (after a reconnection), only the differences
+        are applied, unless most of them changed.
+        """
+        if channel not in self.channels:  # twisted factory add a hash to nicks too
+            return
+
+        old = self.usertypes[channel]
+        new = dict(members)
+
+        removed = [nickname for nickname in old if nickname not in new]
+        changed = [(nickname, usertype) for nickname, usertype in new.items() if old.get(nickname) != usertype]
+        listbox = self.nicks_listboxs.get(channel, None)
+
+        if not old or len(removed) + len(changed) > len(new) / 2:
+            self.usertypes[channel] = new
+            self.members.set_members(channel, new.keys())
+
+            if listbox is not None:
+                listbox.set_list(members)
+
+            return
+
+        for nickname in removed:
+            del old[nickname]
+            self.members.remove(channel, nickname)
+
+            if listbox is not None:
+                listbox.remove_nickname(nickname)
 
-    def add_nickname(self, channel, nickname):
-        self.nicks[channel].append(nickname)
-        self.nicks_listboxs[channel].add_nickname(nickname)
+        for nickname, usertype in changed:
+            old[nickname] = usertype
+            self.members.add(channel, nickname)
+
+            if listbox is not None:
+                listbox.remove_nickname(nickname)
+                listbox.add_nickname(nickname, usertype)
+
+    def add_nickname(self, channel, nickname, usertype=None):
+        usertype = UserType.NORMAL if usertype is None else usertype
+        self.members.add(channel, nickname)
+        self.usertypes[channel][nickname] = usertype
+
+        if channel in self.nicks_listboxs:
+            self.nicks_listboxs[channel].add_nickname(nickname, usertype)
 
     def remove_nickname(self, channel, nickname):
-        self.nicks[channel].remove(nickname)
-        self.nicks_listboxs[channel].remove_nickname(nickname)
+        nickname = self.members.remove(channel, nickname)
+        if nickname is not None:
+            self.usertypes[channel].pop(nickname, None)
+
+            if channel in self.nicks_listboxs:
+                self.nicks_listboxs[channel].remove_nickname(nickname)
 
     def set_topic(self, channel, topic):
         if channel in self.channels:
-            self.topic_labels[channel].set_topic(topic)
+            self.topics[channel] = topic
+
+            if channel in self.topic_labels:
+                self.topic_labels[channel].set_topic(topic)
 
     def remove_nickname_from_all_channels(self, nickname):
-        for channel in self.nicks.keys():
-            if nickname in self.nicks[channel]:
-                self.remove_nickname(channel, nickname)
+        """
+        Returns a list of (channel, nickname) with the channels where
+        nickname was.
+        """
+        removed = self.members.quit(nickname)
+        for channel, nickname in removed:
+            self.usertypes[channel].pop(nickname, None)
+
+            if channel in self.nicks_listboxs:
+                self.nicks_listboxs[channel].remove_nickname(nickname)
+
+        return removed
+
+    def rename_nickname(self, old_nick, new_nick):
+        """
+        Returns a list of (channel, old nickname) with the channels where
+        old_nick was.
+        """
+        renamed = self.members.rename(old_nick, new_nick)
+        for channel, nickname in renamed:
+            usertype = self.usertypes[channel].pop(nickname, UserType.NORMAL)
+            self.usertypes[channel][new_nick] = usertype
+
+            if channel in self.nicks_listboxs:
+                listbox = self.nicks_listboxs[channel]
+                listbox.remove_nickname(nickname)
+                listbox.add_nickname(new_nick, usertype)
+
+        return renamed
+
+    def search_logs(self, text, channel=None):
+        """
+        Returns a LogSearch of the lines of the history with all the words
+        of text, in channel or in all the channels of the network.
+        """
+        self.log_store.flush()
+        return self.log_store.search(text, channel)
+
+    def show_search_results(self, channel, text):
+        """
+        Shows in channel the first page of results of a search in its
+        history, or the next page of the last search if text is empty.
+        """
+        if text:
+            self.log_search = self.search_logs(text, None if channel == STATUS_CHANNEL else channel)
+
+        if self.log_search is None:
+            return
+
+        lines = self.log_search.next_page()
+        if not lines and self.log_search.last_id is None:
+            self.add_system_message(channel, SEARCH_NO_RESULTS)
+
+        for line_channel, timestamp, nickname, message in lines:
+            date = time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp))
+            if message.startswith(ACTION_PREFIX) and message.endswith(u"\x01"):
+                self.add_system_message(channel, u"[%s] %s * %s %s" % (date, line_channel, nickname, message[len(ACTION_PREFIX):-1]))
+
+            else:
+                self.add_system_message(channel, u"[%s] %s <%s> %s" % (date, line_channel, nickname, message))
+
+        if self.log_search.has_more():
+            self.add_system_message(channel, SEARCH_MORE)
+
+        else:
+            self.log_search = None
+
+    def _scroll_changed(self, adjustment):
+        channel = self.current_channel
+        if channel is None or channel not in self.scrollbacks:
+            return
+
+        if adjustment.get_value() == adjustment.get_lower():
+            self.page_back_scrollback(channel)
+
+        elif adjustment.get_value() + adjustment.get_page_size() >= adjustment.get_upper():
+            self.trim_scrollback(channel)
+
+    def _flush_cb(self):
+        self.flush_id = None
+
+        for channel in self.pending.keys():
+            self.flush_channel(channel)
+
+        return False
+
+    def _destroy_cb(self, widget):
+        for scrollback in self.scrollbacks.values():
+            scrollback.close()
+
+        self.log_store.close()
+
+        shutil.rmtree(self.scrollback_dir, ignore_errors=True)
 
     def _query(self, widget, nickname):
         if nickname != self.nick:
@@ -319,10 +712,21 @@ class ChatBox(Gtk.VBox):
         self.emit("change-topic", self.current_channel, topic)
 
     def set_user_afk(self, nickname, afk):
-        for channel in self.nicks.keys():
-            if nickname in self.nicks[channel]:
-                self.nicks_listboxs[channel].set_afk(nickname, afk)
+        if afk:
+            self.afk.add(self.members.fold(nickname))
+
+        else:
+            self.afk.discard(self.members.fold(nickname))
+
+        for channel in self.members.get_channels(nickname):
+            if channel in self.nicks_listboxs:
+                self.nicks_listboxs[channel].set_afk(self.members.get(channel, nickname), afk)
 
     def set_user_mode(self, channel, usertype, nickname):
         if channel in self.channels:  # Nicknames aren't channels (/query nickname)
-            self.nicks_listboxs[channel].set_user_type(nickname, usertype)
+            stored = self.members.get(channel, nickname)
+            if stored is not None:
+                self.usertypes[channel][stored] = usertype
+
+            if channel in self.nicks_listboxs:
+                self.nicks_listboxs[channel].set_user_type(nickname, usertype)
@@ -19,8 +19,10 @@
 # Boston, MA 02111-1307, USA.
 
 import random
+from collections import deque
 
-from consts import ALL_CHANNELS, CURRENT_CHANNEL, UserType
+from consts import ALL_CHANNELS, CURRENT_CHANNEL, UserType, EventType
+from utils import parse_server_time
 
 from twisted.internet.error import ReactorAlreadyInstalledError
 
@@ -36,7 +38,14 @@ from twisted.internet import protocol
 from twisted.internet import ssl
 from twisted.internet import defer
 
-from gi.repository import GObject
+
+CAPABILITIES = ("batch", "server-time", "message-tags", "echo-message",
+                "multi-prefix", "userhost-in-names")
+ADMIN_PREFIXES = "~&@"
+
+JOIN_BATCH_LENGTH = 400  # Bytes of channel names in a single JOIN
+JOIN_BATCH_TARGETS = 10  # Channels in a single JOIN, unless the server has TARGMAX
+JOIN_BATCH_INTERVAL = 2  # Seconds between JOIN commands
 
 
 def get_random_nickname():
@@ -44,82 +53,128 @@ def get_random_nickname():
     return "Guest_" + "0" * (4 - len(number)) + number
 
 
-class Client(irc.IRCClient, GObject.GObject):
+class Client(irc.IRCClient):
 
     nickname = get_random_nickname()
     first_nickname = nickname
+    capabilities = CAPABILITIES
+    lineRate = 2  # Seconds per line, after a burst of lineBurst lines
+    lineBurst = 5
+
+    def start_client(self):
+        self.names_replies = {}  # Channel: list of (Nickname, UserType)
+        self.join_batches = deque()  # Lists of channels waiting to be joined
+        self.join_call = None
 
-    __gsignals__ = {
-        "signed-on": (GObject.SIGNAL_RUN_FIRST, None, []),
-        "joined": (GObject.SIGNAL_RUN_FIRST, None, [str]),  # Channel
-        "system-message": (GObject.SIGNAL_RUN_FIRST, None, [str, str]),  # Channel, Message
-        "user-message": (GObject.SIGNAL_RUN_FIRST, None, [str, str, str]),  # Channel, Nickname, Message
-        "nickname-changed": (GObject.SIGNAL_RUN_FIRST, None, [str]),  # Nickname
-        "user-nickname-changed": (GObject.SIGNAL_RUN_FIRST, None, [str, str]),  # Old nickname, New nickname
-        "user-joined": (GObject.SIGNAL_RUN_FIRST, None, [str, str]),  # Channel, Nickname
-        "user-left": (GObject.SIGNAL_RUN_FIRST, None, [str, str]),  # Channel, Nickname
-        "user-quit": (GObject.SIGNAL_RUN_FIRST, None, [str, str]),  # Nickname, Message
-        "user-kicked": (GObject.SIGNAL_RUN_FIRST, None, [str, str, str, str]),  # Channel, Nickname, Kicker, Message
-        "nicknames-list": (GObject.SIGNAL_RUN_FIRST, None, [str, str]),  # Channel, Nicknames list (splited by " ")
-        "me-command": (GObject.SIGNAL_RUN_FIRST, None, [str, str, str]), # Channel, Nickname, Message
-        "status-message": (GObject.SIGNAL_RUN_FIRST, None, [str]),  # Message
-        "topic-changed": (GObject.SIGNAL_RUN_FIRST, None, [str, str]),  # Channel, Topic
-        "mode-changed": (GObject.SIGNAL_RUN_FIRST, None, [str, str, str])  # Channel, UserType, Nickname
-    }
-
-    def start_gobject(self):
-        GObject.GObject.__init__(self)
-
-        self.__who_reply = []
-        self.__who_channel = None
+    def post(self, type, *args):
+        self.factory.post(type, *args)
 
     def signedOn(self):
-        self.emit("signed-on")
-        self.emit("status-message", _("== Signed on!"))
-        for c in self.factory.channels:
-            self.join(c)
+        self.factory.resetDelay()
+        self.post(EventType.SIGNED_ON)
+        self.post(EventType.STATUS_MESSAGE, _("== Signed on!"))
+        self.join_channels(self.factory.channels)
+
+    def connectionLost(self, reason):
+        if self.join_call is not None and self.join_call.active():
+            self.join_call.cancel()
+
+        self.join_call = None
+        irc.IRCClient.connectionLost(self, reason)
+
+    def join_channels(self, channels):
+        """
+        Joins channels with multi-target JOIN commands, sending one every
+        JOIN_BATCH_INTERVAL seconds so rejoining a lot of channels doesn't
+        flood the server.
+        """
+        targets = JOIN_BATCH_TARGETS
+        targmax = self.supported.getFeature("TARGMAX") or {}
+        if targmax.get("JOIN"):
+            targets = targmax["JOIN"]
+
+        # Channels are added to the last batch not sent yet, if any
+        batch = self.join_batches.pop() if self.join_batches else []
+        length = sum(len(channel) + 1 for channel in batch)
+
+        for channel in channels:
+            if channel[0] not in irc.CHANNEL_PREFIXES:
+                channel = "#" + channel
+
+            if batch and (len(batch) >= targets or length + len(channel) + 1 > JOIN_BATCH_LENGTH):
+                self.join_batches.append(batch)
+                batch = []
+                length = 0
+
+            batch.append(channel)
+            length += len(channel) + 1
+
+        if batch:
+            self.join_batches.append(batch)
+
+        if self.join_call is None:
+            self._join_next()
+
+    def _join_next(self):
+        self.join_call = None
+
+        if self.join_batches:
+            self.sendLine("JOIN " + ",".join(self.join_batches.popleft()))
+
+        if self.join_batches:
+            self.join_call = reactor.callLater(JOIN_BATCH_INTERVAL, self._join_next)
 
     def joined(self, channel):
-        self.emit("joined", channel)
-        self.emit("status-message", _("== Joined: ") + channel)
-        self.who(channel)
+        self.post(EventType.JOINED, channel)
+        self.post(EventType.STATUS_MESSAGE, _("== Joined: ") + channel)
+
+    def get_server_time(self):
+        """
+        Returns the time the message being handled was sent at, from its
+        server-time tag, or None if it has none.
+        """
+        return parse_server_time(self.currentTags.get("time"))
 
     def privmsg(self, user, channel, msg):
-        self.emit("user-message", channel, user.split("!")[0], msg)
+        self.post(EventType.USER_MESSAGE, channel, user.split("!")[0], msg, self.get_server_time())
+
+    def action(self, user, channel, data):
+        # Called by IRCClient for CTCP ACTION queries
+        self.post(EventType.ME_COMMAND, channel, user.split("!")[0], data or "", self.get_server_time())
 
     def nickChanged(self, nickname):
         self.nickname = nickname
-        self.emit("nickname-changed", nickname)
+        self.post(EventType.NICKNAME_CHANGED, nickname)
 
     def irc_NICK(self, prefix, params):
         old_nick = prefix.split("!")[0]
         new_nick = params[0]
-        self.emit("user-nickname-changed", old_nick, new_nick)
+        self.post(EventType.USER_NICKNAME_CHANGED, old_nick, new_nick)
 
     def irc_ERR_NICKNAMEINUSE(self, prefix, params):
         if params[0] != "*":
-            self.emit("system-message", ALL_CHANNELS, _("Nickname is already in use: %s") % params[1])
+            self.post(EventType.SYSTEM_MESSAGE, ALL_CHANNELS, _("Nickname is already in use: %s") % params[1])
 
         else:
             self.nickname = get_random_nickname()
             self.first_nickname = self.nickname
             self.set_nickname(self.nickname)
-            self.emit("nickname-changed", self.nickname)
+            self.post(EventType.NICKNAME_CHANGED, self.nickname)
 
     def alterCollidedNick(self, nickname):
         return (nickname + "^")
 
     def userJoined(self, nickname, channel):
-        self.emit("user-joined", channel, nickname)
+        self.post(EventType.USER_JOINED, channel, nickname)
 
     def userLeft(self, nickname, channel):
-        self.emit("user-left", channel, nickname)
+        self.post(EventType.USER_LEFT, channel, nickname)
 
     def userQuit(self, nickname, message):
-        self.emit("user-quit", nickname, message)
+        self.post(EventType.USER_QUIT, nickname, message)
 
     def userKicked(self, nickname, channel, kicker, message):
-        self.emit("user-kicked", channel, nickname, kicker, message)
+        self.post(EventType.USER_KICKED, channel, nickname, kicker, message)
 
     def close_channel(self, channel):
         self.leave(channel, "")
@@ -131,46 +186,47 @@ class Client(irc.IRCClient, GObject.GObject):
     def get_nickname(self):
         return self.nickname
 
-    def who(self, channel):
-        self.__who_reply = []
-        self.__who_channel = channel
-        self.sendLine("WHO %s" % channel)
+    def capabilitiesNegotiated(self, capabilities):
+        self.post(EventType.CAPABILITIES, capabilities)
 
-    def irc_RPL_WHOREPLY(self, server, data):
-        usertype = UserType.NORMAL
-        if data[6] == "H":
-            usertype = UserType.NORMAL
+    def ask_for_names(self, channel):
+        self.sendLine("NAMES %s" % channel)
 
-        elif data[6] == "H+":
-            usertype = UserType.MODERATOR
+    def get_prefix_symbols(self):
+        prefixes = self.supported.getFeature("PREFIX") or {}
+        return "".join(symbol for symbol, priority in prefixes.values())
 
-        elif data[6] == "H@":
+    def parse_names_member(self, member, symbols):
+        """
+        Parses a member of a NAMES reply, like "@+nick!user@host" (with the
+        multi-prefix and userhost-in-names capabilities) or just "@nick".
+        Returns a (nickname, usertype) tuple.
+        """
+        nickname = member.lstrip(symbols)
+        prefix = member[:len(member) - len(nickname)]
+        nickname = nickname.split("!", 1)[0]
+
+        usertype = UserType.NORMAL
+        if set(prefix) & set(ADMIN_PREFIXES):
             usertype = UserType.ADMIN
 
-        self.__who_reply.append(data[5] + "@" + usertype)
- 
-    def irc_RPL_ENDOFWHO(self, *nargs):
-        nicknames = ""
-        for nick in self.__who_reply:
-            nicknames += nick + " "
+        elif prefix:
+            usertype = UserType.MODERATOR
 
-        nicknames = nicknames[:-1]
+        return (nickname, usertype)
 
-        self.emit("nicknames-list", self.__who_channel, nicknames)
- 
-        self.__who_reply = []
-        self.__who_channel = None
+    def irc_RPL_NAMREPLY(self, prefix, params):
+        channel = params[2]
+        members = self.names_replies.setdefault(channel, [])
+        symbols = self.get_prefix_symbols()
 
-    def irc_PRIVMSG(self, prefix, params):
-        channel = params[0]
-        nickname = prefix.split("!")[0]
-        d = irc.ctcpExtract(params[1])
-        if d["extended"] != []:
-            message = d["extended"][0][1]
-            self.emit("me-command", channel, nickname, message)
+        for member in params[3].split():
+            members.append(self.parse_names_member(member, symbols))
 
-        else:
-            irc.IRCClient.irc_PRIVMSG(self, prefix, params)
+    def irc_RPL_ENDOFNAMES(self, prefix, params):
+        channel = params[1]
+        members = self.names_replies.pop(channel, [])
+        self.post(EventType.NICKNAMES_LIST, channel, members)
 
     def irc_unknown(self, prefix, command, params):
         pass
@@ -182,44 +238,49 @@ class Client(irc.IRCClient, GObject.GObject):
         self.describe(channel, message)
 
     def created(self, info):
-        self.emit("status-message", "== " + info)
+        self.post(EventType.STATUS_MESSAGE, "== " + info)
 
     def yourHost(self, info):
-        self.emit("status-message", "== " + info)
+        self.post(EventType.STATUS_MESSAGE, "== " + info)
 
     def luserClient(self, info):
-        self.emit("status-message", "== " + info)
+        self.post(EventType.STATUS_MESSAGE, "== " + info)
+
+    def isupport(self, options):
+        casemapping = self.supported.getFeature("CASEMAPPING")
+        if casemapping:
+            self.post(EventType.CASEMAPPING, casemapping[0])
 
     def luserMe(self, info):
-        self.emit("status-message", "== " + info)
+        self.post(EventType.STATUS_MESSAGE, "== " + info)
 
     def set_away(self, away, message=""):
         if away:
             self.away(message)
-            self.emit("system-message", ALL_CHANNELS, _("You have been marked as being away"))
+            self.post(EventType.SYSTEM_MESSAGE, ALL_CHANNELS, _("You have been marked as being away"))
 
         else:
             self.back()
-            self.emit("system-message", ALL_CHANNELS, _("You are no longer marked as being away"))
+            self.post(EventType.SYSTEM_MESSAGE, ALL_CHANNELS, _("You are no longer marked as being away"))
 
     def receivedMOTD(self, info):
         for line in info:
             line = "== " + line
-            self.emit("status-message", line)
+            self.post(EventType.STATUS_MESSAGE, line)
 
     def topicUpdated(self, nickname, channel, topic):
-        self.emit("topic-changed", channel, topic)
+        self.post(EventType.TOPIC_CHANGED, channel, topic)
 
         if "." not in nickname:
-            self.emit("system-message", channel, _("{nickname} changed the topic of {channel} to: {topic}").format(nickname=nickname, channel=channel, topic=topic))
+            self.post(EventType.SYSTEM_MESSAGE, channel, _("{nickname} changed the topic of {channel} to: {topic}").format(nickname=nickname, channel=channel, topic=topic))
 
     def noticed(self, nickname, mynickname, message):
-        self.emit("status-message", "== " + nickname.split("!")[0] + " " + message)
+        self.post(EventType.STATUS_MESSAGE, "== " + nickname.split("!")[0] + " " + message)
 
         if "You are now identified for" in message:
             new_nick = message.split(" ")[-1][1:-2]
-            self.emit("nickname-changed", new_nick)
-            self.emit("system-message", CURRENT_CHANNEL, _("You are now identified for {new_nick}").format(new_nick=new_nick))
+            self.post(EventType.NICKNAME_CHANGED, new_nick)
+            self.post(EventType.SYSTEM_MESSAGE, CURRENT_CHANNEL, _("You are now identified for {new_nick}").format(new_nick=new_nick))
 
     def modeChanged(self, user, channel, set, modes, args):
         usertype = UserType.NORMAL
@@ -244,69 +305,48 @@ class Client(irc.IRCClient, GObject.GObject):
         else:
             if args[0] != None:
                 message = _("{changer} puts mode {plusminus}{modes} to {args}").format(changer=changer, plusminus = "+" if set else "-", modes=modes, args=args[0])
-                self.emit("system-message", channel, message)
+                self.post(EventType.SYSTEM_MESSAGE, channel, message)
 
-        self.emit("mode-changed", channel, usertype, args[0])
+        self.post(EventType.MODE_CHANGED, channel, usertype, args[0])
 
 
-class ClientFactory(protocol.ClientFactory, GObject.GObject):
+class ClientFactory(protocol.ReconnectingClientFactory):
+    """
+    Reconnects with a jittered exponential backoff (see
+    ReconnectingClientFactory), reset once the client signs on again.
+    """
 
     protocol = Client
+    maxDelay = 300
 
-    __gsignals__ = {
-        "signed-on": (GObject.SIGNAL_RUN_FIRST, None, []),
-        "joined": (GObject.SIGNAL_RUN_FIRST, None, [str]),  # Channel
-        "system-message": (GObject.SIGNAL_RUN_FIRST, None, [str, str]),  # Channel, Message
-        "user-message": (GObject.SIGNAL_RUN_FIRST, None, [str, str, str]),  # Channel, Nickname, Message
-        "nickname-changed": (GObject.SIGNAL_RUN_FIRST, None, [str]),  # Nickname
-        "user-nickname-changed": (GObject.SIGNAL_RUN_FIRST, None, [str, str]),  # Old nickname, New nickname
-        "user-joined": (GObject.SIGNAL_RUN_FIRST, None, [str, str]),  # Channel, Nickname
-        "user-left": (GObject.SIGNAL_RUN_FIRST, None, [str, str]),  # Channel, Nickname
-        "user-quit": (GObject.SIGNAL_RUN_FIRST, None, [str, str]),  # Nickname, Message
-        "user-kicked": (GObject.SIGNAL_RUN_FIRST, None, [str, str, str, str]),  # Channel, Nickname, Kicker, Message
-        "nicknames-list": (GObject.SIGNAL_RUN_FIRST, None, [str, str]),  # Channel, Nicknames list (splited by " ")
-        "me-command": (GObject.SIGNAL_RUN_FIRST, None, [str, str, str]), # Channel, Nickname, Message
-        "status-message": (GObject.SIGNAL_RUN_FIRST, None, [str]),  # Message
-        "topic-changed": (GObject.SIGNAL_RUN_FIRST, None, [str, str]),  # Channel, Topic
-        "mode-changed": (GObject.SIGNAL_RUN_FIRST, None, [str, str, str])  # Channel, UserType, Nickname
-    }
-
-    def __init__(self, channels):
-        GObject.GObject.__init__(self)
-
+    def __init__(self, network, nickname, channels, bus):
+        self.network = network
+        self.nickname = nickname
         self.channels = channels
         self.client = None
+        self.connector = None
+        self.stopped = False
+        self.bus = bus  # EventBus shared by all the networks
 
     def buildProtocol(self, addr):
         self.client = Client()
         self.client.factory = self
-        self.client.start_gobject()
-
-        self.client.connect("signed-on", self._client_signed_on)
-        self.client.connect("joined", self._client_joined)
-        self.client.connect("system-message", self._client_system_message)
-        self.client.connect("user-message", self._client_user_message)
-        self.client.connect("nickname-changed", self._client_nickname_changed)
-        self.client.connect("user-nickname-changed", self._client_user_nickname_changed)
-        self.client.connect("user-joined", self._client_user_joined)
-        self.client.connect("user-left", self._client_left)
-        self.client.connect("user-quit", self._client_quit)
-        self.client.connect("user-kicked", self._client_kicked)
-        self.client.connect("nicknames-list", self._client_nicknames_list)
-        self.client.connect("me-command", self._client_me_command)
-        self.client.connect("status-message", self._client_status_message)
-        self.client.connect("topic-changed", self._client_topic_changed)
-        self.client.connect("mode-changed", self._client_mode_changed)
+        self.client.nickname = self.nickname
+        self.client.first_nickname = self.nickname
+        self.client.start_client()
 
         return self.client
 
+    def post(self, type, *args):
+        self.bus.post(self.network, type, *args)
+
     def add_channel(self, channel):
         if channel not in self.channels:
             self.channels.append(channel)
 
             if self.client is not None:
                 # TODO: check if client is joined
-                self.client.join(channel)
+                self.client.join_channels([channel])
 
     def remove_channel(self, channel):
         if channel in self.channels:
@@ -316,59 +356,30 @@ class ClientFactory(protocol.ClientFactory, GObject.GObject):
                 self.client.close_channel(channel)
 
     def clientConnectionLost(self, connector, reason):
-        self.emit("system-message", ALL_CHANNELS, _("Connection lost: {reason}").format(reason=reason))
-        connector.connect()
-
-    def clientConnectionFailed(self, connector, reason):
-        self.emit("system-message", ALL_CHANNELS, _("Connection failed: {reason}").format(reason=reason))
-
-    def start_connection(self, host, port):
-        self.emit("system-message", ALL_CHANNELS, _("Connecting to {host}:{port}").format(host=host, port=port))
-        reactor.connectTCP(host, port, self)
-        reactor.run()
-
-    def _client_signed_on(self, client):
-        self.emit("signed-on")
-
-    def _client_joined(self, client, channel):
-        self.emit("joined", channel)
-
-    def _client_system_message(self, client, channel, message):
-        self.emit("system-message", channel, message)
-
-    def _client_user_message(self, client, channel, nickname, message):
-        self.emit("user-message", channel, nickname, message)
-
-    def _client_nickname_changed(self, client, nick):
-        # TODO: send "user-nickname-changed" too
-        self.emit("nickname-changed", nick)
-
-    def _client_user_nickname_changed(self, client, old_nick, new_nick):
-        self.emit("user-nickname-changed", old_nick, new_nick)
-
-    def _client_user_joined(self, client, channel, nickname):
-        self.emit("user-joined", channel, nickname)
-
-    def _client_left(self, client, channel, nickname):
-        self.emit("user-left", channel, nickname)
+        self.client = None
+        if self.stopped:
+            return
 
-    def _client_quit(self, client, nickname, message):
-        self.emit("user-quit", nickname, message)
+        self.post(EventType.SYSTEM_MESSAGE, ALL_CHANNELS, _("Connection lost: {reason}").format(reason=reason))
+        protocol.ReconnectingClientFactory.clientConnectionLost(self, connector, reason)
 
-    def _client_kicked(self, client, channel, nickname, kicker, message):
-        self.emit("user-kicked", channel, nickname, kicker, message)
+    def clientConnectionFailed(self, connector, reason):
+        if self.stopped:
+            return
 
-    def _client_nicknames_list(self, client, channel, nicknames):
-        self.emit("nicknames-list", channel, nicknames)
+        self.post(EventType.SYSTEM_MESSAGE, ALL_CHANNELS, _("Connection failed: {reason}").format(reason=reason))
+        protocol.ReconnectingClientFactory.clientConnectionFailed(self, connector, reason)
 
-    def _client_me_command(self, client, channel, nickname, message):
-        self.emit("me-command", channel, nickname, message)
+    def start_connection(self, host, port):
+        self.post(EventType.SYSTEM_MESSAGE, ALL_CHANNELS, _("Connecting to {host}:{port}").format(host=host, port=port))
+        self.connector = reactor.connectTCP(host, port, self)
 
-    def _client_status_message(self, client, message):
-        self.emit("status-message", message)
+    def stop_connection(self):
+        self.stopped = True
+        self.stopTrying()
 
-    def _client_topic_changed(self, client, channel, topic):
-        self.emit("topic-changed", channel, topic)
+        if self.client is not None:
+            self.client.quit("")
 
-    def _client_mode_changed(self, client, channel, usertype, nickname):
-        self.emit("mode-changed", channel, usertype, nickname)
+        if self.connector is not None:
+            self.connector.disconnect()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014-2016, Cristian García <cristian99garcia@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+from client import ClientFactory
+from event_bus import EventBus
+
+from twisted.internet import reactor
+
+
+class ConnectionManager(object):
+    """
+    Keeps a ClientFactory for every network.  All of them share the same
+    reactor, started with the first connection, and post their events to
+    the same EventBus, tagged with their network.
+    """
+
+    def __init__(self):
+        self.bus = EventBus()
+        self.factories = { }  # Network: ClientFactory
+        self.running = False
+
+    def add_network(self, network, nickname):
+        if network not in self.factories:
+            self.factories[network] = ClientFactory(network, nickname, [], self.bus)
+
+        return self.factories[network]
+
+    def remove_network(self, network):
+        factory = self.factories.pop(network, None)
+        if factory is not None:
+            factory.stop_connection()
+
+    def get_factory(self, network):
+        return self.factories.get(network, None)
+
+    def get_networks(self):
+        return self.factories.keys()
+
+    def connect(self, network, host, port):
+        self.factories[network].start_connection(host, port)
+
+        if not self.running:
+            self.running = True
+            reactor.run()
@@ -51,6 +51,8 @@ LOST_CONNECTION = _('Lost connection with the server...')
 CONNECTION_ERROR = _('Error connecting to the server... closing the socket.')
 ALERT_TITLE = _('You already have a session on this host with this channel and with this nickname.')
 ALERT_MSG = _('Automatically selected session you tried to create.')
+SEARCH_MORE = _('Type /search to see older results.')
+SEARCH_NO_RESULTS = _('No results.')
 
 STATUS_CHANNEL = "status.polari"  # Users nicknames can't has a "."
 ALL_CHANNELS = "ALLCHANNELS"
@@ -66,6 +68,22 @@ MODERATOR_PIXBUF = GdkPixbuf.Pixbuf.new_from_file(os.path.join(ICONS_DIR, "moder
 NORMAL_PIXBUF = GdkPixbuf.Pixbuf.new_from_file(os.path.join(ICONS_DIR, "normal.png"))
 
 AFK_COUNT = 900000  # 15 minutes on miliseconds
+AFK_TICK = 30000  # 30 seconds on miliseconds, precision of AFK_COUNT
+
+SCROLLBACK_LINES = 2000  # Maximum lines kept in a channel buffer
+SCROLLBACK_CHUNK = 200  # Lines trimmed or paged back at once
+
+COMPLETION_SPEAKERS = 50  # Recent speakers of a channel ranked first on completion
+
+LOG_DIR = os.path.join(os.environ.get("SUGAR_ACTIVITY_ROOT", os.path.expanduser("~/.polari")), "data", "logs")
+LOG_SEGMENT_LINES = 10000  # Lines of every chat log file
+LOG_BATCH_LINES = 500  # Maximum lines written to the chat log at once
+LOG_BATCH_DELAY = 1  # Seconds waited for more lines before writing to the chat log
+LOG_FLUSH_TIMEOUT = 5  # Maximum seconds waited for the chat log to be written before searching it
+LOG_SEARCH_PAGE = 20  # Chat log search results shown at once
+ACTION_PREFIX = u"\x01ACTION "  # /me actions are logged as CTCP ACTIONs, ending with "\x01"
+
+LATE_MESSAGE_DELAY = 60  # Seconds after which a message is shown with its server time, as in a playback
 
 
 class Screen:
@@ -122,3 +140,23 @@ class UserType:
     ADMIN = "ADMIN"
     MODERATOR = "MODERATOR"
     NORMAL = "NORMAL"
+
+
+class EventType:
+    SIGNED_ON = "signed-on"
+    JOINED = "joined"  # Channel
+    SYSTEM_MESSAGE = "system-message"  # Channel, Message
+    USER_MESSAGE = "user-message"  # Channel, Nickname, Message, Server time or None
+    NICKNAME_CHANGED = "nickname-changed"  # Nickname
+    USER_NICKNAME_CHANGED = "user-nickname-changed"  # Old nickname, New nickname
+    USER_JOINED = "user-joined"  # Channel, Nickname
+    USER_LEFT = "user-left"  # Channel, Nickname
+    USER_QUIT = "user-quit"  # Nickname, Message
+    USER_KICKED = "user-kicked"  # Channel, Nickname, Kicker, Message
+    NICKNAMES_LIST = "nicknames-list"  # Channel, List of (Nickname, UserType)
+    ME_COMMAND = "me-command"  # Channel, Nickname, Message, Server time or None
+    STATUS_MESSAGE = "status-message"  # Message
+    TOPIC_CHANGED = "topic-changed"  # Channel, Topic
+    MODE_CHANGED = "mode-changed"  # Channel, UserType, Nickname
+    CASEMAPPING = "casemapping"  # Server CASEMAPPING
+    CAPABILITIES = "capabilities"  # Set of enabled capabilities
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014-2016, Cristian García <cristian99garcia@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+from collections import namedtuple
+
+from gi.repository import GObject
+
+
+Event = namedtuple("Event", ["network", "type", "args"])  # str, EventType, tuple
+
+
+class EventBus(GObject.GObject):
+    """
+    Collects the events posted by the IRC clients of all the networks and
+    delivers them all together, with a single "events" emission per main
+    loop iteration.
+    """
+
+    __gsignals__ = {
+        "events": (GObject.SIGNAL_RUN_FIRST, None, [object]),  # List of Event
+    }
+
+    def __init__(self):
+        GObject.GObject.__init__(self)
+
+        self.queue = []
+        self.flush_id = None
+
+    def post(self, network, type, *args):
+        self.queue.append(Event(network, type, args))
+
+        if self.flush_id is None:
+            self.flush_id = GObject.idle_add(self._flush_cb)
+
+    def flush(self):
+        if self.flush_id is not None:
+            GObject.source_remove(self.flush_id)
+
+        self._flush_cb()
+
+    def _flush_cb(self):
+        events = self.queue
+        self.queue = []
+        self.flush_id = None
+
+        if events:
+            self.emit("events", events)
+
+        return False
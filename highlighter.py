@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014-2016, Cristian García <cristian99garcia@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+from utils import URL_PATTERN
+
+
+class Highlighter(object):
+    """
+    Finds the URLs and the mentions of the watched words in a message.
+
+    The URLs are found with the precompiled URL pattern, and the words
+    with str.find: a single pattern alternating the URLs and the words
+    can't skip ahead to a literal prefix, so it is slower than both
+    searches together (see benchmarks/highlighting.py).
+    """
+
+    def __init__(self, words=[]):
+        self.words = []
+
+        self.set_words(words)
+
+    def set_words(self, words):
+        # Longest words first, so a word doesn't shadow a longer one
+        self.words = sorted(set(word for word in words if word), key=len, reverse=True)
+
+    def get_spans(self, text, mentions=True):
+        """
+        Returns a list of (start, end, tag) tuples, where tag is "url" or
+        "mention", and start and end are offsets in text, sorted and not
+        overlapping.  Mentions inside URLs are ignored.
+        """
+        spans = []
+        if "http" in text:  # Most messages have no URL
+            spans = [(match.start(), match.end(), "url") for match in URL_PATTERN.finditer(text)]
+
+        if not mentions:
+            return spans
+
+        found = False
+        for word in self.words:
+            start = text.find(word)
+            while start != -1:
+                end = start + len(word)
+                if not any(start < span[1] and span[0] < end for span in spans):
+                    spans.append((start, end, "mention"))
+                    found = True
+
+                start = text.find(word, end)
+
+        if found:
+            spans.sort()
+
+        return spans
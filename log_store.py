@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014-2016, Cristian García <cristian99garcia@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import re
+import json
+import time
+import Queue
+import urllib
+import sqlite3
+import threading
+import traceback
+
+from consts import LOG_SEGMENT_LINES, LOG_BATCH_LINES, LOG_BATCH_DELAY, LOG_FLUSH_TIMEOUT, LOG_SEARCH_PAGE
+from utils import to_unicode
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lines (
+    id INTEGER PRIMARY KEY,
+    channel TEXT,
+    segment INTEGER,
+    offset INTEGER
+);
+CREATE INDEX IF NOT EXISTS lines_segment ON lines (channel, segment);
+CREATE VIRTUAL TABLE IF NOT EXISTS words USING fts4(content="", text);
+"""
+
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+class LogStore(object):
+    """
+    History of the channels of a network, kept across sessions.
+
+    The lines of every channel are appended to segment files of
+    LOG_SEGMENT_LINES lines (one JSON list per line), which are never
+    rewritten.  The words of every line are indexed in a contentless
+    SQLite FTS4 table, next to the position of the line in its segment,
+    so a search reads from disk only the lines it returns.
+
+    The lines are written by a thread, in batches of up to
+    LOG_BATCH_LINES lines or LOG_BATCH_DELAY seconds, so logging a
+    message never blocks the main loop.  A batch that can't be written
+    (a full disk, a locked index) is lost, and the next ones are still
+    tried.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.queue = Queue.Queue()
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self.database = self._connect()  # Used by the main thread, to search
+        self.database.executescript(SCHEMA)
+
+        self.thread = threading.Thread(target=self._write_cb)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def append(self, channel, nickname, message, timestamp=None):
+        """
+        Queues a line to be written, sent at timestamp (the server time of
+        the message, when the server gives it) or now.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        self.queue.put((to_unicode(channel), timestamp, to_unicode(nickname), to_unicode(message)))
+
+    def flush(self):
+        """
+        Waits until all the appended lines are written, or for
+        LOG_FLUSH_TIMEOUT seconds at most, and returns whether they were.
+        """
+        if not self.thread.is_alive():
+            return False
+
+        written = threading.Event()
+        self.queue.put(written)
+        return written.wait(LOG_FLUSH_TIMEOUT)
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+        self.database.close()
+
+    def search(self, text, channel=None):
+        """
+        Returns a LogSearch of the lines containing all the words of text,
+        in channel or in all the channels, the most recent first.
+        """
+        return LogSearch(self, text, channel)
+
+    def get_segment_path(self, channel, segment):
+        return os.path.join(self.path, urllib.quote(channel.encode("utf-8"), safe=""), "%08d.log" % segment)
+
+    def read_lines(self, rows):
+        """
+        Reads from the segments the lines of (channel, segment, offset)
+        rows, and returns a list of (channel, time, nickname, message)
+        tuples.
+        """
+        lines = [ ]
+        files = { }  # Path: file
+
+        for channel, segment, offset in rows:
+            path = self.get_segment_path(channel, segment)
+            if path not in files:
+                files[path] = open(path, "rb")
+
+            file = files[path]
+            file.seek(offset)
+            lines.append(tuple([channel] + json.loads(file.readline())))
+
+        for file in files.values():
+            file.close()
+
+        return lines
+
+    def _connect(self):
+        database = sqlite3.connect(os.path.join(self.path, "index.db"))
+        database.execute("PRAGMA journal_mode=WAL")  # Searches don't wait for the writes
+        return database
+
+    def _write_cb(self):
+        database = self._connect()
+        segments = { }  # Channel: [segment, lines, file]
+
+        while True:
+            items = [self.queue.get()]
+            deadline = time.time() + LOG_BATCH_DELAY
+
+            while len(items) < LOG_BATCH_LINES and isinstance(items[-1], tuple):
+                try:
+                    items.append(self.queue.get(timeout=max(0, deadline - time.time())))
+
+                except Queue.Empty:
+                    break
+
+            lines = [item for item in items if isinstance(item, tuple)]
+            if lines:
+                try:
+                    self._write_lines(database, segments, lines)
+
+                except Exception:
+                    traceback.print_exc()
+
+            if items[-1] is None:
+                break
+
+            elif not isinstance(items[-1], tuple):
+                items[-1].set()  # Waited by flush
+
+        for segment, count, file in segments.values():
+            file.close()
+
+        database.close()
+
+    def _write_lines(self, database, segments, lines):
+        """
+        Appends the lines to their segments, and then indexes them all in
+        a single transaction, so an indexed line is always on disk.
+        """
+        rows = [ ]
+
+        for channel, timestamp, nickname, message in lines:
+            if channel not in segments:
+                segments[channel] = self._open_last_segment(database, channel)
+
+            current = segments[channel]
+            if current[1] >= LOG_SEGMENT_LINES:
+                current[2].close()
+                current[0] += 1
+                current[1] = 0
+                current[2] = open(self.get_segment_path(channel, current[0]), "ab")
+
+            file = current[2]
+            file.seek(0, os.SEEK_END)
+            rows.append((channel, current[0], file.tell(), nickname + u" " + message))
+            file.write(json.dumps([timestamp, nickname, message]) + "\n")
+            current[1] += 1
+
+        for segment, count, file in segments.values():
+            file.flush()
+
+        with database:
+            for channel, segment, offset, text in rows:
+                cursor = database.execute("INSERT INTO lines (channel, segment, offset) VALUES (?, ?, ?)", (channel, segment, offset))
+                database.execute("INSERT INTO words (docid, text) VALUES (?, ?)", (cursor.lastrowid, text))
+
+    def _open_last_segment(self, database, channel):
+        row = database.execute("SELECT MAX(segment) FROM lines WHERE channel = ?", (channel,)).fetchone()
+        segment = row[0] or 0
+        count = database.execute("SELECT COUNT(*) FROM lines WHERE channel = ? AND segment = ?", (channel, segment)).fetchone()[0]
+
+        path = self.get_segment_path(channel, segment)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        return [segment, count, open(path, "ab")]
+
+
+class LogSearch(object):
+    """
+    The results of a search in a LogStore, read a page at a time: every
+    call to next_page looks up the next LOG_SEARCH_PAGE matching lines,
+    older than the last ones returned.
+    """
+
+    def __init__(self, store, text, channel=None, page_size=LOG_SEARCH_PAGE):
+        self.store = store
+        self.channel = to_unicode(channel) if channel is not None else None
+        self.page_size = page_size
+        self.last_id = None  # Id of the oldest line returned
+
+        # Every word quoted, so the text can't be taken as FTS syntax
+        words = WORD_PATTERN.findall(to_unicode(text))
+        self.query = u" ".join(u'"%s"' % word for word in words)
+        self.finished = not words
+
+    def has_more(self):
+        return not self.finished
+
+    def next_page(self):
+        """
+        Returns the next page of results, as a list of (channel, time,
+        nickname, message) tuples, the most recent first.
+        """
+        if self.finished:
+            return [ ]
+
+        sql = "SELECT lines.id, channel, segment, offset FROM words JOIN lines ON lines.id = words.docid WHERE words MATCH ?"
+        parameters = [self.query]
+
+        if self.channel is not None:
+            sql += " AND channel = ?"
+            parameters.append(self.channel)
+
+        if self.last_id is not None:
+            sql += " AND lines.id < ?"
+            parameters.append(self.last_id)
+
+        sql += " ORDER BY lines.id DESC LIMIT ?"
+        parameters.append(self.page_size)
+
+        rows = self.store.database.execute(sql, parameters).fetchall()
+        if len(rows) < self.page_size:
+            self.finished = True
+
+        if rows:
+            self.last_id = rows[-1][0]
+
+        return self.store.read_lines([row[1:] for row in rows])
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014-2016, Cristian García <cristian99garcia@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import string
+from bisect import bisect_left, insort
+
+
+CASEMAPPINGS = {
+    "ascii": string.maketrans(string.ascii_uppercase, string.ascii_lowercase),
+    "rfc1459": string.maketrans(string.ascii_uppercase + "[]\\~", string.ascii_lowercase + "{}|^"),
+    "strict-rfc1459": string.maketrans(string.ascii_uppercase + "[]\\", string.ascii_lowercase + "{}|"),
+}
+
+DEFAULT_CASEMAPPING = "rfc1459"
+
+
+class MemberRegistry(object):
+    """
+    Members of every channel, keyed by the nickname folded with the server
+    CASEMAPPING, and the channels of every nickname, so a user can be found
+    (or removed) without looking in all the channels.
+
+    The keys of every channel are also kept sorted, so the members starting
+    with a prefix are found with a binary search (for the completion).
+    """
+
+    def __init__(self):
+        self.table = CASEMAPPINGS[DEFAULT_CASEMAPPING]
+        self.members = { }  # Channel: {key: nickname}
+        self.nick_channels = { }  # Key: set of channels
+        self.sorted_keys = { }  # Channel: sorted list of keys
+
+    def set_casemapping(self, casemapping):
+        self.table = CASEMAPPINGS.get(casemapping, CASEMAPPINGS[DEFAULT_CASEMAPPING])
+
+        members = self.members
+        self.members = { }
+        self.nick_channels = { }
+        self.sorted_keys = { }
+
+        for channel, nicknames in members.items():
+            self.set_members(channel, nicknames.values())
+
+    def fold(self, nickname):
+        if isinstance(nickname, unicode):
+            nickname = nickname.encode("utf-8")
+
+        return nickname.translate(self.table)
+
+    def add_channel(self, channel):
+        if channel not in self.members:
+            self.members[channel] = { }
+            self.sorted_keys[channel] = [ ]
+
+    def remove_channel(self, channel):
+        self.sorted_keys.pop(channel, None)
+        for key in self.members.pop(channel, { }).keys():
+            self._unlink(key, channel)
+
+    def set_members(self, channel, nicknames):
+        self.remove_channel(channel)
+        self.add_channel(channel)
+
+        members = self.members[channel]
+        for nickname in nicknames:
+            key = self.fold(nickname)
+            members[key] = nickname
+            self.nick_channels.setdefault(key, set()).add(channel)
+
+        # Sorting once is cheaper than inserting every member in order
+        self.sorted_keys[channel] = sorted(members)
+
+    def add(self, channel, nickname):
+        key = self.fold(nickname)
+        self.add_channel(channel)
+
+        if key not in self.members[channel]:
+            insort(self.sorted_keys[channel], key)
+
+        self.members[channel][key] = nickname
+        self.nick_channels.setdefault(key, set()).add(channel)
+
+    def remove(self, channel, nickname):
+        """
+        Removes nickname from channel, and returns the nickname as it was
+        stored, or None if it wasn't there.
+        """
+        key = self.fold(nickname)
+        if key not in self.members.get(channel, { }):
+            return None
+
+        self._unlink(key, channel)
+        self._unsort(key, channel)
+        return self.members[channel].pop(key)
+
+    def quit(self, nickname):
+        """
+        Removes nickname from all the channels, and returns a list of
+        (channel, stored nickname) tuples.
+        """
+        key = self.fold(nickname)
+        removed = [ ]
+
+        for channel in self.nick_channels.pop(key, set()):
+            self._unsort(key, channel)
+            removed.append((channel, self.members[channel].pop(key)))
+
+        return removed
+
+    def rename(self, old_nick, new_nick):
+        """
+        Renames a nickname in all its channels, and returns a list of
+        (channel, old stored nickname) tuples.
+        """
+        removed = self.quit(old_nick)
+
+        for channel, nickname in removed:
+            self.add(channel, new_nick)
+
+        return removed
+
+    def get(self, channel, nickname):
+        return self.members.get(channel, { }).get(self.fold(nickname))
+
+    def has(self, channel, nickname):
+        return self.fold(nickname) in self.members.get(channel, { })
+
+    def get_members(self, channel):
+        return self.members.get(channel, { }).values()
+
+    def get_channels(self, nickname):
+        return self.nick_channels.get(self.fold(nickname), set())
+
+    def get_members_with_prefix(self, channel, prefix):
+        """
+        Returns the nicknames of channel starting with prefix, compared
+        with the server CASEMAPPING, in order.
+        """
+        prefix = self.fold(prefix)
+        keys = self.sorted_keys.get(channel, [ ])
+        members = self.members.get(channel, { })
+        nicknames = [ ]
+
+        for index in xrange(bisect_left(keys, prefix), len(keys)):
+            if not keys[index].startswith(prefix):
+                break
+
+            nicknames.append(members[keys[index]])
+
+        return nicknames
+
+    def _unsort(self, key, channel):
+        keys = self.sorted_keys[channel]
+        index = bisect_left(keys, key)
+        if index < len(keys) and keys[index] == key:
+            del keys[index]
+
+    def _unlink(self, key, channel):
+        channels = self.nick_channels.get(key)
+        if channels is not None:
+            channels.discard(channel)
+
+            if not channels:
+                del self.nick_channels[key]
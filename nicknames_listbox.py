@@ -18,6 +18,8 @@
 # Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 # Boston, MA 02111-1307, USA.
 
+import bisect
+
 from consts import Color, SUGAR, ADMIN_PIXBUF, MODERATOR_PIXBUF, \
                    NORMAL_PIXBUF, UserType, UserState
 
@@ -30,6 +32,9 @@ from gi.repository import Pango
 from gi.repository import GObject
 
 
+ROLES = (UserType.ADMIN, UserType.MODERATOR, UserType.NORMAL)
+
+
 class NicknamesListBox(Gtk.ScrolledWindow):
 
     __gsignals__ = {
@@ -39,17 +44,15 @@ class NicknamesListBox(Gtk.ScrolledWindow):
     def __init__(self):
         Gtk.ScrolledWindow.__init__(self)
 
-        self.nicknames = []
-        self.admins = []
-        self.moderators = []
-        self.normals = []
-        self.model = Gtk.ListStore(str, str, str)  # Type, Nickname, State
+        self.usertypes = {}  # Nickname: UserType
+        self.rows = {}  # Nickname: Gtk.TreeRowReference
+        self.roles = {}  # UserType: sorted list of (key, nickname)
+        self.model = None
         self.selected_nickname = None
 
         self.set_size_request(150, 1)
 
         self.view = Gtk.TreeView()
-        self.view.set_model(self.model)
         self.view.set_headers_visible(False)
         self.view.add_events(Gdk.EventMask.BUTTON_PRESS_MASK)
         self.view.connect("button-press-event", self._button_press)
@@ -66,6 +69,8 @@ class NicknamesListBox(Gtk.ScrolledWindow):
 
         self.view.append_column(column)
 
+        self.clear()
+
         self.menu = Gtk.Menu()
 
         item = Gtk.MenuItem("Query")
@@ -87,86 +92,95 @@ class NicknamesListBox(Gtk.ScrolledWindow):
     def __get_tree_text(self, col, cell, model, iter, user_data):
         cell.set_property("text", self.model.get_value(iter, 1))
 
-    def set_list(self, nicknames):
-        self.clear()
-        nicknames.sort()
+    def set_list(self, members):
+        """
+        Replaces all the nicknames with members, a list of (nickname,
+        usertype) tuples.  The new model is filled while detached from the
+        view and then swapped in at once.
+        """
+        self.clear_index()
 
-        for nick in nicknames:
-            usertype = UserType.NORMAL
-            if "@" in nick:
-                nick, usertype = nick.split("@")
+        for nick, usertype in members:
+            if nick in self.usertypes:
+                continue
 
-            self.add_nickname(nick, usertype)
+            self.usertypes[nick] = usertype
+            self.roles[usertype].append((nick.lower(), nick))
 
-    def clear(self):
-        while len(self.nicknames) > 0:
-            for item in self.nicknames:
-                self.nicknames.remove(item)
+        model = Gtk.ListStore(str, str, str)  # Type, Nickname, State
+        for usertype in ROLES:
+            self.roles[usertype].sort()
 
-        self.model.clear()
+            for key, nick in self.roles[usertype]:
+                iter = model.append([usertype, nick, UserState.ACTIVE])
+                self.rows[nick] = Gtk.TreeRowReference.new(model, model.get_path(iter))
 
-    def add_nickname(self, nickname, usertype=None):
-        self.nicknames.append(nickname)
-        self.nicknames = sorted(self.nicknames, key=str.lower)
+        self.model = model
+        self.view.set_model(self.model)
+        self.show_all()
 
-        usertype = UserType.NORMAL if usertype == None else usertype
+    def clear(self):
+        self.clear_index()
+
+        self.model = Gtk.ListStore(str, str, str)  # Type, Nickname, State
+        self.view.set_model(self.model)
+
+    def clear_index(self):
+        self.usertypes = {}
+        self.rows = {}
+        self.roles = dict((usertype, []) for usertype in ROLES)
+
+    def get_index(self, nickname, usertype):
+        """
+        Returns the position on the model where nickname goes, keeping
+        admins first, then moderators and then normal users, sorted by
+        nickname.
+        """
         idx = 0
+        for role in ROLES:
+            if role == usertype:
+                return idx + bisect.bisect_left(self.roles[role], (nickname.lower(), nickname))
 
-        if usertype == UserType.ADMIN:
-            self.admins.append(nickname)
-            self.admins = sorted(self.admins, key=str.lower)
-            idx = self.admins.index(nickname)
+            idx += len(self.roles[role])
 
-        elif usertype == UserType.MODERATOR:
-            self.moderators.append(nickname)
-            self.moderators = sorted(self.moderators, key=str.lower)
-            idx = len(self.admins) + self.moderators.index(nickname)
+    def add_nickname(self, nickname, usertype=None):
+        if nickname in self.usertypes:
+            return
 
-        elif usertype == UserType.NORMAL:
-            self.normals.append(nickname)
-            self.normals = sorted(self.normals, key=str.lower)
-            idx = len(self.admins) + len(self.moderators) + self.normals.index(nickname)
+        usertype = UserType.NORMAL if usertype == None else usertype
+        idx = self.get_index(nickname, usertype)
+
+        bisect.insort(self.roles[usertype], (nickname.lower(), nickname))
+        self.usertypes[nickname] = usertype
 
-        data = [usertype, nickname, UserState.ACTIVE]
-        self.model.insert(idx, data)
+        iter = self.model.insert(idx, [usertype, nickname, UserState.ACTIVE])
+        self.rows[nickname] = Gtk.TreeRowReference.new(self.model, self.model.get_path(iter))
         self.show_all()
 
     def remove_nickname(self, nickname):
-        iter = self.model.get_iter_first()
-        if self.model.get_value(iter, 1) == nickname:
-            self.model.remove(iter)
-
-        else:
-            while self.model.iter_next(iter):
-                iter = self.model.iter_next(iter)
-                if self.model.get_value(iter, 1) == nickname:
-                    self.model.remove(iter)
-                    break
-
-        self.nicknames.remove(nickname)
-        if nickname in self.admins:
-            self.admins.remove(nickname)
+        if nickname not in self.usertypes:
+            return
 
-        elif nickname in self.moderators:
-            self.moderators.remove(nickname)
+        usertype = self.usertypes.pop(nickname)
+        role = self.roles[usertype]
+        idx = bisect.bisect_left(role, (nickname.lower(), nickname))
+        del role[idx]
 
-        elif nickname in self.normals:
-            self.normals.remove(nickname)
+        path = self.rows.pop(nickname).get_path()
+        self.model.remove(self.model.get_iter(path))
 
     def set_user_type(self, nickname, type):
-        if nickname not in self.nicknames:
+        if nickname not in self.usertypes:
             return
 
         self.remove_nickname(nickname)
         self.add_nickname(nickname, type)
 
     def set_afk(self, nickname, afk):
-        if nickname not in self.nicknames:
+        if nickname not in self.rows:
             return
 
-        nicks = self.admins + self.moderators + self.normals
-        idx = nicks.index(nickname)
-        iter = self.model.get_iter(idx)
+        iter = self.model.get_iter(self.rows[nickname].get_path())
         state = UserState.ACTIVE if not afk else UserState.AFK
         self.model.set_value(iter, 2, state)
 
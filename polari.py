@@ -86,6 +86,9 @@ class PolariActivity(activity.Activity):
         self.metadata["port"] = screen.port.get_value()
         self.metadata["channel"] = screen.channels.get_value()
 
+        # The history is kept in the activity data, not in the journal
+        self.polari.flush_logs()
+
     def read_metadata(self):
         screen = self.polari.channel_screen
 
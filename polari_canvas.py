@@ -18,12 +18,14 @@
 # Free Software Foundation, Inc., 59 Temple Place - Suite 330,
 # Boston, MA 02111-1307, USA.
 
+import traceback
+
 from new_channel_screen import NewChannelScreen
 from channels_listbox import ChannelsListBox
-from chat_box import ChatBox
-from consts import Screen, STATUS_CHANNEL, ALL_CHANNELS, CURRENT_CHANNEL, UserType
-from client import ClientFactory
-from afk_manager import AFKManager
+from consts import Screen, STATUS_CHANNEL, ALL_CHANNELS, CURRENT_CHANNEL, UserType, \
+                   EventType, DEFAULT_PORT
+from connection_manager import ConnectionManager
+from session import Session
 
 import gi
 gi.require_version("Gtk", "3.0")
@@ -38,26 +40,30 @@ class PolariCanvas(Gtk.VBox):
         Gtk.VBox.__init__(self)
 
         self.screen = None
-
-        self.factory = ClientFactory([])
-        self.factory.connect("signed-on", self._signed_on)
-        self.factory.connect("joined", self._joined)
-        self.factory.connect("system-message", self._system_message)
-        self.factory.connect("user-message", self._user_message)
-        self.factory.connect("nickname-changed", self._nickname_changed)
-        self.factory.connect("user-nickname-changed", self._user_nickname_changed)
-        self.factory.connect("user-joined", self._user_joined)
-        self.factory.connect("user-left", self._user_left)
-        self.factory.connect("user-quit", self._user_quit)
-        self.factory.connect("nicknames-list", self._nicknames)
-        self.factory.connect("me-command", self._me_command)
-        self.factory.connect("status-message", self._status_message)
-        self.factory.connect("topic-changed", self._topic_changed)
-        self.factory.connect("mode-changed", self._mode_changed)
-
-        self.afk_manager = AFKManager()
-        self.afk_manager.connect("user-afk", self._user_afk)
-        self.afk_manager.connect("user-back", self._user_back)
+        self.session = None  # Session of the ChatBox being shown
+        self.sessions = { }  # Network: Session
+
+        self.manager = ConnectionManager()
+        self.manager.bus.connect("events", self._events)
+
+        self.event_handlers = {
+            EventType.SIGNED_ON: self._signed_on,
+            EventType.JOINED: self._joined,
+            EventType.SYSTEM_MESSAGE: self._system_message,
+            EventType.USER_MESSAGE: self._user_message,
+            EventType.NICKNAME_CHANGED: self._nickname_changed,
+            EventType.USER_NICKNAME_CHANGED: self._user_nickname_changed,
+            EventType.USER_JOINED: self._user_joined,
+            EventType.USER_LEFT: self._user_left,
+            EventType.USER_QUIT: self._user_quit,
+            EventType.NICKNAMES_LIST: self._nicknames,
+            EventType.ME_COMMAND: self._me_command,
+            EventType.STATUS_MESSAGE: self._status_message,
+            EventType.TOPIC_CHANGED: self._topic_changed,
+            EventType.MODE_CHANGED: self._mode_changed,
+            EventType.CASEMAPPING: self._casemapping,
+            EventType.CAPABILITIES: self._capabilities,
+        }
 
         self.channel_screen = NewChannelScreen()
         self.channel_screen.connect("log-in", self._log_in)
@@ -70,14 +76,6 @@ class PolariCanvas(Gtk.VBox):
         self.channels_listbox.connect("channel-removed", self._channel_removed)
         self.chat_screen.pack_start(self.channels_listbox, False, False, 0)
 
-        self.chat_box = ChatBox()
-        self.chat_box.connect("send-message", self._send_message)
-        self.chat_box.connect("command", self.run_command)
-        self.chat_box.connect("change-nickname", self._change_nickname)
-        self.chat_box.connect("query", self._query)
-        self.chat_box.connect("change-topic", self._change_topic)
-        self.chat_screen.pack_start(self.chat_box, True, True, 0)
-
         self.set_screen(Screen.NEW_CHANNEL)
 
     def set_screen(self, screen):
@@ -100,46 +98,109 @@ class PolariCanvas(Gtk.VBox):
 
         self.show_all()
 
-    def _send_message(self, widget, channel, message):
-        self.send_message(channel, message)
+    def add_network(self, network, nickname):
+        """
+        Creates the Session of a network, if it doesn't exist yet, with a
+        status tab in the channels list.
+        """
+        if network in self.sessions:
+            return self.sessions[network]
+
+        session = Session(self.manager.add_network(network, nickname))
+        self.sessions[network] = session
+
+        session.afk_manager.connect("user-afk", self._user_afk, session)
+        session.afk_manager.connect("user-back", self._user_back, session)
+
+        chat_box = session.chat_box
+        chat_box.set_nickname(nickname)
+        chat_box.connect("send-message", self._send_message, session)
+        chat_box.connect("command", self.run_command, session)
+        chat_box.connect("change-nickname", self._change_nickname, session)
+        chat_box.connect("query", self._query, session)
+        chat_box.connect("change-topic", self._change_topic, session)
+
+        self.show_session(session)
+        self.channels_listbox.add_network(network)
+
+        return session
+
+    def show_session(self, session):
+        if session == self.session:
+            return
+
+        if self.session is not None:
+            self.chat_screen.remove(self.session.chat_box)
+
+        self.session = session
+        self.chat_screen.pack_start(self.session.chat_box, True, True, 0)
+        self.show_all()
+
+    def flush_logs(self):
+        for session in self.sessions.values():
+            session.log_store.flush()
+
+    def connect_network(self, session, host, port):
+        self.set_screen(Screen.CHAT)
+
+        session.chat_box.add_system_message(STATUS_CHANNEL, _("Logging in, please wait"))
+        self.manager.connect(session.network, host, port)
+
+    def _send_message(self, widget, channel, message, session):
+        self.send_message(session, channel, message)
 
-    def send_message(self, channel, message):
-        self.factory.client.msg(channel, message)
+    def send_message(self, session, channel, message):
+        session.factory.client.msg(channel, message)
 
-    def _change_nickname(self, widget, new_nickname):
-        self.change_nickname(new_nickname)
+    def _change_nickname(self, widget, new_nickname, session):
+        self.change_nickname(session, new_nickname)
 
-    def change_nickname(self, new_nickname):
-        self.factory.client.set_nickname(new_nickname)
+    def change_nickname(self, session, new_nickname):
+        session.factory.client.set_nickname(new_nickname)
 
-    def _query(self, widget, nickname):
-        self.query(nickname)
+    def _query(self, widget, nickname, session):
+        self.query(session, nickname)
 
-    def query(self, nickname):
-        self.new_channel(nickname, add_hash=False)
+    def query(self, session, nickname):
+        self.new_channel(session, nickname, add_hash=False)
 
-    def _change_topic(self, widget, channel, topic):
-        self.change_topic(channel, topic)
+    def _change_topic(self, widget, channel, topic, session):
+        self.change_topic(session, channel, topic)
 
-    def change_topic(self, channel, topic):
-        self.factory.client.topic(channel, topic)
+    def change_topic(self, session, channel, topic):
+        session.factory.client.topic(channel, topic)
+
+    def run_command(self, widget, channel, command, parameters="", session=None):
+        chat_box = session.chat_box
 
-    def run_command(self, widget, channel, command, parameters=""):
         if command == "/join":
             for channel in parameters.split(" "):
                 if channel.strip() != "":
-                    self.new_channel(channel)
+                    self.new_channel(session, channel)
+
+        elif command == "/server":
+            if parameters.strip() != "":
+                host = parameters.split(" ")[0]
+                port = parameters.split(" ")[-1]
+                port = int(port) if port.isdigit() else int(DEFAULT_PORT)
+
+                if host in self.sessions:
+                    self.channels_listbox.select_item_from_string(host, STATUS_CHANNEL)
+
+                else:
+                    self.connect_network(self.add_network(host, session.get_nickname()), host, port)
 
         elif command == "/msg":
             if parameters.split(" ")[0].lower() != "nickserv":
                 nickname = parameters.split(" ")[0]
                 message = parameters[len(nickname) + 1:]
 
-                if nickname not in self.chat_box.channels:
-                    self.new_channel(nickname, add_hash=False)
+                if nickname not in chat_box.channels:
+                    self.new_channel(session, nickname, add_hash=False)
 
-                self.send_message(nickname, message)
-                self.chat_box.add_message_to_view(nickname, self.factory.client.get_nickname(), message, force=True)
+                self.send_message(session, nickname, message)
+                if not chat_box.echo_message:
+                    chat_box.add_message_to_view(nickname, session.get_nickname(), message, force=True)
 
             else:
                 nickserv = parameters.split(" ")[0]
@@ -147,184 +208,222 @@ class PolariCanvas(Gtk.VBox):
 
                 if action == "identify" and len(parameters.split(" ")) == 3:
                     password = parameters.split(" ")[2]
-                    self.send_message("NickServ", "identify %s" % password)
+                    self.send_message(session, "NickServ", "identify %s" % password)
 
                 elif action == "identify" and len(parameters.split(" ")) == 4:
                     nickname = parameters.split(" ")[2]
                     password = parameters.split(" ")[3]
-                    self.send_message("NickServ", "identify %s %s" % (nickname, password))
+                    self.send_message(session, "NickServ", "identify %s %s" % (nickname, password))
 
         elif command == "/query":
             nickname = parameters.split(" ")[0]
 
-            if nickname not in self.chat_box.channels:
-                self.new_channel(nickname, add_hash=False)
+            if nickname not in chat_box.channels:
+                self.new_channel(session, nickname, add_hash=False)
 
         elif command == "/nick":
-            self.change_nickname(parameters)
+            self.change_nickname(session, parameters)
 
         elif command == "/names":
-            self.factory.client.ask_for_names(channel)
+            session.factory.client.ask_for_names(channel)
 
         elif command == "/me":
-            self.factory.client.me(channel, parameters)
-            self._me_command(None, channel, self.factory.client.get_nickname(), parameters)
+            session.factory.client.me(channel, parameters)
+            if not chat_box.echo_message:
+                self._me_command(session, channel, session.get_nickname(), parameters)
 
         elif command == "/topic":
-            self.change_topic(channel, parameters)
+            self.change_topic(session, channel, parameters)
 
         elif command == "/away":
-            self.factory.client.set_away(True, parameters)
+            session.factory.client.set_away(True, parameters)
 
         elif command == "/back":
-            self.factory.client.set_away(False)
+            session.factory.client.set_away(False)
+
+        elif command == "/search":
+            chat_box.show_search_results(channel, parameters)
 
     def _log_in(self, widget, nick, host, channel, port):
         self.set_screen(Screen.CHAT)
-        self.chat_box.set_nickname(nick)
         self.channel_screen.set_logged(True)
 
-        self.factory.protocol.nickname = nick
+        session = self.add_network(host, nick)
         if channel.strip() != "":
-            self.new_channel(channel)
+            self.new_channel(session, channel)
 
-        self.chat_box.add_system_message(STATUS_CHANNEL, _("Logging in, please wait"))
-        self.factory.start_connection(host, port)
+        self.connect_network(session, host, port)
 
     def _new_channel(self, widget, channel):
-        if channel.strip() != "":
-            self.new_channel(channel)
+        if channel.strip() != "" and self.session is not None:
+            self.new_channel(self.session, channel)
+
+    def _channel_removed(self, widget, network, channel):
+        session = self.sessions.get(network, None)
+        if session is None:
+            return
 
-    def _channel_removed(self, widget, channel):
-        self.factory.remove_channel(channel)
-        self.chat_box.remove_channel(channel)
+        session.factory.remove_channel(channel)
+        session.chat_box.remove_channel(channel)
 
-        if len(self.factory.channels) == 0:
+        if not any(session.factory.channels for session in self.sessions.values()):
             self.set_screen(Screen.NEW_CHANNEL)
 
-    def new_channel(self, channel, add_hash=True, show=None):
+    def new_channel(self, session, channel, add_hash=True, show=None):
         self.set_screen(Screen.CHAT)
+        self.show_session(session)
+
+        chat_box = session.chat_box
 
         if add_hash and not channel.startswith("#"):
             channel = "#" + channel
 
-        if channel in self.chat_box.channels:
-            self.chat_box.add_system_message(channel, _("You've already joined %s") % channel)
+        if channel in chat_box.channels:
+            chat_box.add_system_message(channel, _("You've already joined %s") % channel)
             return
 
-        self.chat_box.add_channel(channel)
-        self.channels_listbox.add_channel(channel, show=show)
-        self.factory.add_channel(channel)
-        self.chat_box.switch_channel(channel)
+        chat_box.add_channel(channel)
+        self.channels_listbox.add_channel(session.network, channel, show=show)
+        session.factory.add_channel(channel)
+        chat_box.switch_channel(channel)
 
-    def _channel_selected(self, listbox, channel):
-        self.chat_box.switch_channel(channel)
+    def _channel_selected(self, listbox, network, channel):
+        session = self.sessions.get(network, None)
+        if session is not None:
+            self.show_session(session)
+            session.chat_box.switch_channel(channel)
 
     def _screen_changed(self, widget, screen):
         self.set_screen(screen)
 
-    def _signed_on(self, factory):
-        self.chat_box.entry.set_sensitive(True)
-        self.chat_box.nicker.set_sensitive(True)
-        self.channels_listbox.change_spinner(STATUS_CHANNEL, False)
-
-    def _joined(self, factory, channel):
-        if channel not in self.chat_box.channels:
+    def _events(self, bus, events):
+        for event in events:
+            handler = self.event_handlers.get(event.type, None)
+            session = self.sessions.get(event.network, None)
+            if handler is None or session is None:
+                continue
+
+            # A failing event mustn't drop the rest of the batch
+            try:
+                handler(session, *event.args)
+
+            except Exception:
+                print "Error handling event %s from %s:" % (event.type, event.network)
+                traceback.print_exc()
+
+    def _signed_on(self, session):
+        session.chat_box.entry.set_sensitive(True)
+        session.chat_box.nicker.set_sensitive(True)
+        self.channels_listbox.change_spinner(session.network, STATUS_CHANNEL, False)
+
+    def _joined(self, session, channel):
+        chat_box = session.chat_box
+        if channel not in chat_box.channels:
             channel = channel[1:]  # Isn't a channel, is a user (removing #)
 
         else:
-            self.chat_box.add_system_message(channel, _("Joined to: %s") % channel)
+            chat_box.add_system_message(channel, _("Joined to: %s") % channel)
 
-        self.channels_listbox.change_spinner(channel, False)
+        self.channels_listbox.change_spinner(session.network, channel, False)
 
-    def _system_message(self, factory, channel, message):
+    def _system_message(self, session, channel, message):
+        chat_box = session.chat_box
         if channel == CURRENT_CHANNEL:
-            channel = self.chat_box.current_channel
+            channel = chat_box.current_channel
 
         if channel == ALL_CHANNELS:
-            for channel in self.chat_box.channels:
-                self.chat_box.add_system_message(channel, message)
+            for channel in chat_box.channels:
+                chat_box.add_system_message(channel, message)
 
         else:
-            self.chat_box.add_system_message(channel, message)
+            chat_box.add_system_message(channel, message)
 
-    def _user_message(self, factory, channel, nickname, message):
-        if channel == self.factory.client.get_nickname() and nickname not in self.chat_box.channels:
-            self.new_channel(nickname, add_hash=False, show=nickname)
+    def _user_message(self, session, channel, nickname, message, timestamp=None):
+        chat_box = session.chat_box
+        own_nickname = session.get_nickname()
 
-        if channel != self.factory.client.get_nickname():  # Channel message
-            self.chat_box.message_recived(channel, nickname, message)
+        if channel == own_nickname and nickname not in chat_box.channels:
+            self.new_channel(session, nickname, add_hash=False, show=nickname)
 
-        else:  # Direct message
-            self.chat_box.message_recived(nickname, nickname, message)
+        if channel != own_nickname:  # Channel message
+            chat_box.message_recived(channel, nickname, message, timestamp)
 
-        self.afk_manager.start_counting(nickname, restart=True)
+        else:  # Direct message
+            chat_box.message_recived(nickname, nickname, message, timestamp)
 
-    def _nickname_changed(self, factory, nickname):
-        self.chat_box.set_nickname(nickname)
+        session.afk_manager.start_counting(nickname, restart=True)
 
-    def _user_nickname_changed(self, factory, old_nick, new_nick):
-        for channel in self.chat_box.channels:
-            nicknames = self.chat_box.nicks[channel]
-            if old_nick in nicknames:
-                self.chat_box.add_system_message(channel, _("{old_nick} has changed nick to {new_nick}").format(old_nick, new_nick))
-                self.chat_box.remove_nickname(channel, old_nick)
-                self.chat_box.add_nickname(channel, new_nick)
+    def _nickname_changed(self, session, nickname):
+        session.chat_box.set_nickname(nickname)
 
-                if old_nick == self.chat_box.nick:
-                    self.chat_box.set_nickname(new_nick)
+    def _user_nickname_changed(self, session, old_nick, new_nick):
+        chat_box = session.chat_box
+        renamed = chat_box.rename_nickname(old_nick, new_nick)
+        for channel, nickname in renamed:
+            chat_box.add_system_message(channel, _("{old_nick} has changed nick to {new_nick}").format(old_nick=old_nick, new_nick=new_nick))
 
-    def _user_joined(self, factory, channel, nickname):
-        self.chat_box.add_system_message(channel, _("{nickname} joined.").format(nickname=nickname))
-        self.chat_box.add_nickname(channel, nickname)
-        self.afk_manager.start_counting(nickname, restart=False)
+        if renamed and old_nick == chat_box.nick:
+            chat_box.set_nickname(new_nick)
 
-    def _user_left(self, factory, channel, nickname):
-        self.chat_box.add_system_message(channel, _("{nickname} has left.").format(nickname=nickname))
-        self.chat_box.remove_nickname(channel, nickname)
-        self.afk_manager.remove_nickname(nickname)
+        session.afk_manager.rename_nickname(old_nick, new_nick)
 
-    def _user_quit(self, factory, nickname, message):
-        for channel in self.chat_box.channels:
-            nicknames = self.chat_box.nicks[channel]
-            if nickname in nicknames:
-                self.chat_box.add_system_message(channel, _("{nickname} has quit. {message}").format(nickname=nickname, message=message))
+    def _user_joined(self, session, channel, nickname):
+        session.chat_box.add_system_message(channel, _("{nickname} joined.").format(nickname=nickname))
+        session.chat_box.add_nickname(channel, nickname)
+        session.afk_manager.start_counting(nickname, restart=False)
 
-        self.chat_box.remove_nickname_from_all_channels(nickname)
-        self.afk_manager.remove_nickname(nickname)
+    def _user_left(self, session, channel, nickname):
+        session.chat_box.add_system_message(channel, _("{nickname} has left.").format(nickname=nickname))
+        session.chat_box.remove_nickname(channel, nickname)
 
-    def _user_afk(self, manager, nickname):
-        self.chat_box.set_user_afk(nickname, True)
+        if not session.members.get_channels(nickname):
+            session.afk_manager.remove_nickname(nickname)
 
-    def _user_back(self, manager, nickname):
-        self.chat_box.set_user_afk(nickname, False)
+    def _user_quit(self, session, nickname, message):
+        chat_box = session.chat_box
+        for channel, nick in chat_box.remove_nickname_from_all_channels(nickname):
+            chat_box.add_system_message(channel, _("{nickname} has quit. {message}").format(nickname=nickname, message=message))
 
-    def _nicknames(self, factory, channel, nicknames):
-        self.set_nicknames(channel, nicknames.split(" "))
+        session.afk_manager.remove_nickname(nickname)
 
-    def set_nicknames(self, channel, nicknames):
-        self.chat_box.set_nicknames(channel, nicknames)
+    def _user_afk(self, manager, nicknames, session):
+        for nickname in nicknames:
+            session.chat_box.set_user_afk(nickname, True)
 
+    def _user_back(self, manager, nicknames, session):
         for nickname in nicknames:
-            if "@" in nickname:
-                nickname, usertype = nickname.split("@")
+            session.chat_box.set_user_afk(nickname, False)
+
+    def _nicknames(self, session, channel, members):
+        self.set_nicknames(session, channel, members)
+
+    def set_nicknames(self, session, channel, members):
+        session.chat_box.set_nicknames(channel, members)
+
+        for nickname, usertype in members:
+            session.afk_manager.start_counting(nickname, restart=False)
+
+    def _casemapping(self, session, casemapping):
+        session.members.set_casemapping(casemapping)
 
-            self.afk_manager.start_counting(nickname, restart=False)
+    def _capabilities(self, session, capabilities):
+        # The server sends back our own messages, so they aren't shown twice
+        session.chat_box.echo_message = "echo-message" in capabilities
 
-    def _me_command(self, factory, channel, nickname, message):
-        self.chat_box.add_system_message(channel, _(" * {nickname} {message}").format(nickname=nickname, message=message))
+    def _me_command(self, session, channel, nickname, message, timestamp=None):
+        session.chat_box.add_action(channel, nickname, message, timestamp)
 
-    def _status_message(self, factory, message):
-        self.chat_box.add_system_message(STATUS_CHANNEL, message)
+    def _status_message(self, session, message):
+        session.chat_box.add_system_message(STATUS_CHANNEL, message)
 
-    def _topic_changed(self, factory, channel, topic):
-        self.chat_box.set_topic(channel, topic)
+    def _topic_changed(self, session, channel, topic):
+        session.chat_box.set_topic(channel, topic)
 
-    def _mode_changed(self, factory, channel, usertype, nickname):
+    def _mode_changed(self, session, channel, usertype, nickname):
         if channel == CURRENT_CHANNEL:
-            channel = self.chat_box.current_channel
+            channel = session.chat_box.current_channel
 
-        self.chat_box.set_user_mode(channel, usertype, nickname)
+        session.chat_box.set_user_mode(channel, usertype, nickname)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014-2016, Cristian García <cristian99garcia@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import json
+from array import array
+from collections import deque
+
+from consts import SCROLLBACK_LINES, SCROLLBACK_CHUNK
+
+
+class Scrollback(object):
+    """
+    Keeps track of the lines shown in a channel buffer.
+
+    Every line is a list of (text, tag) segments.  When there are too
+    many lines, the oldest ones are spilled to an append-only log on
+    disk, so they can be read back later (page_back) without keeping
+    them in memory.
+    """
+
+    def __init__(self, path, max_lines=SCROLLBACK_LINES, chunk=SCROLLBACK_CHUNK):
+        self.path = path
+        self.max_lines = max_lines
+        self.chunk = chunk
+
+        self.lines = deque()  # Lines currently in the buffer
+        self.first = 0  # Log index of the first line in the buffer
+        self.stored = 0  # Number of lines written to the log
+        self.offsets = array("L")  # Log index: file offset
+
+        self.file = None
+
+    def add(self, segments):
+        self.lines.append(segments)
+        return len(self.lines) >= self.max_lines + self.chunk
+
+    def trim(self):
+        """
+        Removes the oldest lines over the limit, writing to the log those
+        which aren't already there.  Returns the number of removed lines.
+        """
+        count = len(self.lines) - self.max_lines
+        if count <= 0:
+            return 0
+
+        for x in range(count):
+            segments = self.lines.popleft()
+            if self.first + x >= self.stored:
+                self._write(segments)
+
+        self.first += count
+        return count
+
+    def spill(self, segments):
+        """
+        Writes to the log a line which was never in the buffer, for
+        channels that weren't shown yet.
+        """
+        self._write(segments)
+        self.first += 1
+
+    def is_paged(self):
+        return self.first < self.stored
+
+    def can_page_back(self):
+        return self.first > 0
+
+    def page_back(self):
+        """
+        Reads back from the log the chunk of lines previous to the first
+        line in the buffer, and returns them.
+        """
+        if not self.can_page_back():
+            return []
+
+        start = max(0, self.first - self.chunk)
+        self.file.flush()
+        self.file.seek(self.offsets[start])
+
+        if self.first < len(self.offsets):
+            data = self.file.read(self.offsets[self.first] - self.offsets[start])
+
+        else:
+            data = self.file.read()
+
+        lines = [json.loads(line) for line in data.splitlines()]
+        self.lines.extendleft(reversed(lines))
+        self.first = start
+
+        return lines
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _write(self, segments):
+        if self.file is None:
+            self.file = open(self.path, "ab+")
+
+        self.file.seek(0, os.SEEK_END)
+        self.offsets.append(self.file.tell())
+        self.file.write(json.dumps(segments) + "\n")
+        self.stored += 1
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014-2016, Cristian García <cristian99garcia@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import urllib
+
+from consts import LOG_DIR
+from chat_box import ChatBox
+from log_store import LogStore
+from afk_manager import AFKManager
+from member_registry import MemberRegistry
+
+
+class Session(object):
+    """
+    Everything that belongs to a single network: its ClientFactory, the
+    members of its channels (with its own CASEMAPPING), the AFK timers,
+    the history of its channels and the ChatBox that shows them.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.network = factory.network
+
+        self.members = MemberRegistry()
+        self.afk_manager = AFKManager(self.members)
+        self.log_store = LogStore(os.path.join(LOG_DIR, urllib.quote(self.network, safe="")))
+        self.chat_box = ChatBox(self.members, self.log_store)
+
+    def get_nickname(self):
+        if self.factory.client is not None:
+            return self.factory.client.get_nickname()
+
+        return self.factory.nickname
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014-2016, Cristian García <cristian99garcia@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import unittest
+
+from highlighter import Highlighter
+
+
+class HighlighterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.highlighter = Highlighter(["nick", "nickname"])
+
+    def test_mentions(self):
+        self.assertEqual(self.highlighter.get_spans(u"nick: hi nickname"),
+                         [(0, 4, "mention"), (9, 17, "mention")])
+
+    def test_url(self):
+        self.assertEqual(self.highlighter.get_spans(u"see http://example.com/ now"),
+                         [(4, 23, "url")])
+
+    def test_mention_in_url(self):
+        self.assertEqual(self.highlighter.get_spans(u"nick http://example.com/nick"),
+                         [(0, 4, "mention"), (5, 28, "url")])
+
+    def test_without_mentions(self):
+        self.assertEqual(self.highlighter.get_spans(u"nick http://example.com/", mentions=False),
+                         [(5, 24, "url")])
+
+    def test_no_words(self):
+        self.assertEqual(Highlighter().get_spans(u"nick"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014-2016, Cristian García <cristian99garcia@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import log_store
+from log_store import LogStore, LogSearch
+
+
+class LogStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.segment_lines = log_store.LOG_SEGMENT_LINES
+        log_store.LOG_SEGMENT_LINES = 3
+
+        self.path = tempfile.mkdtemp()
+        self.store = LogStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        log_store.LOG_SEGMENT_LINES = self.segment_lines
+        shutil.rmtree(self.path)
+
+    def append_lines(self, channel, count, first=0):
+        for number in range(first, first + count):
+            self.store.append(channel, "nick", "line %d" % number, 1000 + number)
+
+        self.assertTrue(self.store.flush())
+
+    def get_segments(self, channel):
+        return sorted(os.listdir(os.path.dirname(self.store.get_segment_path(channel, 0))))
+
+    def test_search(self):
+        self.store.append("#a", "nick", "hello world", 1000)
+        self.store.append("#a", "other", "goodbye", 1001)
+        self.store.append(u"#b\xe9", "nick", "caf\xc3\xa9 world", 1002)
+        self.store.flush()
+
+        self.assertEqual(self.store.search("world").next_page(),
+                         [(u"#b\xe9", 1002, u"nick", u"caf\xe9 world"), (u"#a", 1000, u"nick", u"hello world")])
+
+        self.assertEqual(self.store.search("WORLD hello").next_page(),
+                         [(u"#a", 1000, u"nick", u"hello world")])
+
+        self.assertEqual(self.store.search("world", "#a").next_page(),
+                         [(u"#a", 1000, u"nick", u"hello world")])
+
+        # The nickname is indexed too
+        self.assertEqual(self.store.search("other").next_page(),
+                         [(u"#a", 1001, u"other", u"goodbye")])
+
+    def test_search_syntax(self):
+        self.append_lines("#a", 2)
+
+        self.assertEqual(self.store.search("line OR NEAR 1*").next_page(), [ ])
+        self.assertEqual(self.store.search(" ,.").next_page(), [ ])
+
+    def test_segment_rollover(self):
+        self.append_lines("#a", 7)
+
+        self.assertEqual(self.get_segments("#a"), ["00000000.log", "00000001.log", "00000002.log"])
+        self.assertEqual([line[3] for line in self.store.search("line").next_page()],
+                         [u"line %d" % number for number in range(6, -1, -1)])
+
+    def test_reopen(self):
+        self.append_lines("#a", 4)
+        self.store.close()
+
+        self.store = LogStore(self.path)
+        self.append_lines("#a", 3, 4)
+
+        # The last segment is continued, up to LOG_SEGMENT_LINES lines
+        self.assertEqual(self.get_segments("#a"), ["00000000.log", "00000001.log", "00000002.log"])
+        self.assertEqual([line[3] for line in self.store.search("line").next_page()],
+                         [u"line %d" % number for number in range(6, -1, -1)])
+
+    def test_paging(self):
+        self.append_lines("#a", 5)
+
+        search = LogSearch(self.store, "line", page_size=2)
+        pages = [ ]
+        while search.has_more():
+            pages.append([line[3] for line in search.next_page()])
+
+        self.assertEqual(pages, [[u"line 4", u"line 3"], [u"line 2", u"line 1"], [u"line 0"]])
+        self.assertEqual(search.next_page(), [ ])
+
+    def test_write_error(self):
+        write_lines = self.store._write_lines
+
+        def fail(database, segments, lines):
+            self.store._write_lines = write_lines
+            raise IOError("No space left on device")
+
+        self.store._write_lines = fail
+        self.store.append("#a", "nick", "lost", 1000)
+        self.assertTrue(self.store.flush())
+
+        # The batch is lost, but the thread still writes the next ones
+        self.append_lines("#a", 1)
+        self.assertTrue(self.store.thread.is_alive())
+        self.assertEqual(self.store.search("lost").next_page(), [ ])
+        self.assertEqual(self.store.search("line").next_page(), [(u"#a", 1000, u"nick", u"line 0")])
+
+    def test_flush_closed(self):
+        self.store.close()
+        self.assertFalse(self.store.flush())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014-2016, Cristian García <cristian99garcia@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import unittest
+
+from member_registry import MemberRegistry
+
+
+class CasemappingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.members = MemberRegistry()
+
+    def test_rfc1459(self):
+        self.assertEqual(self.members.fold("Nick[a]\\~"), "nick{a}|^")
+
+    def test_strict_rfc1459(self):
+        self.members.set_casemapping("strict-rfc1459")
+        self.assertEqual(self.members.fold("Nick[a]\\~"), "nick{a}|~")
+
+    def test_ascii(self):
+        self.members.set_casemapping("ascii")
+        self.assertEqual(self.members.fold("Nick[a]\\~"), "nick[a]\\~")
+
+    def test_unknown(self):
+        self.members.set_casemapping("rfc7613")
+        self.assertEqual(self.members.fold("Nick[a]"), "nick{a}")
+
+    def test_unicode(self):
+        self.assertEqual(self.members.fold(u"N\xefck"), "n\xc3\xafck")
+
+    def test_refold(self):
+        self.members.set_casemapping("ascii")
+        self.members.set_members("#a", ["Nick[a]", "nick{a}"])
+
+        self.members.set_casemapping("rfc1459")
+        self.assertEqual(len(self.members.get_members("#a")), 1)
+        self.assertTrue(self.members.has("#a", "NICK[A]"))
+
+
+class MemberRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.members = MemberRegistry()
+        self.members.set_members("#a", ["Alice", "bob", "Carol"])
+        self.members.set_members("#b", ["alice", "Dave"])
+
+    def test_get(self):
+        self.assertEqual(self.members.get("#a", "ALICE"), "Alice")
+        self.assertEqual(self.members.get("#b", "ALICE"), "alice")
+        self.assertEqual(self.members.get("#b", "bob"), None)
+        self.assertEqual(self.members.get_channels("aLiCe"), set(["#a", "#b"]))
+
+    def test_add_remove(self):
+        self.members.add("#b", "Bob")
+        self.assertEqual(self.members.get_channels("bob"), set(["#a", "#b"]))
+
+        self.assertEqual(self.members.remove("#a", "BOB"), "bob")
+        self.assertEqual(self.members.remove("#a", "bob"), None)
+        self.assertEqual(self.members.get_channels("bob"), set(["#b"]))
+        self.assertEqual(self.members.get_members_with_prefix("#a", "b"), [ ])
+
+    def test_rename(self):
+        self.assertEqual(sorted(self.members.rename("alice", "Eve")), [("#a", "Alice"), ("#b", "alice")])
+
+        self.assertEqual(self.members.get_channels("alice"), set())
+        self.assertEqual(self.members.get_channels("eve"), set(["#a", "#b"]))
+        self.assertEqual(self.members.get("#a", "EVE"), "Eve")
+        self.assertEqual(self.members.get_members_with_prefix("#a", "e"), ["Eve"])
+
+    def test_rename_case(self):
+        self.assertEqual(self.members.rename("bob", "BOB"), [("#a", "bob")])
+
+        self.assertEqual(self.members.get("#a", "bob"), "BOB")
+        self.assertEqual(self.members.get_members_with_prefix("#a", "b"), ["BOB"])
+
+    def test_quit(self):
+        self.assertEqual(sorted(self.members.quit("ALICE")), [("#a", "Alice"), ("#b", "alice")])
+
+        self.assertEqual(self.members.get_channels("alice"), set())
+        self.assertEqual(sorted(self.members.get_members("#a")), ["Carol", "bob"])
+        self.assertEqual(self.members.get_members("#b"), ["Dave"])
+        self.assertEqual(self.members.quit("alice"), [ ])
+
+    def test_remove_channel(self):
+        self.members.remove_channel("#a")
+
+        self.assertEqual(self.members.get_channels("alice"), set(["#b"]))
+        self.assertEqual(self.members.get_channels("bob"), set())
+        self.assertEqual(self.members.get_members_with_prefix("#a", ""), [ ])
+
+    def test_prefix(self):
+        self.members.set_members("#c", ["Ann", "anna", "Annie[x]", "Bo", "an", "Zed"])
+
+        self.assertEqual(self.members.get_members_with_prefix("#c", "AN"), ["an", "Ann", "anna", "Annie[x]"])
+        self.assertEqual(self.members.get_members_with_prefix("#c", "annie{"), ["Annie[x]"])
+        self.assertEqual(self.members.get_members_with_prefix("#c", "z"), ["Zed"])
+        self.assertEqual(self.members.get_members_with_prefix("#c", "x"), [ ])
+        self.assertEqual(self.members.get_members_with_prefix("#d", "a"), [ ])
+
+    def test_prefix_after_add(self):
+        self.members.add("#a", "Bea")
+        self.members.add("#a", "Al")
+
+        self.assertEqual(self.members.get_members_with_prefix("#a", "b"), ["Bea", "bob"])
+        self.assertEqual(self.members.get_members_with_prefix("#a", "a"), ["Al", "Alice"])
+
+
+if __name__ == "__main__":
+    unittest.main()
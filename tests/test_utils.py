@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2014-2016, Cristian García <cristian99garcia@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import unittest
+
+from utils import to_unicode, split_lines, parse_server_time
+
+
+class ToUnicodeTest(unittest.TestCase):
+
+    def test_utf8(self):
+        self.assertEqual(to_unicode("caf\xc3\xa9"), u"caf\xe9")
+
+    def test_unicode(self):
+        self.assertEqual(to_unicode(u"caf\xe9"), u"caf\xe9")
+
+    def test_invalid_utf8(self):
+        # A latin-1 message, relayed as it was sent
+        self.assertEqual(to_unicode("caf\xe9 ok"), u"caf\ufffd ok")
+
+
+class ParseServerTimeTest(unittest.TestCase):
+
+    def test_milliseconds(self):
+        self.assertEqual(parse_server_time("2016-01-01T12:30:00.250Z"), 1451651400.25)
+
+    def test_seconds(self):
+        self.assertEqual(parse_server_time("1970-01-02T00:00:00Z"), 86400)
+
+    def test_invalid(self):
+        self.assertEqual(parse_server_time("yesterday"), None)
+        self.assertEqual(parse_server_time(None), None)
+
+
+class SplitLinesTest(unittest.TestCase):
+
+    def test_single_line(self):
+        segments = [(u"nick: ", "nick"), (u"hello\n", "message1")]
+        self.assertEqual(split_lines(segments), [segments])
+
+    def test_line_breaks(self):
+        # A system message with a traceback, as "Connection lost: ..."
+        segments = [(u"nick: ", "nick"), (u"a\r\nb\rc\n\nd\u2029e\n", "sys-msg")]
+        self.assertEqual(split_lines(segments), [
+            [(u"nick: ", "nick"), (u"a\n", "sys-msg")],
+            [(u"b\n", "sys-msg")],
+            [(u"c\n", "sys-msg")],
+            [(u"\n", "sys-msg")],
+            [(u"d\n", "sys-msg")],
+            [(u"e\n", "sys-msg")],
+        ])
+
+    def test_break_between_segments(self):
+        segments = [(u"a\n", "nick"), (u"b\n", "message1")]
+        self.assertEqual(split_lines(segments), [[(u"a\n", "nick")], [(u"b\n", "message1")]])
+
+    def test_one_line_per_buffer_line(self):
+        text = u"Connection lost: [Failure instance: Traceback\n  File x\n]\n"
+        lines = split_lines([(text, "sys-msg")])
+        self.assertEqual(len(lines), text.count(u"\n"))
+        for line in lines:
+            self.assertTrue(line[-1][0].endswith(u"\n"))
+            self.assertEqual(u"".join(text for text, tag in line).count(u"\n"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -524,6 +524,7 @@ class LineReceiver(protocol.Protocol, _PauseableMixin):
     """
     line_mode = 1
     _buffer = b''
+    _bufferOffset = 0
     _busyReceiving = False
     delimiter = b'\r\n'
     MAX_LENGTH = 16384
@@ -535,7 +536,19 @@ class LineReceiver(protocol.Protocol, _PauseableMixin):
         @return: All of the cleared buffered data.
         @rtype: C{bytes}
         """
-        b, self._buffer = self._buffer, b""
+        return self._takeBuffer()
+
+
+    def _takeBuffer(self):
+        """
+        Clear buffered data.
+
+        @return: The buffered data which wasn't delivered yet.
+        @rtype: C{bytes}
+        """
+        b = self._buffer[self._bufferOffset:]
+        self._buffer = b''
+        self._bufferOffset = 0
         return b
 
 
@@ -544,42 +557,49 @@ class LineReceiver(protocol.Protocol, _PauseableMixin):
         Protocol.dataReceived.
         Translates bytes into lines, and calls lineReceived (or
         rawDataReceived, depending on mode.)
+
+        The buffer is scanned for delimiters from a read offset, slicing
+        only the lines themselves; the delivered lines are only removed from
+        it when this call returns, so the buffer isn't copied once per line.
         """
-        if self._busyReceiving:
+        if self._buffer:
             self._buffer += data
+        else:
+            self._buffer = data
+        if self._busyReceiving:
             return
 
         try:
             self._busyReceiving = True
-            self._buffer += data
-            while self._buffer and not self.paused:
-                if self.line_mode:
-                    try:
-                        line, self._buffer = self._buffer.split(
-                            self.delimiter, 1)
-                    except ValueError:
-                        if len(self._buffer) > self.MAX_LENGTH:
-                            line, self._buffer = self._buffer, b''
-                            return self.lineLengthExceeded(line)
+            while not self.paused:
+                # lineReceived may clear the buffer or change the mode, so
+                # look at the buffer again every time.
+                buffer = self._buffer
+                start = self._bufferOffset
+                if not self.line_mode:
+                    if start >= len(buffer):
                         return
-                    else:
-                        lineLength = len(line)
-                        if lineLength > self.MAX_LENGTH:
-                            exceeded = line + self.delimiter + self._buffer
-                            self._buffer = b''
-                            return self.lineLengthExceeded(exceeded)
-                        why = self.lineReceived(line)
-                        if (why or self.transport and
-                            self.transport.disconnecting):
-                            return why
-                else:
-                    data = self._buffer
-                    self._buffer = b''
-                    why = self.rawDataReceived(data)
+                    why = self.rawDataReceived(self._takeBuffer())
                     if why:
                         return why
+                    continue
+                end = buffer.find(self.delimiter, start)
+                if end == -1:
+                    if len(buffer) - start > self.MAX_LENGTH:
+                        return self.lineLengthExceeded(self._takeBuffer())
+                    return
+                if end - start > self.MAX_LENGTH:
+                    return self.lineLengthExceeded(self._takeBuffer())
+                self._bufferOffset = end + len(self.delimiter)
+                why = self.lineReceived(buffer[start:end])
+                if (why or self.transport and
+                    self.transport.disconnecting):
+                    return why
         finally:
             self._busyReceiving = False
+            if self._bufferOffset:
+                self._buffer = self._buffer[self._bufferOffset:]
+                self._bufferOffset = 0
 
 
     def setLineMode(self, extra=b''):
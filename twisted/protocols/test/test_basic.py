@@ -292,6 +292,31 @@ a'''
         self.assertEqual(protocol.rest, b'')
 
 
+    def test_manyLinesInOneChunk(self):
+        """
+        All the lines of a chunk are delivered as C{bytes}, and an unfinished
+        line is kept until the rest of it is received.
+        """
+        class CollectingReceiver(basic.LineReceiver):
+            def connectionMade(self):
+                self.lines = []
+
+            def lineReceived(self, line):
+                self.lines.append(line)
+
+        proto = CollectingReceiver()
+        proto.makeConnection(proto_helpers.StringTransport())
+        lines = [b'line ' + str(i).encode('ascii') for i in range(1000)]
+        proto.dataReceived(b'\r\n'.join(lines) + b'\r\nunfin')
+        self.assertEqual(proto.lines, lines)
+        self.assertEqual([type(line) for line in proto.lines[:1]], [bytes])
+
+        proto.dataReceived(b'ished\r')
+        proto.dataReceived(b'\n')
+        self.assertEqual(proto.lines[-1], b'unfinished')
+        self.assertEqual(proto.clearLineBuffer(), b'')
+
+
     def test_stackRecursion(self):
         """
         Test switching modes many times on the same data.
@@ -39,14 +39,16 @@ import operator
 import string, socket
 import textwrap
 import shlex
+from collections import deque
 from functools import reduce
+from itertools import chain, islice
 from os import path
 
 from twisted.internet import reactor, protocol, task
 from twisted.persisted import styles
 from twisted.protocols import basic
 from twisted.python import log, reflect, _textattributes
-from twisted.python.compat import unicode, xrange
+from twisted.python.compat import unicode, xrange, _PY3
 
 NUL = chr(0)
 CR = chr(0o15)
@@ -102,6 +104,266 @@ def parsemsg(s):
 
 
 
+# Unescaping of message tag values, see
+# <https://ircv3.net/specs/core/message-tags-3.2.html>.
+_tagUnescapes = {':': ';', 's': ' ', '\\': '\\', 'r': '\r', 'n': '\n'}
+
+def _unescapeTagValue(value):
+    """
+    Unescape an IRCv3 message tag value.
+
+    @param value: The escaped tag value.
+    @type value: L{str}
+
+    @return: The unescaped value.
+    @rtype: L{str}
+    """
+    if '\\' not in value:
+        return value
+    unescaped = []
+    chars = iter(value)
+    for char in chars:
+        if char == '\\':
+            # A trailing backslash is dropped.
+            char = next(chars, '')
+            char = _tagUnescapes.get(char, char)
+        unescaped.append(char)
+    return ''.join(unescaped)
+
+
+
+def _parseTags(tagString):
+    """
+    Parse the IRCv3 message tags of a message, without the leading C{@}.
+
+    @param tagString: The tags, separated by C{;}.
+    @type tagString: L{str}
+
+    @return: A mapping of tag names to their unescaped values.  Tags without
+        a value are mapped to an empty string.
+    @rtype: L{dict}
+    """
+    tags = {}
+    for tag in tagString.split(';'):
+        if tag:
+            key, _, value = tag.partition('=')
+            tags[key] = _unescapeTagValue(value)
+    return tags
+
+
+
+class _Message(object):
+    """
+    A message received from an IRC server, as parsed by L{_parseMessage}.
+
+    @ivar tags: The IRCv3 message tags, see L{_parseTags}.
+    @type tags: L{dict}
+
+    @ivar prefix: The prefix of the message, or an empty string.
+    @type prefix: L{str}
+
+    @ivar command: The command, with numeric replies translated to their
+        symbolic names.
+    @type command: L{str}
+
+    @ivar params: The parameters, including the trailing one.
+    @type params: L{list} of L{str}
+    """
+    __slots__ = ('tags', 'prefix', 'command', 'params')
+
+    def __init__(self, tags, prefix, command, params):
+        self.tags = tags
+        self.prefix = prefix
+        self.command = command
+        self.params = params
+
+
+    def __repr__(self):
+        return '<%s %r %r %r %r>' % (self.__class__.__name__, self.tags,
+                                     self.prefix, self.command, self.params)
+
+
+
+# The tags of the messages without any, shared by all of them: it must not
+# be modified.
+_NO_TAGS = {}
+
+
+
+def _parseMessage(line):
+    """
+    Parse a message from an IRC server.
+
+    Unlike L{parsemsg}, the message may start with IRCv3 message tags, and
+    numeric replies are translated to their symbolic names.
+
+    @param line: The message, without its line ending.
+    @type line: L{str}
+
+    @return: The parsed message, with L{_NO_TAGS} as its tags if it has
+        none.
+    @rtype: L{_Message}
+
+    @raise IRCBadMessage: If the line has no command.
+    """
+    tags = _NO_TAGS
+    if line[0:1] == '@':
+        try:
+            tagString, line = line[1:].split(' ', 1)
+        except ValueError:
+            raise IRCBadMessage("Message tags without a command.")
+        tags = _parseTags(tagString)
+        line = line.lstrip(' ')
+    prefix, command, params = _splitMessage(line)
+    return _Message(tags, prefix, command, params)
+
+
+
+def _splitMessage(line):
+    """
+    Split a message from an IRC server without tags into its prefix, its
+    command and its parameters.
+
+    Unlike L{parsemsg}, numeric replies are translated to their symbolic
+    names.  The line is split with string methods only, which is faster
+    than scanning it in Python (see C{benchmarks/irc_parse.py}).
+
+    @param line: The message, without tags nor line ending.
+    @type line: L{str}
+
+    @return: The prefix, or an empty string, the command and the list of
+        parameters, including the trailing one.
+    @rtype: L{tuple}
+
+    @raise IRCBadMessage: If the line has no command.
+    """
+    prefix = ''
+    if line[0:1] == ':':
+        try:
+            prefix, line = line[1:].split(' ', 1)
+        except ValueError:
+            raise IRCBadMessage("Prefix without a command.")
+
+    trailing = line.find(' :')
+    if trailing == -1:
+        params = line.split()
+    else:
+        params = line[:trailing].split()
+        params.append(line[trailing + 2:])
+
+    if not params:
+        raise IRCBadMessage("Empty line.")
+    command = params.pop(0)
+    return prefix, numeric_to_symbolic.get(command, command), params
+
+
+
+def _splitUTF8(message, length):
+    """
+    Split a message into lines of at most C{length} bytes of UTF-8.
+
+    C{"\\n"} is used as a breaking point, and a space near the length limit
+    is preferred to break long lines.  Otherwise lines are broken between
+    characters, never inside the encoding of a character.
+
+    @param message: The message to split, which is encoded to UTF-8 if it is
+        L{unicode}.
+    @type message: L{bytes} or L{unicode}
+
+    @param length: The maximum number of bytes of UTF-8 of any line in the
+        result.
+    @type length: L{int}
+
+    @return: The non-empty lines, as native strings: L{bytes} of UTF-8 on
+        Python 2 and L{unicode} on Python 3.
+    @rtype: L{list} of L{str}
+    """
+    if length <= 0:
+        raise ValueError("Length must be a number greater than zero")
+    if isinstance(message, unicode):
+        message = message.encode('utf-8')
+
+    lines = []
+    for line in message.split(b'\n'):
+        while len(line) > length:
+            end = line.rfind(b' ', 0, length + 1)
+            if end > 0:
+                chunk = line[:end].rstrip(b' ')
+                line = line[end + 1:].lstrip(b' ')
+            else:
+                end = length
+                # Back up over UTF-8 continuation bytes, unless the line is
+                # not UTF-8 at all.
+                while end > 0 and 0x80 <= ord(line[end:end + 1]) < 0xc0:
+                    end -= 1
+                if end == 0:
+                    end = length
+                chunk = line[:end]
+                line = line[end:]
+            if chunk:
+                lines.append(chunk)
+        if line:
+            lines.append(line)
+    if _PY3:
+        lines = [line.decode('utf-8') for line in lines]
+    return lines
+
+
+
+
+class _CommandObserver(object):
+    """
+    A replacement for the C{handleCommand} method of a protocol, calling an
+    observer with each command handled and the time spent handling it, see
+    L{IRC.observeCommands} and L{IRCClient.observeCommands}.
+
+    It is only set on the protocols observed, so that the others do not
+    check for an observer on every line.
+
+    @ivar handleCommand: The C{handleCommand} method observed.
+
+    @ivar instanceHandler: The C{handleCommand} set on the protocol instance
+        before, to put back when the observer is removed, or L{None}.
+
+    @ivar observer: Called with the command and the time spent handling it,
+        in seconds.
+    """
+    __slots__ = ('handleCommand', 'instanceHandler', 'observer')
+
+    def __init__(self, handleCommand, instanceHandler, observer):
+        self.handleCommand = handleCommand
+        self.instanceHandler = instanceHandler
+        self.observer = observer
+
+
+    def __call__(self, command, prefix, params):
+        started = time.time()
+        self.handleCommand(command, prefix, params)
+        self.observer(command, time.time() - started)
+
+
+
+def _observeCommands(protocol, observer):
+    """
+    Set, replace or remove the command observer of C{protocol}.
+
+    @type protocol: L{IRC} or L{IRCClient}
+
+    @param observer: Called with each command handled and the time spent
+        handling it, in seconds, or L{None} to remove the observer.
+    @type observer: callable or L{None}
+    """
+    handler = protocol.__dict__.pop('handleCommand', None)
+    if isinstance(handler, _CommandObserver):
+        handler = handler.instanceHandler
+    if handler is not None:
+        protocol.handleCommand = handler
+    if observer is not None:
+        protocol.handleCommand = _CommandObserver(
+            protocol.handleCommand, handler, observer)
+
+
+
 def split(str, length=80):
     """
     Split a string into multiple lines.
@@ -245,9 +507,96 @@ def parseModes(modes, params, paramModes=('', '')):
 
 
 
+class _ReplyProducer(object):
+    """
+    Pull producer writing the long replies of an L{IRC} protocol to its
+    transport, a batch of lines each time the transport asks for more.
+
+    @ivar protocol: The protocol sending the replies.
+    @type protocol: L{IRC}
+
+    @ivar replies: Iterators of the encoded lines waiting to be written, in
+        order.
+    @type replies: L{deque}
+
+    @ivar _next: The next line to write, already taken from L{replies} to
+        tell whether there are lines left, or L{None}.
+    @type _next: L{bytes}
+    """
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.replies = deque()
+        self._next = None
+
+
+    def resumeProducing(self):
+        """
+        Write the next L{IRC.replyBatchLines} lines with a single
+        C{writeSequence}, and unregister once all of them are written.
+        """
+        count = self.protocol.replyBatchLines
+        batch = []
+        if self._next is not None:
+            batch.append(self._next)
+            self._next = None
+        while self.replies and len(batch) < count:
+            batch.extend(islice(self.replies[0], count - len(batch)))
+            if len(batch) < count:
+                self.replies.popleft()
+        while self.replies and self._next is None:
+            self._next = next(self.replies[0], None)
+            if self._next is None:
+                self.replies.popleft()
+
+        if batch:
+            self.protocol.transport.writeSequence(batch)
+        if self._next is None:
+            self.protocol._replyProducer = None
+            self.protocol.transport.unregisterProducer()
+
+
+    def stopProducing(self):
+        self.replies.clear()
+        self._next = None
+        self.protocol._replyProducer = None
+
+
+
 class IRC(protocol.Protocol):
     """
     Internet Relay Chat server protocol.
+
+    @ivar replyBatchLines: The maximum number of lines written at once by
+        L{sendLines}.  Longer replies are written a batch at a time, as the
+        transport asks for more.
+    @type replyBatchLines: L{int}
+
+    @ivar commandRate: If not L{None}, the number of seconds per command the
+        peer may send in the long run.  Commands are handled as long as there
+        are tokens left: one token is added every C{commandRate} seconds, up
+        to L{commandBurst}, and every command takes the number of tokens
+        given by L{commandCosts} (one by default).  When the tokens run out,
+        reading from the transport is paused until there is a token again.
+    @type commandRate: L{float} or L{None}
+
+    @ivar commandBurst: The maximum number of tokens.
+    @type commandBurst: L{int}
+
+    @ivar commandCosts: The number of tokens taken by commands that cost
+        more, or less, than one, by command name.
+    @type commandCosts: L{dict}
+
+    @ivar throttleObserver: If not L{None}, a callable called with the
+        protocol and the delay, in seconds, every time reading from its
+        transport is paused because of L{commandRate}.  Set it on the
+        instance, or as a C{staticmethod} on the class, so that it is not
+        bound to the protocol.
+    @type throttleObserver: callable or L{None}
+
+    @ivar throttled: The number of times reading from the transport was
+        paused because of L{commandRate}.
+    @type throttled: L{int}
     """
 
     buffer = ""
@@ -255,10 +604,35 @@ class IRC(protocol.Protocol):
 
     encoding = None
 
+    replyBatchLines = 64
+    _replyProducer = None
+
+    commandRate = None
+    commandBurst = 10
+    commandCosts = {}
+    throttleObserver = None
+    throttled = 0
+    _commandTokens = 0
+    _lastCommandRefill = 0
+    _pendingLines = None
+    _throttleCall = None
+    _throttling = False
+    _reactor = reactor
+
     def connectionMade(self):
         self.channels = []
         if self.hostname is None:
             self.hostname = socket.getfqdn()
+        self._pendingLines = deque()
+        self._commandTokens = self.commandBurst
+        self._lastCommandRefill = self._reactor.seconds()
+
+
+    def connectionLost(self, reason):
+        self._pendingLines = None
+        if self._throttleCall is not None:
+            self._throttleCall.cancel()
+            self._throttleCall = None
 
 
     def sendLine(self, line):
@@ -266,7 +640,81 @@ class IRC(protocol.Protocol):
         if isinstance(line, unicode):
             useEncoding = self.encoding if self.encoding else "utf-8"
             line = line.encode(useEncoding)
-        self.transport.write(line)
+        self._write(line)
+
+
+    def _write(self, data):
+        """
+        Write encoded lines to the transport, after the lines of the reply
+        being written by L{sendLines}, if any.
+
+        @param data: The lines, including their line terminators.
+        @type data: L{bytes}
+        """
+        if self._replyProducer is not None:
+            # Don't overtake the lines of a reply still being written.
+            self._replyProducer.replies.append(iter([data]))
+        else:
+            self.transport.write(data)
+
+
+    def _encodeLines(self, lines):
+        """
+        Encode lines as L{sendLine} does.
+
+        @param lines: The lines, which may be L{bytes} if already encoded.
+        @type lines: iterable of L{bytes} or L{unicode}
+
+        @return: The encoded lines, including the line terminator.
+        @rtype: iterator of L{bytes}
+        """
+        useEncoding = self.encoding if self.encoding else "utf-8"
+        for line in lines:
+            if isinstance(line, unicode):
+                line = (line + CR + LF).encode(useEncoding)
+            else:
+                line = line + b'\r\n'
+            yield line
+
+
+    def sendLines(self, lines):
+        """
+        Send several lines.
+
+        Up to L{replyBatchLines} lines are written with a single
+        C{writeSequence} call.  The lines of longer replies are produced and
+        written a batch at a time, by a producer registered on the transport,
+        so a slow client gets them as fast as it reads them instead of having
+        them all buffered.  If L{sendLine} is overridden, each line goes
+        through it instead.
+
+        @param lines: The lines to send, without line terminators.
+        @type lines: iterable of L{bytes} or L{unicode}
+        """
+        if _function(self.sendLine) is not _IRCSendLine:
+            for line in lines:
+                self.sendLine(line)
+            return
+
+        encoded = self._encodeLines(lines)
+        if self._replyProducer is not None:
+            self._replyProducer.replies.append(encoded)
+            return
+
+        batch = list(islice(encoded, self.replyBatchLines + 1))
+        if len(batch) <= self.replyBatchLines:
+            self.transport.writeSequence(batch)
+            return
+
+        producer = _ReplyProducer(self)
+        producer.replies.append(chain(batch, encoded))
+        self._replyProducer = producer
+        try:
+            self.transport.registerProducer(producer, False)
+        except RuntimeError:
+            # Some other producer is writing to the transport.
+            self._replyProducer = None
+            self.transport.writeSequence(list(chain(batch, encoded)))
 
 
     def sendMessage(self, command, *parameter_list, **prefix):
@@ -412,18 +860,84 @@ class IRC(protocol.Protocol):
         # buffer
         self.buffer = lines.pop()
 
-        for line in lines:
-            if len(line) <= 2:
-                # This is a blank line, at best.
-                continue
-            if line[-1] == CR:
-                line = line[:-1]
-            prefix, command, params = parsemsg(line)
-            # mIRC is a big pile of doo-doo
-            command = command.upper()
-            # DEBUG: log.msg( "%s %s %s" % (prefix, command, params))
+        if self.commandRate is None:
+            for line in lines:
+                self._handleLine(line)
+        else:
+            self._pendingLines.extend(lines)
+            if self._throttleCall is None:
+                self._handlePendingLines()
 
-            self.handleCommand(command, prefix, params)
+
+    def _handleLine(self, line):
+        """
+        Parse and handle a line received from the peer.
+
+        @param line: The line, without its LF.
+        @type line: L{unicode}
+
+        @return: The command of the line, or L{None} if it was blank.
+        """
+        if len(line) <= 2:
+            # This is a blank line, at best.
+            return None
+        if line[-1] == CR:
+            line = line[:-1]
+        prefix, command, params = parsemsg(line)
+        # mIRC is a big pile of doo-doo
+        command = command.upper()
+        # DEBUG: log.msg( "%s %s %s" % (prefix, command, params))
+
+        self.handleCommand(command, prefix, params)
+        return command
+
+
+    def _handlePendingLines(self):
+        """
+        Handle received lines as long as there are tokens left, then pause
+        the transport until the next token if there are lines left, or
+        resume it if it was paused and there are none.
+
+        A line which cannot be parsed drops the connection, as it does when
+        the lines are not throttled.
+        """
+        self._throttleCall = None
+        now = self._reactor.seconds()
+        self._commandTokens = min(
+            self.commandBurst,
+            self._commandTokens +
+            (now - self._lastCommandRefill) / self.commandRate)
+        self._lastCommandRefill = now
+
+        while self._pendingLines and self._commandTokens >= 1:
+            try:
+                command = self._handleLine(self._pendingLines.popleft())
+            except:
+                # Raised from a delayed call, the error would leave the
+                # transport paused for good.
+                log.err(None, "Error parsing a line, dropping the connection")
+                self._pendingLines.clear()
+                self.transport.loseConnection()
+                return
+            if command is not None:
+                self._commandTokens -= self.commandCosts.get(command, 1)
+            if self._pendingLines is None:
+                # The connection was lost while handling the command.
+                return
+
+        if self._pendingLines:
+            delay = (1 - self._commandTokens) * self.commandRate
+            if not self._throttling:
+                self._throttling = True
+                self.throttled += 1
+                self.transport.pauseProducing()
+                if self.throttleObserver is not None:
+                    self.throttleObserver(self, delay)
+            self._throttleCall = self._reactor.callLater(
+                delay, self._handlePendingLines)
+        elif self._throttling:
+            self._throttling = False
+            self.transport.resumeProducing()
 
 
     def handleCommand(self, command, prefix, params):
@@ -451,6 +965,21 @@ class IRC(protocol.Protocol):
             log.deferr()
 
 
+    def observeCommands(self, observer):
+        """
+        Call C{observer} with each command handled from now on and the time
+        spent handling it, in seconds, to find out which handlers are hot.
+
+        Commands are handled without any check for an observer as long as
+        none is set.
+
+        @param observer: The new observer, replacing the previous one, or
+            L{None} to stop observing commands.
+        @type observer: callable or L{None}
+        """
+        _observeCommands(self, observer)
+
+
     def irc_unknown(self, prefix, command, params):
         """
         Called by L{handleCommand} on a command that doesn't have a defined
@@ -587,26 +1116,58 @@ class IRC(protocol.Protocol):
         @type names: C{list} of C{str} or C{unicode}
         @param names: The names to send.
         """
-        # XXX If unicode is given, these limits are not quite correct
-        prefixLength = len(channel) + len(user) + 10
-        namesLength = 512 - prefixLength
-
-        L = []
-        count = 0
-        for n in names:
-            if count + len(n) + 1 > namesLength:
-                self.sendLine(":%s %s %s = %s :%s" % (
-                    self.hostname, RPL_NAMREPLY, user, channel, ' '.join(L)))
-                L = [n]
-                count = len(n)
+        end = ":%s %s %s %s :End of /NAMES list" % (
+            self.hostname, RPL_ENDOFNAMES, user, channel)
+        self.sendLines(chain(
+            self._packNames(":%s %s %s = %s :" % (
+                self.hostname, RPL_NAMREPLY, user, channel), names),
+            [end]))
+
+
+    def _packNames(self, prefix, names):
+        """
+        Pack names into as few lines as fit in L{MAX_COMMAND_LENGTH} bytes,
+        line terminator included, once encoded.
+
+        @param prefix: The beginning of every line.
+        @type prefix: C{str} or C{unicode}
+
+        @param names: The names to pack, separated by spaces.
+        @type names: iterable of C{str} or C{unicode}
+
+        @return: The encoded lines, without line terminators.
+        @rtype: iterator of L{bytes}
+        """
+        useEncoding = self.encoding if self.encoding else "utf-8"
+        if isinstance(prefix, unicode):
+            prefix = prefix.encode(useEncoding)
+        namesLength = MAX_COMMAND_LENGTH - len(prefix) - 2
+
+        # The names are encoded at once, and the lines cut at the last space
+        # which fits.
+        names = list(names)
+        try:
+            data = u' '.join(names).encode(useEncoding)
+        except (TypeError, UnicodeDecodeError):
+            # Some names are already encoded.
+            data = b' '.join([
+                n.encode(useEncoding) if isinstance(n, unicode) else n
+                for n in names])
+
+        start = 0
+        while start < len(data):
+            end = start + namesLength
+            if end >= len(data):
+                end = len(data)
             else:
-                L.append(n)
-                count += len(n) + 1
-        if L:
-            self.sendLine(":%s %s %s = %s :%s" % (
-                self.hostname, RPL_NAMREPLY, user, channel, ' '.join(L)))
-        self.sendLine(":%s %s %s %s :End of /NAMES list" % (
-            self.hostname, RPL_ENDOFNAMES, user, channel))
+                end = data.rfind(b' ', start + 1, end + 1)
+                if end == -1:
+                    # A name longer than a line gets a line of its own.
+                    end = data.find(b' ', start + 1)
+                    if end == -1:
+                        end = len(data)
+            yield prefix + data[start:end]
+            start = end + 1
 
 
     def who(self, user, channel, memberInfo):
@@ -627,15 +1188,19 @@ class IRC(protocol.Protocol):
             "Here" or "Gone"), the hopcount from C{user} to this member, and
             this member's real name.
         """
-        for info in memberInfo:
-            (username, hostmask, server, nickname, flag, hops, realName) = info
-            assert flag in ("H", "G")
-            self.sendLine(":%s %s %s %s %s %s %s %s %s :%d %s" % (
-                self.hostname, RPL_WHOREPLY, user, channel,
-                username, hostmask, server, nickname, flag, hops, realName))
+        def lines():
+            for info in memberInfo:
+                (username, hostmask, server, nickname, flag, hops,
+                 realName) = info
+                assert flag in ("H", "G")
+                yield ":%s %s %s %s %s %s %s %s %s :%d %s" % (
+                    self.hostname, RPL_WHOREPLY, user, channel,
+                    username, hostmask, server, nickname, flag, hops, realName)
+
+            yield ":%s %s %s %s :End of /WHO list." % (
+                self.hostname, RPL_ENDOFWHO, user, channel)
 
-        self.sendLine(":%s %s %s %s :End of /WHO list." % (
-            self.hostname, RPL_ENDOFWHO, user, channel))
+        self.sendLines(lines())
 
 
     def whois(self, user, nick, username, hostname, realName, server, serverInfo, oper, idle, signOn, channels):
@@ -748,6 +1313,19 @@ class IRC(protocol.Protocol):
 
 
 
+# The function of IRC.sendLine, to tell when a subclass overrides it.
+_IRCSendLine = IRC.__dict__['sendLine']
+
+
+
+def _function(method):
+    """
+    Return the function of a method, which is the method itself on Python 3.
+    """
+    return getattr(method, '__func__', method)
+
+
+
 class ServerSupportedFeatures(_CommandDispatcherMixin):
     """
     Handle ISUPPORT messages.
@@ -1096,6 +1674,89 @@ class ServerSupportedFeatures(_CommandDispatcherMixin):
 
 
 
+class _SendQueue(object):
+    """
+    Lines waiting to be sent by an L{IRCClient} with a
+    L{IRCClient.lineRate}.
+
+    Lines are kept in three priority classes: I{PING} and I{PONG} first, then
+    any other command, and then messages (I{PRIVMSG} and I{NOTICE}).  The
+    messages are kept per target, and the targets are served in turn, so a
+    long paste to one channel doesn't hold back messages to others.
+
+    @ivar _urgent: Queued I{PING} and I{PONG} lines.
+    @type _urgent: L{deque}
+
+    @ivar _control: Queued lines of other commands than messages.
+    @type _control: L{deque}
+
+    @ivar _messages: Queued messages, by target.
+    @type _messages: L{dict} of L{deque}
+
+    @ivar _targets: Targets with queued messages, in the order they will be
+        served.
+    @type _targets: L{deque}
+    """
+    _urgentCommands = ('PING', 'PONG')
+    _messageCommands = ('PRIVMSG', 'NOTICE')
+
+    def __init__(self):
+        self._urgent = deque()
+        self._control = deque()
+        self._messages = {}
+        self._targets = deque()
+        self._length = 0
+
+
+    def __len__(self):
+        return self._length
+
+
+    def append(self, line):
+        """
+        Queue a line in its priority class.
+
+        @param line: The line to send.
+        @type line: L{str}
+        """
+        command, _, rest = line.partition(' ')
+        command = command.upper()
+        if command in self._urgentCommands:
+            self._urgent.append(line)
+        elif command in self._messageCommands:
+            target = rest.split(' ', 1)[0].lower()
+            if target not in self._messages:
+                self._messages[target] = deque()
+                self._targets.append(target)
+            self._messages[target].append(line)
+        else:
+            self._control.append(line)
+        self._length += 1
+
+
+    def popleft(self):
+        """
+        Remove and return the next line to send.
+
+        @raise IndexError: If the queue is empty.
+        """
+        if self._urgent:
+            line = self._urgent.popleft()
+        elif self._control:
+            line = self._control.popleft()
+        else:
+            target = self._targets.popleft()
+            messages = self._messages[target]
+            line = messages.popleft()
+            if messages:
+                self._targets.append(target)
+            else:
+                del self._messages[target]
+        self._length -= 1
+        return line
+
+
+
 class IRCClient(basic.LineReceiver):
     """
     Internet Relay Chat client protocol, with sprinkles.
@@ -1137,10 +1798,15 @@ class IRCClient(basic.LineReceiver):
     @ivar sourceURL: CTCP SOURCE reply, a URL where the source code of this
         client may be found.  If L{None}, no SOURCE reply will be sent.
 
-    @ivar lineRate: Minimum delay between lines sent to the server.  If
-        L{None}, no delay will be imposed.
+    @ivar lineRate: Minimum delay between lines sent to the server, once
+        L{lineBurst} lines have been sent at once.  If L{None}, no delay will
+        be imposed.  Queued lines are sent by priority, see L{_SendQueue}.
     @type lineRate: Number of Seconds.
 
+    @ivar lineBurst: Number of lines which may be sent at once, when no line
+        was sent during the last C{lineBurst * lineRate} seconds.
+    @type lineBurst: C{int}
+
     @ivar motd: Either L{None} or, between receipt of I{RPL_MOTDSTART} and
         I{RPL_ENDOFMOTD}, a L{list} of L{str}, each of which is the content
         of an I{RPL_MOTD} message.
@@ -1176,6 +1842,22 @@ class IRCClient(basic.LineReceiver):
     @ivar heartbeatInterval: Interval, in seconds, to send I{PING} messages to
         the server as a form of keepalive, defaults to 120 seconds. Use L{None}
         to disable the heartbeat.
+
+    @type capabilities: C{tuple} of C{str}
+    @ivar capabilities: IRCv3 capabilities to request during registration,
+        among those offered by the server.  If empty, no capability
+        negotiation is done.
+
+    @type enabledCapabilities: C{set} of C{str}
+    @ivar enabledCapabilities: Capabilities acknowledged by the server.
+
+    @type currentTags: C{dict}
+    @ivar currentTags: IRCv3 message tags of the message being handled, see
+        L{_parseTags}.
+
+    @type _batches: C{dict} or L{None}
+    @ivar _batches: Open batches, mapping each batch reference to a tuple of
+        its type, its parameters and the list of messages received so far.
     """
     hostname = None
     motd = None
@@ -1202,8 +1884,12 @@ class IRCClient(basic.LineReceiver):
     performLogin = 1
 
     lineRate = None
+    lineBurst = 1
     _queue = None
     _queueEmptying = None
+    _tokens = 0
+    _lastRefill = 0
+    _reactor = reactor
 
     delimiter = b'\n' # b'\r\n' will also work (see dataReceived)
 
@@ -1216,6 +1902,13 @@ class IRCClient(basic.LineReceiver):
     _heartbeat = None
     heartbeatInterval = 120
 
+    capabilities = ()
+    enabledCapabilities = frozenset()
+    currentTags = _NO_TAGS
+    _offeredCapabilities = None
+    _negotiatingCapabilities = False
+    _batches = None
+
 
     def _reallySendLine(self, line):
         quoteLine = lowQuote(line)
@@ -1232,18 +1925,63 @@ class IRCClient(basic.LineReceiver):
             if not self._queueEmptying:
                 self._sendLine()
 
+
+    def sendLines(self, lines):
+        """
+        Send several lines.
+
+        Without a L{lineRate}, the lines are written to the transport at once
+        with a single C{writeSequence} call.  Otherwise, or if L{sendLine} is
+        overridden, each line goes through L{sendLine}.
+
+        @param lines: The lines to send.
+        @type lines: iterable of L{str}
+        """
+        if (self.lineRate is not None or
+                _function(self.sendLine) is not _IRCClientSendLine):
+            for line in lines:
+                self.sendLine(line)
+            return
+
+        data = []
+        for line in lines:
+            line = lowQuote(line)
+            if isinstance(line, unicode):
+                line = line.encode("utf-8")
+            data.append(line)
+            data.append(b'\r' + self.delimiter)
+        self.transport.writeSequence(data)
+
     def _sendLine(self):
+        """
+        Send as many queued lines as the available tokens allow, and schedule
+        the next call for when a token will be available, if there are lines
+        left.
+
+        One token is added every L{lineRate} seconds, up to L{lineBurst}.
+        """
+        self._queueEmptying = None
+        now = self._reactor.seconds()
+        self._tokens = min(self.lineBurst,
+                           self._tokens + (now - self._lastRefill) /
+                           self.lineRate)
+        self._lastRefill = now
+
+        while self._queue and self._tokens >= 1:
+            self._reallySendLine(self._queue.popleft())
+            self._tokens -= 1
+
         if self._queue:
-            self._reallySendLine(self._queue.pop(0))
-            self._queueEmptying = reactor.callLater(self.lineRate,
-                                                    self._sendLine)
-        else:
-            self._queueEmptying = None
+            self._queueEmptying = self._reactor.callLater(
+                (1 - self._tokens) * self.lineRate, self._sendLine)
 
 
     def connectionLost(self, reason):
         basic.LineReceiver.connectionLost(self, reason)
         self.stopHeartbeat()
+        if self._queueEmptying is not None:
+            self._queueEmptying.cancel()
+            self._queueEmptying = None
 
 
     def _createHeartbeat(self):
@@ -1695,16 +2433,16 @@ class IRCClient(basic.LineReceiver):
         side) while the length is still being calculated.
         """
         # :nickname!realname@hostname COMMAND ...
-        theoretical = ':%s!%s@%s %s' % (
-            'a' * self.supported.getFeature('NICKLEN'),
+        theoretical = (
+            4 + self.supported.getFeature('NICKLEN') +
             # This value is based on observation.
-            'b' * 10,
+            10 +
             # See <http://tools.ietf.org/html/rfc2812#section-2.3.1>.
-            'c' * 63,
-            command)
+            63 +
+            len(command))
         # Fingers crossed.
         fudge = 10
-        return MAX_COMMAND_LENGTH - len(theoretical) - fudge
+        return MAX_COMMAND_LENGTH - theoretical - fudge
 
 
     def msg(self, user, message, length=None):
@@ -1716,12 +2454,15 @@ class IRCClient(basic.LineReceiver):
          - Any span between newline characters is longer than the given
            line-length.
 
+        Lengths are counted in bytes of UTF-8, and a message is never split
+        inside the encoding of a character.
+
         @param user: Username or channel name to which to direct the
             message.
         @type user: C{str}
 
         @param message: Text to send.
-        @type message: C{str}
+        @type message: C{str} or C{unicode}
 
         @param length: Maximum number of octets to send in a single
             command, including the IRC protocol framing. If L{None} is given
@@ -1730,17 +2471,23 @@ class IRCClient(basic.LineReceiver):
         @type length: C{int}
         """
         fmt = 'PRIVMSG %s :' % (user,)
+        if not isinstance(fmt, str):
+            fmt = fmt.encode('utf-8')
 
         if length is None:
             length = self._safeMaximumLineLength(fmt)
 
         # Account for the line terminator.
-        minimumLength = len(fmt) + 2
+        if _PY3:
+            minimumLength = len(fmt.encode('utf-8')) + 2
+        else:
+            minimumLength = len(fmt) + 2
         if length <= minimumLength:
             raise ValueError("Maximum length must exceed %d for message "
                              "to %s" % (minimumLength, user))
-        for line in split(message, length - minimumLength):
-            self.sendLine(fmt + line)
+        self.sendLines([fmt + line
+                        for line in _splitUTF8(message,
+                                               length - minimumLength)])
 
 
     def notice(self, user, message):
@@ -1802,6 +2549,9 @@ class IRCClient(basic.LineReceiver):
         @type servername: C{str}
         @param servername: If specified, the servername to logon as.
         """
+        if self.capabilities:
+            self._negotiatingCapabilities = True
+            self.sendLine("CAP LS 302")
         if self.password is not None:
             self.sendLine("PASS %s" % self.password)
         self.setNick(nickname)
@@ -2189,6 +2939,117 @@ class IRCClient(basic.LineReceiver):
     def irc_RPL_LUSERME(self, prefix, params):
         self.luserMe(params[1])
 
+    def irc_CAP(self, prefix, params):
+        """
+        Handle the capability negotiation replies from the server.
+        """
+        subcommand = params[1].upper()
+        capabilities = params[-1].split()
+
+        if subcommand == 'LS':
+            if self._offeredCapabilities is None:
+                self._offeredCapabilities = set()
+            for capability in capabilities:
+                self._offeredCapabilities.add(capability.split('=', 1)[0])
+            if len(params) > 3 and params[2] == '*':
+                # More capabilities are listed in the following lines.
+                return
+            wanted = [capability for capability in self.capabilities
+                      if capability in self._offeredCapabilities]
+            self._offeredCapabilities = None
+            if wanted:
+                self.sendLine("CAP REQ :%s" % (' '.join(wanted),))
+            else:
+                self._endCapabilityNegotiation()
+        elif subcommand == 'ACK':
+            enabled = set(self.enabledCapabilities)
+            for capability in capabilities:
+                if capability[0:1] == '-':
+                    enabled.discard(capability[1:])
+                else:
+                    enabled.add(capability)
+            self.enabledCapabilities = enabled
+            self._endCapabilityNegotiation()
+        elif subcommand == 'NAK':
+            self._endCapabilityNegotiation()
+
+
+    def _endCapabilityNegotiation(self):
+        """
+        Finish the capability negotiation started during registration, if it
+        is still going on.
+        """
+        if self._negotiatingCapabilities:
+            self._negotiatingCapabilities = False
+            self.sendLine("CAP END")
+            self.capabilitiesNegotiated(set(self.enabledCapabilities))
+
+
+    def capabilitiesNegotiated(self, capabilities):
+        """
+        Called when the capability negotiation done during registration
+        finishes.
+
+        @param capabilities: The capabilities acknowledged by the server.
+        @type capabilities: C{set} of C{str}
+        """
+
+
+    def irc_BATCH(self, prefix, params):
+        """
+        Open or close a batch of messages.
+
+        Messages tagged with the reference of an open batch are held until the
+        batch is closed, and then passed to L{batchReceived}.
+        """
+        reference = params[0]
+        if reference[0:1] == '+':
+            if self._batches is None:
+                self._batches = {}
+            self._batches[reference[1:]] = (params[1], params[2:], [])
+        elif reference[0:1] == '-' and self._batches:
+            batch = self._batches.pop(reference[1:], None)
+            if batch is not None:
+                self.batchReceived(*batch)
+
+
+    def batchReceived(self, batchType, parameters, messages):
+        """
+        Called when a batch of messages has been received completely.
+
+        The default implementation handles every message of the batch, in the
+        order they were received.  Nested batches are delivered when they are
+        closed, before the batch that contains them.
+
+        @param batchType: The type of the batch, for example C{"netsplit"}
+            or C{"chathistory"}.
+        @type batchType: C{str}
+
+        @param parameters: The parameters of the batch.
+        @type parameters: C{list} of C{str}
+
+        @param messages: The messages of the batch.
+        @type messages: C{list} of L{_Message}
+        """
+        for message in messages:
+            self._handleMessage(message)
+
+
+    def _handleMessage(self, message):
+        """
+        Call L{handleCommand} for a message, with L{currentTags} set to its
+        tags.
+
+        @type message: L{_Message}
+        """
+        previousTags = self.currentTags
+        self.currentTags = message.tags
+        try:
+            self.handleCommand(message.command, message.prefix, message.params)
+        finally:
+            self.currentTags = previousTags
+
+
     def irc_unknown(self, prefix, command, params):
         pass
 
@@ -2620,30 +3481,51 @@ class IRCClient(basic.LineReceiver):
 
     def connectionMade(self):
         self.supported = ServerSupportedFeatures()
-        self._queue = []
+        self._queue = _SendQueue()
+        self._tokens = self.lineBurst
+        self._lastRefill = self._reactor.seconds()
         if self.performLogin:
             self.register(self.nickname)
 
     def dataReceived(self, data):
         if isinstance(data, unicode):
             data = data.encode("utf-8")
-        data = data.replace(b'\r', b'')
         basic.LineReceiver.dataReceived(self, data)
 
 
     def lineReceived(self, line):
+        # Lines end with CRLF, or just LF (see delimiter).
+        if line[-1:] == b'\r':
+            line = line[:-1]
         if bytes != str and isinstance(line, bytes):
             # decode bytes from transport to unicode
             line = line.decode("utf-8")
 
-        line = lowDequote(line)
-        try:
-            prefix, command, params = parsemsg(line)
-            if command in numeric_to_symbolic:
-                command = numeric_to_symbolic[command]
+        if M_QUOTE in line:
+            line = lowDequote(line)
+        if line[0:1] != '@':
+            # Messages without tags are not part of any batch, and leave
+            # currentTags empty.
+            try:
+                prefix, command, params = _splitMessage(line)
+            except IRCBadMessage:
+                self.badMessage(line, *sys.exc_info())
+                return
             self.handleCommand(command, prefix, params)
+            return
+
+        try:
+            message = _parseMessage(line)
         except IRCBadMessage:
             self.badMessage(line, *sys.exc_info())
+            return
+
+        batch = message.tags.get('batch')
+        if (batch is not None and self._batches and
+                batch in self._batches and message.command != 'BATCH'):
+            self._batches[batch][2].append(message)
+        else:
+            self._handleMessage(message)
 
 
     def getUserModeParams(self):
@@ -2703,6 +3585,21 @@ class IRCClient(basic.LineReceiver):
             log.deferr()
 
 
+    def observeCommands(self, observer):
+        """
+        Call C{observer} with each command handled from now on and the time
+        spent handling it, in seconds, to find out which handlers are hot.
+
+        Commands are handled without any check for an observer as long as
+        none is set.
+
+        @param observer: The new observer, replacing the previous one, or
+            L{None} to stop observing commands.
+        @type observer: callable or L{None}
+        """
+        _observeCommands(self, observer)
+
+
     def __getstate__(self):
         dct = self.__dict__.copy()
         dct['dcc_sessions'] = None
@@ -2710,6 +3607,10 @@ class IRCClient(basic.LineReceiver):
         return dct
 
 
+# The function of IRCClient.sendLine, to tell when a subclass overrides it.
+_IRCClientSendLine = IRCClient.__dict__['sendLine']
+
+
 def dccParseAddress(address):
     if '.' in address:
         pass
@@ -3364,188 +4265,106 @@ def _foldr(f, z, xs):
 
 
 
-class _FormattingParser(_CommandDispatcherMixin):
-    """
-    A finite-state machine that parses formatted IRC text.
-
-    Currently handled formatting includes: bold, reverse, underline,
-    mIRC color codes and the ability to remove all current formatting.
-
-    @see: U{http://www.mirc.co.uk/help/color.txt}
+# A formatting code: either a single toggle/reset code, or a color code with
+# an optional foreground of up to two digits, which may be followed by a comma
+# and an optional background of up to two digits.
+_formattingCodePattern = re.compile(
+    '([%s%s%s%s])|%s(?:([0-9]{1,2})(?:,([0-9]{1,2})?)?)?' % (
+        _OFF, _BOLD, _REVERSE_VIDEO, _UNDERLINE, _COLOR))
 
-    @type _formatCodes: C{dict} mapping C{str} to C{str}
-    @cvar _formatCodes: Mapping of format code values to names.
+_toggleAttributes = {
+    _BOLD: 'bold',
+    _REVERSE_VIDEO: 'reverseVideo',
+    _UNDERLINE: 'underline'}
 
-    @type state: C{str}
-    @ivar state: Current state of the finite-state machine.
 
-    @type _buffer: C{str}
-    @ivar _buffer: Buffer, containing the text content, of the formatting
-        sequence currently being parsed, the buffer is used as the content for
-        L{_attrs} before being added to L{_result} and emptied upon calling
-        L{emit}.
 
-    @type _attrs: C{set}
-    @ivar _attrs: Set of the applicable formatting states (bold, underline,
-        etc.) for the current L{_buffer}, these are applied to L{_buffer} when
-        calling L{emit}.
-
-    @type foreground: L{_ForegroundColorAttr}
-    @ivar foreground: Current foreground color attribute, or L{None}.
-
-    @type background: L{_BackgroundColorAttr}
-    @ivar background: Current background color attribute, or L{None}.
-
-    @ivar _result: Current parse result.
+def formattingSpans(text):
     """
-    prefix = 'state'
-
-
-    _formatCodes = {
-        _OFF: 'off',
-        _BOLD: 'bold',
-        _COLOR: 'color',
-        _REVERSE_VIDEO: 'reverseVideo',
-        _UNDERLINE: 'underline'}
-
-
-    def __init__(self):
-        self.state = 'TEXT'
-        self._buffer = ''
-        self._attrs = set()
-        self._result = None
-        self.foreground = None
-        self.background = None
-
-
-    def process(self, ch):
-        """
-        Handle input.
-
-        @type ch: C{str}
-        @param ch: A single character of input to process
-        """
-        self.dispatch(self.state, ch)
-
-
-    def complete(self):
-        """
-        Flush the current buffer and return the final parsed result.
+    Split text containing IRC formatting codes into plain text and a flat list
+    of the formatting of its parts.
 
-        @return: Structured text and attributes.
-        """
-        self.emit()
-        if self._result is None:
-            self._result = attributes.normal
-        return self._result
-
-
-    def emit(self):
-        """
-        Add the currently parsed input to the result.
-        """
-        if self._buffer:
-            attrs = [getattr(attributes, name) for name in self._attrs]
-            attrs.extend(filter(None, [self.foreground, self.background]))
-            if not attrs:
-                attrs.append(attributes.normal)
-            attrs.append(self._buffer)
+    The formatting codes are found with a single regular expression, rather
+    than a character at a time, and no attribute structure is built, so the
+    result maps directly onto ranges of a text buffer.
 
-            attr = _foldr(operator.getitem, attrs.pop(), attrs)
-            if self._result is None:
-                self._result = attr
-            else:
-                self._result[attr]
-            self._buffer = ''
-
-
-    def state_TEXT(self, ch):
-        """
-        Handle the "text" state.
+    Color codes are mapped from 0 to 15 and wrap around if greater than 15.
 
-        Along with regular text, single token formatting codes are handled
-        in this state too.
+    @type text: C{str}
+    @param text: Formatted text to parse.
 
-        @param ch: The character being processed.
-        """
-        formatName = self._formatCodes.get(ch)
-        if formatName == 'color':
-            self.emit()
-            self.state = 'COLOR_FOREGROUND'
+    @rtype: C{tuple} of C{str} and C{list}
+    @return: The text without any control sequences, and a list of
+        C{(start, end, state)} tuples, one for each run of text between
+        formatting codes, where C{start} and C{end} are offsets in the plain
+        text and C{state} is the L{_FormattingState} of the run.  Runs with
+        the same formatting share the same state, which must not be modified.
+    """
+    chunks = []
+    spans = []
+    state = _FormattingState()
+    offset = 0
+    position = 0
+
+    for match in _formattingCodePattern.finditer(text):
+        start = match.start()
+        if start > position:
+            chunk = text[position:start]
+            chunks.append(chunk)
+            spans.append((offset, offset + len(chunk), state))
+            offset += len(chunk)
+        position = match.end()
+
+        code, foreground, background = match.groups()
+        if code == _OFF:
+            state = _FormattingState()
+        elif code is not None:
+            name = _toggleAttributes[code]
+            state = state.copy()
+            setattr(state, name, not getattr(state, name))
+        elif foreground is None:
+            # An empty color code resets both colors.
+            state = state.copy()
+            state.foreground = state.background = None
         else:
-            if formatName is None:
-                self._buffer += ch
-            else:
-                self.emit()
-                if formatName == 'off':
-                    self._attrs = set()
-                    self.foreground = self.background = None
-                else:
-                    self._attrs.symmetric_difference_update([formatName])
+            # Wrap around for color numbers higher than we support, like most
+            # other IRC clients.
+            state = state.copy()
+            state.foreground = int(foreground) % len(_IRC_COLORS)
+            if background is not None:
+                state.background = int(background) % len(_IRC_COLORS)
 
+    if position < len(text):
+        chunk = text[position:]
+        chunks.append(chunk)
+        spans.append((offset, offset + len(chunk), state))
 
-    def state_COLOR_FOREGROUND(self, ch):
-        """
-        Handle the foreground color state.
+    return ''.join(chunks), spans
 
-        Foreground colors can consist of up to two digits and may optionally
-        end in a I{,}. Any non-digit or non-comma characters are treated as
-        invalid input and result in the state being reset to "text".
-
-        @param ch: The character being processed.
-        """
-        # Color codes may only be a maximum of two characters.
-        if ch.isdigit() and len(self._buffer) < 2:
-            self._buffer += ch
-        else:
-            if self._buffer:
-                # Wrap around for color numbers higher than we support, like
-                # most other IRC clients.
-                col = int(self._buffer) % len(_IRC_COLORS)
-                self.foreground = getattr(attributes.fg, _IRC_COLOR_NAMES[col])
-            else:
-                # If there were no digits, then this has been an empty color
-                # code and we can reset the color state.
-                self.foreground = self.background = None
-
-            if ch == ',' and self._buffer:
-                # If there's a comma and it's not the first thing, move on to
-                # the background state.
-                self._buffer = ''
-                self.state = 'COLOR_BACKGROUND'
-            else:
-                # Otherwise, this is a bogus color code, fall back to text.
-                self._buffer = ''
-                self.state = 'TEXT'
-                self.emit()
-                self.process(ch)
 
 
-    def state_COLOR_BACKGROUND(self, ch):
-        """
-        Handle the background color state.
+def _formattedSpan(state, text):
+    """
+    Apply the attributes of a formatting state to text.
 
-        Background colors can consist of up to two digits and must occur after
-        a foreground color and must be preceded by a I{,}. Any non-digit
-        character is treated as invalid input and results in the state being
-        set to "text".
+    @type state: L{_FormattingState}
+    @param state: Formatting of C{text}.
 
-        @param ch: The character being processed.
-        """
-        # Color codes may only be a maximum of two characters.
-        if ch.isdigit() and len(self._buffer) < 2:
-            self._buffer += ch
-        else:
-            if self._buffer:
-                # Wrap around for color numbers higher than we support, like
-                # most other IRC clients.
-                col = int(self._buffer) % len(_IRC_COLORS)
-                self.background = getattr(attributes.bg, _IRC_COLOR_NAMES[col])
-                self._buffer = ''
+    @type text: C{str}
+    @param text: Plain text.
 
-            self.emit()
-            self.state = 'TEXT'
-            self.process(ch)
+    @return: Structured text and attributes.
+    """
+    attrs = [getattr(attributes, name)
+             for name in ('bold', 'underline', 'reverseVideo')
+             if getattr(state, name)]
+    if state.foreground is not None:
+        attrs.append(getattr(attributes.fg, _IRC_COLOR_NAMES[state.foreground]))
+    if state.background is not None:
+        attrs.append(getattr(attributes.bg, _IRC_COLOR_NAMES[state.background]))
+    if not attrs:
+        attrs.append(attributes.normal)
+    return _foldr(operator.getitem, text, attrs)
 
 
 
@@ -3560,12 +4379,18 @@ def parseFormattedText(text):
 
     @return: Structured text and attributes.
 
+    @see: L{formattingSpans}
+
     @since: 13.1
     """
-    state = _FormattingParser()
-    for ch in text:
-        state.process(ch)
-    return state.complete()
+    plain, spans = formattingSpans(text)
+    if not spans:
+        return attributes.normal
+
+    result = _formattedSpan(spans[0][2], plain[spans[0][0]:spans[0][1]])
+    for start, end, state in spans[1:]:
+        result[_formattedSpan(state, plain[start:end])]
+    return result
 
 
 
@@ -3638,9 +4463,7 @@ def stripFormatting(text):
 
     @since: 13.1
     """
-    formatted = parseFormattedText(text)
-    return _textattributes.flatten(
-        formatted, _textattributes.DefaultFormattingState())
+    return _formattingCodePattern.sub('', text)
 
 
 
@@ -3652,41 +4475,36 @@ def ctcpExtract(message):
     """
     Extract CTCP data from a string.
 
+    Messages without any CTCP delimiter, which are most of them, are returned
+    as they are without being split or dequoted.
+
     @return: A C{dict} containing two keys:
        - C{'extended'}: A list of CTCP (tag, data) tuples.
        - C{'normal'}: A list of strings which were not inside a CTCP delimiter.
     """
-    extended_messages = []
-    normal_messages = []
-    retval = {'extended': extended_messages,
-              'normal': normal_messages }
-
-    messages = message.split(X_DELIM)
-    odd = 0
+    if X_DELIM not in message:
+        return {'extended': [],
+                'normal': [message] if message else []}
 
     # X1 extended data X2 nomal data X3 extended data X4 normal...
-    while messages:
-        if odd:
-            extended_messages.append(messages.pop(0))
-        else:
-            normal_messages.append(messages.pop(0))
-        odd = not odd
-
-    extended_messages[:] = filter(None, extended_messages)
-    normal_messages[:] = filter(None, normal_messages)
+    messages = message.split(X_DELIM)
+    normal_messages = [m for m in messages[::2] if m]
+    extended_messages = []
 
-    extended_messages[:] = map(ctcpDequote, extended_messages)
-    for i in xrange(len(extended_messages)):
-        m = extended_messages[i].split(SPC, 1)
+    for m in messages[1::2]:
+        if not m:
+            continue
+        m = ctcpDequote(m).split(SPC, 1)
         tag = m[0]
         if len(m) > 1:
             data = m[1]
         else:
             data = None
 
-        extended_messages[i] = (tag, data)
+        extended_messages.append((tag, data))
 
-    return retval
+    return {'extended': extended_messages,
+            'normal': normal_messages }
 
 # CTCP escaping
 
@@ -3712,6 +4530,9 @@ def lowQuote(s):
     return s
 
 def lowDequote(s):
+    if M_QUOTE not in s:
+        return s
+
     def sub(matchobj, mDequoteTable=mDequoteTable):
         s = matchobj.group()[1]
         try:
@@ -3742,6 +4563,9 @@ def ctcpQuote(s):
     return s
 
 def ctcpDequote(s):
+    if X_QUOTE not in s:
+        return s
+
     def sub(matchobj, xDequoteTable=xDequoteTable):
         s = matchobj.group()[1]
         try:
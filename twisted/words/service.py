@@ -44,6 +44,14 @@ from twisted.words.protocols import irc
 
 @implementer(iwords.IGroup)
 class Group(object):
+    """
+    A group of chat clients, keyed by their names.
+
+    @ivar realm: The realm this group was added to, told by L{_changed}
+        when its users or metadata change, or L{None}.
+    """
+    realm = None
+
     def __init__(self, name):
         self.name = name
         self.users = {}
@@ -60,21 +68,58 @@ class Group(object):
     def _cbUserCall(self, results):
         for (success, result) in results:
             if not success:
-                user, err = result.value # XXX
+                user, err = result.value.args
                 self.remove(user, err.getErrorMessage())
 
 
+    def _changed(self):
+        """
+        Tell the realm the users or the metadata of this group changed.
+        """
+        if self.realm is not None:
+            self.realm.groupChanged(self)
+
+
+    def _callUsers(self, exclude, name, *args):
+        """
+        Call a method of every member but C{exclude}, and remove the members
+        it fails for.
+
+        The method is called directly: only the results which are Deferreds
+        are waited for, the members returning anything else are done.
+
+        @param exclude: The member not to call, or L{None}.
+
+        @param name: The name of the L{iwords.IChatClient} method to call.
+        @type name: L{str}
+
+        @param args: The arguments of the method.
+        """
+        calls = []
+        failures = []
+        for p in itervalues(self.users):
+            if p is exclude:
+                continue
+            try:
+                result = getattr(p, name)(*args)
+            except:
+                failures.append((p, failure.Failure()))
+            else:
+                if isinstance(result, defer.Deferred):
+                    calls.append(result.addErrback(self._ebUserCall, p=p))
+        for p, err in failures:
+            self.remove(p, err.getErrorMessage())
+        if calls:
+            d = defer.DeferredList(calls, consumeErrors=True)
+            d.addCallback(self._cbUserCall)
+
+
     def add(self, user):
         assert iwords.IChatClient.providedBy(user), "%r is not a chat client" % (user,)
         if user.name not in self.users:
-            additions = []
             self.users[user.name] = user
-            for p in itervalues(self.users):
-                if p is not user:
-                    d = defer.maybeDeferred(p.userJoined, self, user)
-                    d.addErrback(self._ebUserCall, p=p)
-                    additions.append(d)
-            defer.DeferredList(additions).addCallback(self._cbUserCall)
+            self._changed()
+            self._callUsers(user, 'userJoined', self, user)
         return defer.succeed(None)
 
 
@@ -84,13 +129,8 @@ class Group(object):
         except KeyError:
             pass
         else:
-            removals = []
-            for p in itervalues(self.users):
-                if p is not user:
-                    d = defer.maybeDeferred(p.userLeft, self, user, reason)
-                    d.addErrback(self._ebUserCall, p=p)
-                    removals.append(d)
-            defer.DeferredList(removals).addCallback(self._cbUserCall)
+            self._changed()
+            self._callUsers(user, 'userLeft', self, user, reason)
         return defer.succeed(None)
 
 
@@ -99,25 +139,46 @@ class Group(object):
 
 
     def receive(self, sender, recipient, message):
+        """
+        Deliver a message to every member but its sender.
+
+        The lines for L{IRCUser} members are formatted once for all of them,
+        for every hostname and encoding, and written directly, after any
+        reply still being written to them; other chat clients are called
+        through Deferreds.
+        """
         assert recipient is self
         receives = []
+        failures = []
+        formatted = {}
         for p in itervalues(self.users):
-            if p is not sender:
+            if p is sender:
+                continue
+            if _canBroadcast(p):
+                key = (p.hostname, p.encoding)
+                try:
+                    data = formatted.get(key)
+                    if data is None:
+                        data = formatted[key] = p.formatReceive(
+                            sender, self, message)
+                    p._write(data)
+                except:
+                    failures.append((p, failure.Failure()))
+            else:
                 d = defer.maybeDeferred(p.receive, sender, self, message)
                 d.addErrback(self._ebUserCall, p=p)
                 receives.append(d)
-        defer.DeferredList(receives).addCallback(self._cbUserCall)
+        for p, err in failures:
+            self.remove(p, err.getErrorMessage())
+        if receives:
+            defer.DeferredList(receives).addCallback(self._cbUserCall)
         return defer.succeed(None)
 
 
     def setMetadata(self, meta):
         self.meta = meta
-        sets = []
-        for p in itervalues(self.users):
-            d = defer.maybeDeferred(p.groupMetaUpdate, self, meta)
-            d.addErrback(self._ebUserCall, p=p)
-            sets.append(d)
-        defer.DeferredList(sets).addCallback(self._cbUserCall)
+        self._changed()
+        self._callUsers(None, 'groupMetaUpdate', self, meta)
         return defer.succeed(None)
 
 
@@ -128,12 +189,23 @@ class Group(object):
 
 @implementer(iwords.IUser)
 class User(object):
+    """
+    A user of a chat service.
+
+    @ivar groups: The groups joined by this user, in the order they were
+        joined.
+    @type groups: L{list}
+
+    @ivar _joined: The same groups, to tell whether one was joined.
+    @type _joined: L{set}
+    """
     realm = None
     mind = None
 
     def __init__(self, name):
         self.name = name
         self.groups = []
+        self._joined = set()
         self.lastMessage = time()
 
 
@@ -145,14 +217,18 @@ class User(object):
 
     def join(self, group):
         def cbJoin(result):
-            self.groups.append(group)
+            if group not in self._joined:
+                self._joined.add(group)
+                self.groups.append(group)
             return result
         return group.add(self.mind).addCallback(cbJoin)
 
 
     def leave(self, group, reason=None):
         def cbLeave(result):
-            self.groups.remove(group)
+            if group in self._joined:
+                self._joined.remove(group)
+                self.groups.remove(group)
             return result
         return group.remove(self.mind, reason).addCallback(cbLeave)
 
@@ -194,14 +270,21 @@ class IRCUser(irc.IRC):
     # How to handle unicode (TODO: Make this customizable on a per-user basis)
     encoding = 'utf-8'
 
+    # Flood control, as in RFC 1459 section 8.10: a command every two
+    # seconds, after a burst of ten
+    commandRate = 2
+    commandBurst = 10
+
     # Twisted callbacks
     def connectionMade(self):
         self.irc_PRIVMSG = self.irc_NICKSERV_PRIVMSG
         self.realm = self.factory.realm
         self.hostname = self.realm.name
+        irc.IRC.connectionMade(self)
 
 
     def connectionLost(self, reason):
+        irc.IRC.connectionLost(self, reason)
         if self.logout is not None:
             self.logout()
             self.avatar = None
@@ -237,21 +320,39 @@ class IRCUser(irc.IRC):
             (reason or u"leaving"))
 
 
-    def receive(self, sender, recipient, message):
-        #>> :glyph!glyph@adsl-64-123-27-108.dsl.austtx.swbell.net PRIVMSG glyph_ :hello
+    def formatReceive(self, sender, recipient, message):
+        """
+        Format the lines L{receive} sends for a message, as they are written
+        to the transport.
+
+        @param sender: The L{IUser} who sent the message.
+
+        @param recipient: The L{IGroup} or L{IUser} the message was sent to.
+
+        @param message: The message, a C{dict} with a C{'text'} key.
 
-        # omg???????????
+        @rtype: L{bytes}
+        """
         if iwords.IGroup.providedBy(recipient):
             recipientName = '#' + recipient.name
         else:
             recipientName = recipient.name
 
+        prefix = '%s!%s@%s' % (sender.name, sender.name, self.hostname)
         text = message.get('text', '<an unrepresentable message>')
+        data = []
         for L in text.splitlines():
-            self.privmsg(
-                '%s!%s@%s' % (sender.name, sender.name, self.hostname),
-                recipientName,
-                L)
+            line = ':%s PRIVMSG %s :%s%s%s' % (
+                prefix, recipientName, irc.lowQuote(L), irc.CR, irc.LF)
+            if isinstance(line, unicode):
+                line = line.encode(self.encoding if self.encoding else "utf-8")
+            data.append(line)
+        return b''.join(data)
+
+
+    def receive(self, sender, recipient, message):
+        #>> :glyph!glyph@adsl-64-123-27-108.dsl.austtx.swbell.net PRIVMSG glyph_ :hello
+        self._write(self.formatReceive(sender, recipient, message))
 
 
     def groupMetaUpdate(self, group, meta):
@@ -619,6 +720,12 @@ class IRCUser(irc.IRC):
         def cbGroup(group):
             def cbLeave(result):
                 self.userLeft(group, self, reason)
+            if group not in self.avatar.itergroups():
+                self.sendMessage(
+                    irc.ERR_NOTONCHANNEL,
+                    '#' + group.name,
+                    ":You're not on that channel")
+                return
             return self.avatar.leave(group, reason).addCallback(cbLeave)
 
         def ebGroup(err):
@@ -641,33 +748,33 @@ class IRCUser(irc.IRC):
         #>> :benford.openprojects.net 353 glyph = #python :Orban ... @glyph ... Zymurgy skreech
         #>> :benford.openprojects.net 366 glyph #python :End of /NAMES list.
         try:
-            channel = params[-1]
-            if isinstance(channel, bytes):
-                channel = channel.decode(self.encoding)
+            allChannels = params[-1]
+            if isinstance(allChannels, bytes):
+                allChannels = allChannels.decode(self.encoding)
         except UnicodeDecodeError:
             self.sendMessage(
                 irc.ERR_NOSUCHCHANNEL, params[-1],
                 ":No such channel (could not decode your unicode!)")
             return
 
-        if channel.startswith('#'):
-            channel = channel[1:]
-
-        def cbGroup(group):
-            self.names(
-                self.name,
-                '#' + group.name,
-                [user.name for user in group.iterusers()])
+        channels = []
+        for channel in allChannels.split(','):
+            if channel.startswith('#'):
+                channel = channel[1:]
+            channels.append(channel)
 
-        def ebGroup(err):
-            err.trap(ewords.NoSuchGroup)
-            # No group?  Fine, no names!
-            self.names(
-                self.name,
-                '#' + channel,
-                [])
+        def cbGroups(groups):
+            for channel, group in zip(channels, groups):
+                if group is None:
+                    # No group?  Fine, no names!
+                    self.names(self.name, '#' + channel, [])
+                else:
+                    self.names(
+                        self.name,
+                        '#' + group.name,
+                        [user.name for user in group.iterusers()])
 
-        self.realm.lookupGroup(channel).addCallbacks(cbGroup, ebGroup)
+        self.realm.lookupGroups(channels).addCallback(cbGroups)
 
 
     def irc_TOPIC(self, prefix, params):
@@ -755,9 +862,18 @@ class IRCUser(irc.IRC):
         @param channel: Information about the channels being sent:
         their name, the number of participants, and their topic.
         """
-        for (name, size, topic) in channels:
-            self.sendMessage(irc.RPL_LIST, name, str(size), ":" + topic)
-        self.sendMessage(irc.RPL_LISTEND, ":End of /LIST")
+        def lines():
+            for (name, size, topic) in channels:
+                if isinstance(name, bytes):
+                    name = name.decode("utf-8")
+                if isinstance(topic, bytes):
+                    topic = topic.decode("utf-8")
+                yield u":%s %s %s %s %s :%s" % (
+                    self.hostname, irc.RPL_LIST, self.name, name, size, topic)
+            yield u":%s %s %s :End of /LIST" % (
+                self.hostname, irc.RPL_LISTEND, self.name)
+
+        self.sendLines(lines())
 
 
     def irc_LIST(self, prefix, params):
@@ -786,26 +902,21 @@ class IRCUser(irc.IRC):
                     ":No such channel (could not decode your unicode!)")
                 return
 
-            groups = []
+            names = []
             for ch in channels:
                 if ch.startswith('#'):
                     ch = ch[1:]
-                groups.append(self.realm.lookupGroup(ch))
+                names.append(ch)
 
-            groups = defer.DeferredList(groups, consumeErrors=True)
-            groups.addCallback(lambda gs: [r for (s, r) in gs if s])
+            groups = self.realm.lookupGroups(names)
+            groups.addCallback(
+                lambda gs: [group for group in gs if group is not None])
         else:
             # Return information about all channels
             groups = self.realm.itergroups()
 
-        def cbGroups(groups):
-            def gotSize(size, group):
-                return group.name, size, group.meta.get('topic')
-            d = defer.DeferredList([
-                group.size().addCallback(gotSize, group) for group in groups])
-            d.addCallback(lambda results: self.list([r for (s, r) in results if s]))
-            return d
-        groups.addCallback(cbGroups)
+        groups.addCallback(self.realm.listGroups)
+        groups.addCallback(self.list)
 
 
     def _channelWho(self, group):
@@ -911,6 +1022,46 @@ class IRCUser(irc.IRC):
         self.sendMessage(irc.ERR_NOOPERHOST, ":O-lines not applicable")
 
 
+
+# Methods of IRCUser involved in receiving a message; a subclass overriding
+# any of them gets its messages through IRCUser.receive.
+_broadcastMethods = ('receive', 'formatReceive', 'privmsg', 'sendCommand',
+                     'sendLine')
+
+# Classes of chat clients, mapped to whether they can be written
+# preformatted lines by Group.receive.
+_broadcastClasses = {}
+
+
+
+def _canBroadcast(client):
+    """
+    Tell whether a chat client is an L{IRCUser} whose lines for a message can
+    be formatted by L{IRCUser.formatReceive} and written to its transport,
+    instead of calling its C{receive} method.
+    """
+    cls = client.__class__
+    result = _broadcastClasses.get(cls)
+    if result is None:
+        result = issubclass(cls, IRCUser) and all(
+            irc._function(getattr(cls, name)) is
+            irc._function(getattr(IRCUser, name))
+            for name in _broadcastMethods)
+        _broadcastClasses[cls] = result
+    return result and client.transport is not None
+
+
+
+def _hasPlainSize(group):
+    """
+    Tell whether the size of a group is the number of its users, as computed
+    by L{Group.size}.
+    """
+    return (isinstance(group, Group) and 'size' not in vars(group) and
+            irc._function(group.__class__.size) is irc._function(Group.size))
+
+
+
 class IRCFactory(protocol.ServerFactory):
     """
     IRC server that creates instances of the L{IRCUser} protocol.
@@ -1172,6 +1323,87 @@ class WordsRealm(object):
         raise NotImplementedError
 
 
+    def lookupGroups(self, names):
+        """
+        Look up several groups at once.
+
+        @param names: The names of the groups.
+        @type names: iterable of L{unicode}
+
+        @rtype: L{twisted.internet.defer.Deferred}
+        @return: A Deferred which fires with a L{list} of the groups, in the
+            order of C{names}, with L{None} for the names without a group.
+        """
+        d = defer.DeferredList(
+            [self.lookupGroup(name) for name in names], consumeErrors=True)
+        d.addCallback(
+            lambda results: [group if success else None
+                             for (success, group) in results])
+        return d
+
+
+    def listGroups(self, groups):
+        """
+        Describe groups as the I{LIST} command does.
+
+        The size of a plain L{Group} is known right away, only other groups
+        are asked for it.
+
+        @param groups: The groups to describe.
+        @type groups: iterable of L{IGroup}
+
+        @rtype: L{twisted.internet.defer.Deferred}
+        @return: A Deferred which fires with a L{list} of the name, size and
+            topic of the groups, in their order, leaving out those whose
+            size could not be found.
+        """
+        def gotSize(size, group):
+            return group.name, size, group.meta.get('topic')
+
+        results = []
+        sizes = []
+        for group in groups:
+            entry = self._listEntry(group)
+            if entry is not None:
+                results.append((True, entry))
+            else:
+                d = group.size().addCallback(gotSize, group)
+                sizes.append((len(results), d))
+                results.append(None)
+
+        if not sizes:
+            return defer.succeed([r for (s, r) in results])
+
+        def gotSizes(sized):
+            for (index, d), result in zip(sizes, sized):
+                results[index] = result
+            return [r for (s, r) in results if s]
+        d = defer.DeferredList([d for (index, d) in sizes])
+        d.addCallback(gotSizes)
+        return d
+
+
+    def _listEntry(self, group):
+        """
+        Describe a plain L{Group} for L{listGroups}.
+
+        @return: The name, size and topic of the group, or L{None} if its
+            size must be asked for.
+        """
+        if _hasPlainSize(group):
+            return group.name, len(group.users), group.meta.get('topic')
+        return None
+
+
+    def groupChanged(self, group):
+        """
+        Called by a L{Group} of this realm when its users or its metadata
+        change.
+
+        @type group: L{Group}
+        """
+
+
     def getGroup(self, name):
         if self.createGroupOnRequest:
             def ebGroup(err):
@@ -1219,10 +1451,26 @@ class WordsRealm(object):
 
 
 class InMemoryWordsRealm(WordsRealm):
+    """
+    A realm keeping its users and groups in memory.
+
+    @ivar users: The users, keyed by their lowercased names.
+    @type users: L{dict}
+
+    @ivar groups: The groups, keyed by their lowercased names.
+    @type groups: L{dict}
+
+    @ivar _listed: The description of the plain groups of this realm by
+        L{listGroups}, kept until their users or metadata change.  Changes
+        not made through L{Group.add}, L{Group.remove} and
+        L{Group.setMetadata} are not seen.
+    @type _listed: L{dict} mapping L{Group} to L{tuple}
+    """
     def __init__(self, *a, **kw):
         super(InMemoryWordsRealm, self).__init__(*a, **kw)
         self.users = {}
         self.groups = {}
+        self._listed = {}
 
 
     def itergroups(self):
@@ -1230,19 +1478,36 @@ class InMemoryWordsRealm(WordsRealm):
 
 
     def addUser(self, user):
-        if user.name in self.users:
+        name = user.name.lower()
+        if name in self.users:
             return defer.fail(failure.Failure(ewords.DuplicateUser()))
-        self.users[user.name] = user
+        self.users[name] = user
         return defer.succeed(user)
 
 
     def addGroup(self, group):
-        if group.name in self.groups:
+        name = group.name.lower()
+        if name in self.groups:
             return defer.fail(failure.Failure(ewords.DuplicateGroup()))
-        self.groups[group.name] = group
+        self.groups[name] = group
+        if isinstance(group, Group):
+            group.realm = self
         return defer.succeed(group)
 
 
+    def _listEntry(self, group):
+        entry = self._listed.get(group)
+        if entry is None:
+            entry = super(InMemoryWordsRealm, self)._listEntry(group)
+            if entry is not None and group.realm is self:
+                self._listed[group] = entry
+        return entry
+
+
+    def groupChanged(self, group):
+        self._listed.pop(group, None)
+
+
     def lookupUser(self, name):
         name = name.lower()
         try:
@@ -1262,6 +1527,11 @@ class InMemoryWordsRealm(WordsRealm):
         else:
             return defer.succeed(group)
 
+
+    def lookupGroups(self, names):
+        return defer.succeed(
+            [self.groups.get(name.lower()) for name in names])
+
 __all__ = [
     'Group', 'User',
 
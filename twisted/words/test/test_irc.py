@@ -479,6 +479,80 @@ class FormattedTextTests(IRCTestCase):
 
 
 
+class FormattingSpansTests(IRCTestCase):
+    """
+    Tests for L{irc.formattingSpans}.
+    """
+    def test_plainText(self):
+        """
+        Text without formatting codes is a single span with the default
+        formatting state.
+        """
+        self.assertEqual(
+            irc.formattingSpans('hello'),
+            ('hello', [(0, 5, irc._FormattingState())]))
+
+
+    def test_empty(self):
+        """
+        Text made only of formatting codes has no spans.
+        """
+        self.assertEqual(irc.formattingSpans(''), ('', []))
+        self.assertEqual(irc.formattingSpans('\x02\x0304\x0f'), ('', []))
+
+
+    def test_offsets(self):
+        """
+        Span offsets refer to the text without the formatting codes, and each
+        span carries the attributes toggled before it.
+        """
+        self.assertEqual(
+            irc.formattingSpans('a\x02bold\x1f both\x02 u\x0fn'),
+            ('abold both un', [
+                (0, 1, irc._FormattingState()),
+                (1, 5, irc._FormattingState(bold=True)),
+                (5, 10, irc._FormattingState(bold=True, underline=True)),
+                (10, 12, irc._FormattingState(underline=True)),
+                (12, 13, irc._FormattingState())]))
+
+
+    def test_colors(self):
+        """
+        Colors are numbers, wrapped around to the 16 supported colors, and a
+        foreground color without a background keeps the previous background.
+        An empty color code resets both colors.
+        """
+        self.assertEqual(
+            irc.formattingSpans('\x0304,99x\x0312y\x03z'),
+            ('xyz', [
+                (0, 1, irc._FormattingState(foreground=4, background=3)),
+                (1, 2, irc._FormattingState(foreground=12, background=3)),
+                (2, 3, irc._FormattingState())]))
+
+
+    def test_sharedState(self):
+        """
+        A formatting code never modifies the formatting state of a previous
+        span.
+        """
+        plain, spans = irc.formattingSpans('\x02a\x0fb\x02c')
+        self.assertEqual(spans[0][2], irc._FormattingState(bold=True))
+        self.assertEqual(spans[1][2], irc._FormattingState())
+        self.assertEqual(spans[2][2], irc._FormattingState(bold=True))
+        self.assertIsNot(spans[0][2], spans[2][2])
+
+
+    def test_stripFormattingColors(self):
+        """
+        L{irc.stripFormatting} removes color codes with their digits, but
+        keeps digits and commas which are not part of a color code.
+        """
+        self.assertEqual(
+            irc.stripFormatting('\x03999,999a\x03,02b\x031,c\x02\x1f\x16'),
+            '9,999a,02bc')
+
+
+
 class FormattingStateAttributeTests(IRCTestCase):
     """
     Tests for L{twisted.words.protocols.irc._FormattingState}.
@@ -538,6 +612,141 @@ class QuotingTests(IRCTestCase):
             self.assertEqual(s, irc.ctcpDequote(irc.ctcpQuote(s)))
 
 
+    def test_dequoteUnquoted(self):
+        """
+        Strings without any quoting character are returned unchanged by
+        L{irc.lowDequote} and L{irc.ctcpDequote}.
+        """
+        s = "Hello, this is a nice string with no complications."
+        self.assertIs(irc.lowDequote(s), s)
+        self.assertIs(irc.ctcpDequote(s), s)
+
+
+
+class CTCPExtractTests(IRCTestCase):
+    """
+    Tests for L{irc.ctcpExtract}.
+    """
+    def test_noDelimiter(self):
+        """
+        A message without CTCP delimiters is a single normal message, even if
+        it contains quoting characters.
+        """
+        message = "C:\\path %s0" % (irc.M_QUOTE,)
+        self.assertEqual(
+            irc.ctcpExtract(message),
+            {'extended': [], 'normal': [message]})
+        self.assertEqual(
+            irc.ctcpExtract(''),
+            {'extended': [], 'normal': []})
+
+
+    def test_mixed(self):
+        """
+        Normal and extended messages alternate around the delimiters, empty
+        ones are left out, and extended messages are dequoted and split into
+        a tag and optional data.
+        """
+        message = (
+            "hi%(X)sACTION waves %(Q)sa%(X)s%(X)s%(X)sthere%(X)sPING%(X)s"
+            % {'X': irc.X_DELIM, 'Q': irc.X_QUOTE})
+        self.assertEqual(
+            irc.ctcpExtract(message),
+            {'extended': [('ACTION', 'waves ' + irc.X_DELIM), ('PING', None)],
+             'normal': ['hi', 'there']})
+
+
+
+class ParseMessageTests(IRCTestCase):
+    """
+    Tests for L{irc._parseMessage}.
+    """
+    def assertParsed(self, line, tags, prefix, command, params):
+        message = irc._parseMessage(line)
+        self.assertEqual(
+            (message.tags, message.prefix, message.command, message.params),
+            (tags, prefix, command, params))
+
+
+    def test_command(self):
+        """
+        A message may be only a command.
+        """
+        self.assertParsed('QUIT', {}, '', 'QUIT', [])
+
+
+    def test_prefixAndParams(self):
+        """
+        The prefix, the middle parameters and the trailing parameter are
+        split like L{irc.parsemsg} does.
+        """
+        line = ':bob!b@host PRIVMSG  #chan :hello :there'
+        self.assertParsed(line, {}, 'bob!b@host', 'PRIVMSG',
+                          ['#chan', 'hello :there'])
+        self.assertEqual(irc.parsemsg(line),
+                         ('bob!b@host', 'PRIVMSG', ['#chan', 'hello :there']))
+
+
+    def test_emptyTrailing(self):
+        """
+        An empty trailing parameter is kept.
+        """
+        self.assertParsed('AWAY :', {}, '', 'AWAY', [''])
+
+
+    def test_tags(self):
+        """
+        Message tags are parsed and unescaped.
+        """
+        self.assertParsed('@a=1;b=x\\sy;c :server PING :now',
+                          {'a': '1', 'b': 'x y', 'c': ''},
+                          'server', 'PING', ['now'])
+
+
+    def test_numeric(self):
+        """
+        Numeric replies are translated to their symbolic names.
+        """
+        self.assertParsed(':server 001 bob :Welcome', {}, 'server',
+                          'RPL_WELCOME', ['bob', 'Welcome'])
+
+
+    def test_bad(self):
+        """
+        Lines without a command are bad messages.
+        """
+        for line in ['', '@tags', ':prefix', '@tags :prefix ']:
+            self.assertRaises(irc.IRCBadMessage, irc._parseMessage, line)
+
+
+    def test_noTags(self):
+        """
+        Messages without tags share L{irc._NO_TAGS}, and are split by
+        L{irc._splitMessage} alone.
+        """
+        line = ':server 001 bob :Welcome'
+        self.assertIs(irc._parseMessage(line).tags, irc._NO_TAGS)
+        self.assertEqual(irc._splitMessage(line),
+                         ('server', 'RPL_WELCOME', ['bob', 'Welcome']))
+        self.assertRaises(irc.IRCBadMessage, irc._splitMessage, ':prefix')
+
+
+
+class HandleCommandTests(IRCTestCase):
+    """
+    Tests for L{IRCClient.handleCommand}.
+    """
+    def test_instanceOverride(self):
+        """
+        Handlers set on the instance take precedence over the class ones.
+        """
+        handled = []
+        client = IRCClient()
+        client.irc_PING = lambda prefix, params: handled.append(params)
+        client.handleCommand('PING', 'server', ['server'])
+        self.assertEqual(handled, [['server']])
+
+
 
 class Dispatcher(irc._CommandDispatcherMixin):
     """
@@ -595,6 +804,21 @@ class DispatcherTests(IRCTestCase):
         self.assertRaises(irc.UnhandledCommand, disp.dispatch, 'bar')
 
 
+    def test_dispatchSubclass(self):
+        """
+        A subclass defined after its parent dispatched a command uses its own
+        handlers.
+        """
+        Dispatcher().dispatch('working', 1, 2)
+
+        class SubDispatcher(Dispatcher):
+            def disp_working(self, a, b):
+                return b, a
+
+        self.assertEqual(SubDispatcher().dispatch('working', 1, 2), (2, 1))
+        self.assertEqual(Dispatcher().dispatch('working', 1, 2), (1, 2))
+
+
 
 class ServerSupportedFeatureTests(IRCTestCase):
     """
@@ -1903,6 +2127,216 @@ class BasicServerFunctionalityTests(IRCTestCase):
 
 
 
+class ServerReplyTests(IRCTestCase):
+    """
+    Tests for the replies of several lines sent by L{irc.IRC}.
+    """
+    def setUp(self):
+        self.transport = StringTransport()
+        self.protocol = irc.IRC()
+        self.protocol.hostname = 'server.host'
+        self.protocol.makeConnection(self.transport)
+        self.writes = []
+        self.patch(self.transport, 'writeSequence', self.writeSequence)
+
+
+    def writeSequence(self, data):
+        self.writes.append(b''.join(data))
+        StringTransport.writeSequence(self.transport, data)
+
+
+    def test_namesPacked(self):
+        """
+        L{IRC.names} packs as many names as fit in lines of
+        L{irc.MAX_COMMAND_LENGTH} bytes once encoded, and writes the whole
+        reply with a single C{writeSequence}.
+        """
+        names = [u'n\xe9%03d' % (i,) for i in range(200)]
+        self.protocol.names(u'someuser', u'#chan', names)
+
+        self.assertEqual(len(self.writes), 1)
+        lines = self.transport.value().split(b'\r\n')
+        self.assertEqual(lines.pop(), b'')
+        self.assertEqual(
+            lines.pop(),
+            b':server.host 366 someuser #chan :End of /NAMES list')
+        prefix = b':server.host 353 someuser = #chan :'
+        received = []
+        for line in lines:
+            self.assertTrue(line.startswith(prefix))
+            self.assertTrue(len(line) + 2 <= irc.MAX_COMMAND_LENGTH)
+            received.extend(line[len(prefix):].split(b' '))
+        for line in lines[:-1]:
+            # The next name would not have fit.
+            self.assertTrue(len(line) + 2 + len(b' n\xc3\xa9000') >
+                            irc.MAX_COMMAND_LENGTH)
+        self.assertEqual(received, [name.encode('utf-8') for name in names])
+
+
+    def test_longReplyProducer(self):
+        """
+        Replies longer than L{IRC.replyBatchLines} are written a batch at a
+        time by a producer registered on the transport, and the lines sent
+        meanwhile are written after them.
+        """
+        self.protocol.replyBatchLines = 2
+        self.protocol.who(
+            'someuser', '#chan',
+            [('user%d' % (i,), 'host', 'server', 'nick%d' % (i,), 'H', 0,
+              'Real Name') for i in range(4)])
+        self.protocol.sendLine('PING :server.host')
+
+        producer = self.transport.producer
+        self.assertFalse(self.transport.streaming)
+        self.assertEqual(self.transport.value(), b'')
+
+        producer.resumeProducing()
+        producer.resumeProducing()
+        self.assertIdentical(self.transport.producer, producer)
+        producer.resumeProducing()
+        self.assertIdentical(self.transport.producer, None)
+
+        self.assertEqual(
+            self.writes,
+            [b':server.host 352 someuser #chan user0 host server nick0 H '
+             b':0 Real Name\r\n'
+             b':server.host 352 someuser #chan user1 host server nick1 H '
+             b':0 Real Name\r\n',
+             b':server.host 352 someuser #chan user2 host server nick2 H '
+             b':0 Real Name\r\n'
+             b':server.host 352 someuser #chan user3 host server nick3 H '
+             b':0 Real Name\r\n',
+             b':server.host 315 someuser #chan :End of /WHO list.\r\n'
+             b'PING :server.host\r\n'])
+
+        self.protocol.sendLine('PING :server.host')
+        self.assertTrue(
+            self.transport.value().endswith(b'\r\nPING :server.host\r\n'))
+
+
+class CommandRateTests(IRCTestCase):
+    """
+    Tests for the flood control of L{irc.IRC} when L{irc.IRC.commandRate} is
+    set.
+    """
+    def setUp(self):
+        self.clock = task.Clock()
+        self.transport = StringTransport()
+        self.protocol = irc.IRC()
+        self.protocol._reactor = self.clock
+        self.protocol.commandRate = 2
+        self.protocol.commandBurst = 3
+        self.protocol.hostname = 'server.host'
+        self.handled = []
+        self.protocol.handleCommand = (
+            lambda command, prefix, params: self.handled.append(command))
+        self.protocol.makeConnection(self.transport)
+
+
+    def test_burst(self):
+        """
+        Up to L{irc.IRC.commandBurst} commands are handled at once, then
+        reading from the transport is paused and one more command is
+        handled every L{irc.IRC.commandRate} seconds.
+        """
+        self.protocol.dataReceived(
+            b'PING :a\r\nPING :b\r\nPING :c\r\nPING :d\r\nPING :e\r\n')
+        self.assertEqual(self.handled, ['PING'] * 3)
+        self.assertEqual(self.transport.producerState, 'paused')
+        self.assertEqual(self.protocol.throttled, 1)
+
+        self.clock.advance(2)
+        self.assertEqual(len(self.handled), 4)
+        self.assertEqual(self.transport.producerState, 'paused')
+
+        self.clock.advance(2)
+        self.assertEqual(len(self.handled), 5)
+        self.assertEqual(self.transport.producerState, 'producing')
+        self.assertEqual(self.protocol.throttled, 1)
+
+
+    def test_refill(self):
+        """
+        Tokens are added back over time, up to L{irc.IRC.commandBurst}.
+        """
+        self.protocol.dataReceived(b'PING :a\r\nPING :b\r\nPING :c\r\n')
+        self.clock.advance(100)
+        self.protocol.dataReceived(
+            b'PING :a\r\nPING :b\r\nPING :c\r\nPING :d\r\n')
+        self.assertEqual(len(self.handled), 6)
+        self.assertEqual(self.transport.producerState, 'paused')
+
+
+    def test_costs(self):
+        """
+        Commands in L{irc.IRC.commandCosts} take that many tokens, and blank
+        lines take none.
+        """
+        self.protocol.commandCosts = {'WHO': 3}
+        self.protocol.dataReceived(b'\r\n\r\nWHO #chan\r\nPING :a\r\n')
+        self.assertEqual(self.handled, ['WHO'])
+
+        self.clock.advance(1)
+        self.assertEqual(self.handled, ['WHO'])
+        self.clock.advance(1)
+        self.assertEqual(self.handled, ['WHO', 'PING'])
+
+
+    def test_throttleObserver(self):
+        """
+        L{irc.IRC.throttleObserver} is called with the protocol and the
+        delay every time the transport is paused.
+        """
+        throttles = []
+        self.protocol.throttleObserver = (
+            lambda protocol, delay: throttles.append((protocol, delay)))
+        self.protocol.dataReceived(b'PING :a\r\n' * 4)
+        self.assertEqual(throttles, [(self.protocol, 2)])
+
+
+    def test_throttleObserverStaticMethod(self):
+        """
+        A L{irc.IRC.throttleObserver} set on a class as a C{staticmethod} is
+        called with the protocol and the delay.
+        """
+        throttles = []
+        class ObservedIRC(irc.IRC):
+            throttleObserver = staticmethod(
+                lambda protocol, delay: throttles.append((protocol, delay)))
+        self.protocol.__class__ = ObservedIRC
+        self.protocol.dataReceived(b'PING :a\r\n' * 4)
+        self.assertEqual(throttles, [(self.protocol, 2)])
+
+
+    def test_badLine(self):
+        """
+        A line which cannot be parsed drops the connection and the lines
+        left, also when it is handled after a delay.
+        """
+        self.protocol.dataReceived(
+            b'PING :a\r\nPING :b\r\nPING :c\r\n:badprefixonly\r\n'
+            b'PING :d\r\n')
+        self.assertEqual(self.handled, ['PING'] * 3)
+        self.assertFalse(self.transport.disconnecting)
+
+        self.clock.advance(2)
+        self.assertEqual(len(self.flushLoggedErrors(ValueError)), 1)
+        self.assertTrue(self.transport.disconnecting)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.clock.advance(100)
+        self.assertEqual(self.handled, ['PING'] * 3)
+
+
+    def test_connectionLost(self):
+        """
+        The commands left are dropped when the connection is lost.
+        """
+        self.protocol.dataReceived(b'PING :a\r\n' * 5)
+        self.protocol.connectionLost(None)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertEqual(len(self.handled), 3)
+
+
 class DummyClient(irc.IRCClient):
     """
     A L{twisted.words.protocols.irc.IRCClient} that stores sent lines in a
@@ -2181,6 +2615,67 @@ class ClientMsgTests(IRCTestCase):
         self.assertRaises(ValueError, irc.split, "foo", -1)
 
 
+    def splitUTF8(self, message, length):
+        """
+        Split C{message} with L{irc._splitUTF8}, check that the lines are
+        native strings, and return them encoded to UTF-8.
+        """
+        lines = irc._splitUTF8(message, length)
+        for line in lines:
+            self.assertIsInstance(line, str)
+        return [line.encode('utf-8') if isinstance(line, unicode) else line
+                for line in lines]
+
+
+    def test_splitUTF8(self):
+        """
+        L{irc._splitUTF8} measures lines in bytes of UTF-8, prefers to break
+        them on spaces, and otherwise never breaks them inside the encoding of
+        a character.  The lines are native strings.
+        """
+        self.assertEqual(
+            self.splitUTF8(u'\xe9\xe9\xe9', 3),
+            [b'\xc3\xa9', b'\xc3\xa9', b'\xc3\xa9'])
+        self.assertEqual(
+            self.splitUTF8(u'\u20ac\xe9 \xe9\n\nab', 5),
+            [b'\xe2\x82\xac\xc3\xa9', b'\xc3\xa9', b'ab'])
+        self.assertEqual(
+            self.splitUTF8(b'aa bb  cc', 5), [b'aa bb', b'cc'])
+        self.assertRaises(ValueError, irc._splitUTF8, 'foo', 0)
+
+
+    def test_splitLongUnicodeMessages(self):
+        """
+        Long non-ASCII messages are split so that no command exceeds the
+        maximum length in bytes, and arrive in their entirety.
+        """
+        message = u'\xe9' * irc.MAX_COMMAND_LENGTH
+        length = irc.MAX_COMMAND_LENGTH // 2
+        self.client.msg('foo', message, length)
+        lines = [line.encode('utf-8') if isinstance(line, unicode) else line
+                 for line in self.client.lines]
+        for line in lines:
+            self.assertTrue(len(line) + 2 <= length)
+        self.assertEqual(
+            b''.join(line[len(b'PRIVMSG foo :'):]
+                     for line in lines).decode('utf-8'),
+            message)
+
+
+    def test_safeMaximumLineLength(self):
+        """
+        L{IRCClient._safeMaximumLineLength} leaves room for the longest
+        prefix a server may add to the command.
+        """
+        command = 'PRIVMSG foo :'
+        theoretical = ':%s!%s@%s %s' % (
+            'a' * self.client.supported.getFeature('NICKLEN'),
+            'b' * 10, 'c' * 63, command)
+        self.assertEqual(
+            self.client._safeMaximumLineLength(command),
+            irc.MAX_COMMAND_LENGTH - len(theoretical) - 10)
+
+
     def test_say(self):
         """
         L{IRCClient.say} prepends the channel prefix C{"#"} if necessary and
@@ -2224,6 +2719,20 @@ class ClientTests(IRCTestCase):
         return line.split('\r\n')[-2]
 
 
+    def test_msgWriteSequence(self):
+        """
+        Without a line rate, all the lines of a long message are written with
+        a single C{writeSequence} call.
+        """
+        writes = []
+        self.patch(self.transport, 'writeSequence', writes.append)
+        self.protocol.msg('foo', 'bar\nbaz\x00')
+        self.assertEqual(len(writes), 1)
+        self.assertEqualBufferValue(
+            b''.join(writes[0]),
+            'PRIVMSG foo :bar\r\nPRIVMSG foo :baz\x100\r\n')
+
+
     def test_away(self):
         """
         L{IRCClient.away} sends an AWAY command with the specified message.
@@ -2422,6 +2931,360 @@ class ClientTests(IRCTestCase):
 
 
 
+class LineRateTests(IRCTestCase):
+    """
+    Tests for the flood control of L{IRCClient} when L{IRCClient.lineRate}
+    is set.
+    """
+    def setUp(self):
+        self.clock = task.Clock()
+        self.transport = StringTransport()
+        self.protocol = IRCClientWithoutLogin()
+        self.protocol._reactor = self.clock
+        self.protocol.lineRate = 2
+        self.protocol.lineBurst = 3
+        self.protocol.makeConnection(self.transport)
+
+
+    def sentLines(self):
+        """
+        Return the lines written to the transport, and clear it.
+        """
+        lines = self.transport.value().split(b'\r\n')[:-1]
+        self.transport.clear()
+        return lines
+
+
+    def test_burst(self):
+        """
+        Up to L{IRCClient.lineBurst} lines are sent at once, and then one
+        every L{IRCClient.lineRate} seconds.
+        """
+        for i in range(5):
+            self.protocol.sendLine('PRIVMSG #chan :%d' % (i,))
+        self.assertEqualBufferValue(self.sentLines(), [
+            'PRIVMSG #chan :0', 'PRIVMSG #chan :1', 'PRIVMSG #chan :2'])
+        self.clock.advance(1)
+        self.assertEqual(self.sentLines(), [])
+        self.clock.advance(1)
+        self.assertEqualBufferValue(self.sentLines(), ['PRIVMSG #chan :3'])
+        self.clock.advance(2)
+        self.assertEqualBufferValue(self.sentLines(), ['PRIVMSG #chan :4'])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+    def test_refill(self):
+        """
+        Tokens are added back while no line is sent, up to
+        L{IRCClient.lineBurst}.
+        """
+        for i in range(3):
+            self.protocol.sendLine('PRIVMSG #chan :%d' % (i,))
+        self.sentLines()
+        self.clock.advance(20)
+        for i in range(4):
+            self.protocol.sendLine('PRIVMSG #chan :%d' % (i,))
+        self.assertEqual(len(self.sentLines()), 3)
+
+
+    def test_priority(self):
+        """
+        Queued I{PONG} lines are sent before other commands, and other
+        commands before messages.
+        """
+        for i in range(3):
+            self.protocol.sendLine('PRIVMSG #chan :%d' % (i,))
+        self.sentLines()
+        self.protocol.sendLine('PRIVMSG #chan :hello')
+        self.protocol.sendLine('JOIN #other')
+        self.protocol.sendLine('PONG :server')
+        for i in range(3):
+            self.clock.advance(2)
+        self.assertEqualBufferValue(self.sentLines(), [
+            'PONG :server', 'JOIN #other', 'PRIVMSG #chan :hello'])
+
+
+    def test_fairness(self):
+        """
+        Queued messages to different targets are sent in turn.
+        """
+        for i in range(3):
+            self.protocol.sendLine('PRIVMSG #chan :%d' % (i,))
+        self.sentLines()
+        self.protocol.sendLine('PRIVMSG #a :1')
+        self.protocol.sendLine('PRIVMSG #a :2')
+        self.protocol.sendLine('PRIVMSG #a :3')
+        self.protocol.sendLine('PRIVMSG #b :1')
+        self.protocol.sendLine('NOTICE bob :1')
+        for i in range(5):
+            self.clock.advance(2)
+        self.assertEqualBufferValue(self.sentLines(), [
+            'PRIVMSG #a :1', 'PRIVMSG #b :1', 'NOTICE bob :1',
+            'PRIVMSG #a :2', 'PRIVMSG #a :3'])
+
+
+    def test_connectionLost(self):
+        """
+        Lines still queued when the connection is lost are dropped.
+        """
+        for i in range(5):
+            self.protocol.sendLine('PRIVMSG #chan :%d' % (i,))
+        self.protocol.connectionLost(None)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+
+
+class CapabilityClient(IRCClientWithoutLogin):
+    """
+    A client that requests some IRCv3 capabilities and records the result of
+    the negotiation.
+    """
+    capabilities = ('batch', 'message-tags', 'echo-message')
+    negotiated = None
+
+    def capabilitiesNegotiated(self, capabilities):
+        self.negotiated = capabilities
+
+
+
+class CapabilityNegotiationTests(IRCTestCase):
+    """
+    Tests for the IRCv3 capability negotiation done by L{IRCClient}.
+    """
+    def setUp(self):
+        self.transport = StringTransport()
+        self.protocol = CapabilityClient()
+        self.protocol.makeConnection(self.transport)
+        self.protocol.register('alice')
+        self.transport.clear()
+
+
+    def test_registerRequestsCapabilities(self):
+        """
+        If L{IRCClient.capabilities} is not empty, L{IRCClient.register}
+        asks the server for its capabilities before registering.
+        """
+        transport = StringTransport()
+        protocol = CapabilityClient()
+        protocol.makeConnection(transport)
+        protocol.register('alice')
+        self.assertEqualBufferValue(
+            transport.value().split(b'\r\n')[:2],
+            ['CAP LS 302', 'NICK alice'])
+
+
+    def test_requestOffered(self):
+        """
+        Only the wanted capabilities offered by the server are requested,
+        once the server has listed all of them, ignoring their values.
+        """
+        self.protocol.dataReceived(
+            ':server CAP * LS * :sasl=PLAIN echo-message\r\n')
+        self.assertEqualBufferValue(self.transport.value(), '')
+        self.protocol.dataReceived(
+            ':server CAP * LS :batch server-time\r\n')
+        self.assertEqualBufferValue(
+            self.transport.value(), 'CAP REQ :batch echo-message\r\n')
+
+
+    def test_nothingOffered(self):
+        """
+        If the server offers none of the wanted capabilities, the
+        negotiation ends without requesting anything.
+        """
+        self.protocol.dataReceived(':server CAP * LS :sasl\r\n')
+        self.assertEqualBufferValue(self.transport.value(), 'CAP END\r\n')
+        self.assertEqual(self.protocol.negotiated, set())
+
+
+    def test_acknowledged(self):
+        """
+        The capabilities acknowledged by the server are enabled, and the
+        negotiation ends.
+        """
+        self.protocol.dataReceived(':server CAP * LS :batch echo-message\r\n')
+        self.transport.clear()
+        self.protocol.dataReceived(
+            ':server CAP alice ACK :batch echo-message\r\n')
+        self.assertEqualBufferValue(self.transport.value(), 'CAP END\r\n')
+        self.assertEqual(self.protocol.negotiated,
+                         set(['batch', 'echo-message']))
+        self.assertEqual(self.protocol.enabledCapabilities,
+                         set(['batch', 'echo-message']))
+
+
+    def test_notAcknowledged(self):
+        """
+        If the server refuses the requested capabilities, the negotiation
+        ends with none of them enabled.
+        """
+        self.protocol.dataReceived(':server CAP * LS :batch\r\n')
+        self.transport.clear()
+        self.protocol.dataReceived(':server CAP alice NAK :batch\r\n')
+        self.assertEqualBufferValue(self.transport.value(), 'CAP END\r\n')
+        self.assertEqual(self.protocol.negotiated, set())
+
+
+    def test_laterAcknowledgement(self):
+        """
+        Capabilities acknowledged after the negotiation are enabled or
+        disabled without ending the negotiation again.
+        """
+        self.protocol.dataReceived(':server CAP * LS :batch\r\n')
+        self.protocol.dataReceived(':server CAP alice ACK :batch\r\n')
+        self.transport.clear()
+        self.protocol.dataReceived(
+            ':server CAP alice ACK :-batch message-tags\r\n')
+        self.assertEqualBufferValue(self.transport.value(), '')
+        self.assertEqual(self.protocol.enabledCapabilities,
+                         set(['message-tags']))
+
+
+
+class TaggedMessageTests(IRCTestCase):
+    """
+    Tests for the handling of IRCv3 message tags and batches by
+    L{IRCClient}.
+    """
+    def setUp(self):
+        self.protocol = IRCClientWithoutLogin()
+        self.protocol.makeConnection(StringTransport())
+        self.received = []
+
+        def irc_PRIVMSG(prefix, params):
+            self.received.append((params[-1], self.protocol.currentTags))
+        self.protocol.irc_PRIVMSG = irc_PRIVMSG
+
+
+    def test_tags(self):
+        """
+        The tags of a message are available in L{IRCClient.currentTags}
+        while it is handled, with their values unescaped.
+        """
+        self.protocol.dataReceived(
+            '@time=2016-01-01T00:00:00.000Z;msgid=a\\sb\\:c;flag '
+            ':bob!b@host PRIVMSG #chan :hello\r\n')
+        self.assertEqual(self.received, [
+            ('hello', {'time': '2016-01-01T00:00:00.000Z',
+                       'msgid': 'a b;c', 'flag': ''})])
+        self.assertEqual(self.protocol.currentTags, {})
+
+
+    def test_untagged(self):
+        """
+        L{IRCClient.currentTags} is empty for messages without tags.
+        """
+        self.protocol.dataReceived(':bob!b@host PRIVMSG #chan :hello\r\n')
+        self.assertEqual(self.received, [('hello', {})])
+
+
+    def test_tagsWithoutCommand(self):
+        """
+        A message made only of tags is a bad message.
+        """
+        bad = []
+        self.protocol.badMessage = lambda *args: bad.append(args)
+        self.protocol.dataReceived('@time=now\r\n')
+        self.assertEqual(len(bad), 1)
+        self.assertEqual(self.received, [])
+
+
+    def test_batch(self):
+        """
+        Messages of a batch are held until the batch ends, and then handled
+        in order.
+        """
+        self.protocol.dataReceived(
+            ':server BATCH +ref chathistory #chan\r\n'
+            '@batch=ref :bob!b@host PRIVMSG #chan :one\r\n'
+            '@batch=ref :bob!b@host PRIVMSG #chan :two\r\n')
+        self.assertEqual(self.received, [])
+        self.protocol.dataReceived(':server BATCH -ref\r\n')
+        self.assertEqual([message for message, tags in self.received],
+                         ['one', 'two'])
+        self.assertEqual(self.received[0][1], {'batch': 'ref'})
+
+
+    def test_batchReceived(self):
+        """
+        L{IRCClient.batchReceived} is called with the type, the parameters
+        and the messages of a batch when it ends.
+        """
+        batches = []
+        self.protocol.batchReceived = lambda *args: batches.append(args)
+        self.protocol.dataReceived(
+            ':server BATCH +ref netsplit irc.a irc.b\r\n'
+            '@batch=ref :bob!b@host QUIT :irc.a irc.b\r\n'
+            ':server BATCH -ref\r\n')
+        [(batchType, parameters, messages)] = batches
+        self.assertEqual((batchType, parameters), ('netsplit', ['irc.a', 'irc.b']))
+        [message] = messages
+        self.assertEqual(
+            (message.command, message.prefix, message.params, message.tags),
+            ('QUIT', 'bob!b@host', ['irc.a irc.b'], {'batch': 'ref'}))
+
+
+    def test_observeCommands(self):
+        """
+        The observer given to L{IRCClient.observeCommands} is called with
+        each command handled and the time spent handling it.
+        """
+        observed = []
+        self.protocol.observeCommands(
+            lambda command, seconds: observed.append((command, seconds)))
+        self.protocol.dataReceived(':bob!b@host PRIVMSG #chan :hello\r\n'
+                                   ':server 375 bob :- MOTD -\r\n')
+        self.assertEqual([command for command, seconds in observed],
+                         ['PRIVMSG', 'RPL_MOTDSTART'])
+        for command, seconds in observed:
+            self.assertTrue(seconds >= 0)
+        self.assertEqual(self.received, [('hello', {})])
+
+
+    def test_observeCommandsReplace(self):
+        """
+        A new observer replaces the previous one, and L{None} removes it.
+        """
+        first, second = [], []
+        self.protocol.observeCommands(
+            lambda command, seconds: first.append(command))
+        self.protocol.observeCommands(
+            lambda command, seconds: second.append(command))
+        self.protocol.dataReceived(':bob!b@host PRIVMSG #chan :hello\r\n')
+        self.protocol.observeCommands(None)
+        self.protocol.dataReceived(':bob!b@host PRIVMSG #chan :again\r\n')
+        self.assertEqual((first, second), ([], ['PRIVMSG']))
+        self.assertNotIn('handleCommand', self.protocol.__dict__)
+        self.assertEqual(len(self.received), 2)
+
+
+    def test_observeCommandsInstanceHandler(self):
+        """
+        A C{handleCommand} set on the instance is observed, and put back when
+        the observer is removed.
+        """
+        handled, observed = [], []
+        handleCommand = lambda command, prefix, params: handled.append(command)
+        self.protocol.handleCommand = handleCommand
+        self.protocol.observeCommands(
+            lambda command, seconds: observed.append(command))
+        self.protocol.dataReceived(':bob!b@host PRIVMSG #chan :hello\r\n')
+        self.protocol.observeCommands(None)
+        self.assertEqual((handled, observed), (['PRIVMSG'], ['PRIVMSG']))
+        self.assertIs(self.protocol.handleCommand, handleCommand)
+
+
+    def test_unknownBatch(self):
+        """
+        Messages tagged with a batch which is not open are handled right
+        away.
+        """
+        self.protocol.dataReceived(
+            '@batch=none :bob!b@host PRIVMSG #chan :hello\r\n')
+        self.assertEqual(self.received, [('hello', {'batch': 'none'})])
+
+
+
 class CollectorClient(irc.IRCClient):
     """
     A client that saves in a list the names of the methods that got called.
@@ -7,6 +7,8 @@ Tests for L{twisted.words.service}.
 
 import time
 
+from zope.interface import implementer
+
 from twisted.cred import portal, credentials, checkers
 from twisted.internet import address, defer, reactor
 from twisted.internet.defer import Deferred, DeferredList, maybeDeferred, succeed
@@ -14,7 +16,7 @@ from twisted.python.compat import unicode
 from twisted.spread import pb
 from twisted.test import proto_helpers
 from twisted.trial import unittest
-from twisted.words import ewords, service
+from twisted.words import ewords, iwords, service
 from twisted.words.protocols import irc
 
 class RealmTests(unittest.TestCase):
@@ -94,6 +96,29 @@ class RealmTests(unittest.TestCase):
         self.assertIdentical(retrieved, lookedUp)
 
 
+    def test_mixedCaseAddition(self):
+        """
+        Users and groups added with mixed-case names are found by their names
+        in any case, and are duplicates of the same names in another case.
+        """
+        realm = service.InMemoryWordsRealm("realmname")
+
+        user = service.User(u"TestUser")
+        self.successResultOf(realm.addUser(user))
+        self.assertIdentical(
+            self.successResultOf(realm.lookupUser(u"testuser")), user)
+        self.failureResultOf(
+            realm.addUser(service.User(u"testUSER"))).trap(ewords.DuplicateUser)
+
+        group = service.Group(u"TestGroup")
+        self.successResultOf(realm.addGroup(group))
+        self.assertIdentical(
+            self.successResultOf(realm.lookupGroup(u"TESTGROUP")), group)
+        self.failureResultOf(
+            realm.addGroup(service.Group(u"testgroup"))).trap(
+                ewords.DuplicateGroup)
+
+
     def testGroupRetrieval(self):
         realm = service.InMemoryWordsRealm("realmname")
 
@@ -128,6 +153,55 @@ class RealmTests(unittest.TestCase):
         self.successResultOf(realm.createGroup(u"test"))
 
 
+    def test_lookupGroups(self):
+        """
+        L{service.InMemoryWordsRealm.lookupGroups} gives the groups of
+        several names at once, in order, and L{None} for the names without a
+        group.
+        """
+        realm = service.InMemoryWordsRealm("realmname")
+        one = self.successResultOf(realm.createGroup(u"groupone"))
+        two = self.successResultOf(realm.createGroup(u"grouptwo"))
+
+        self.assertEqual(
+            self.successResultOf(
+                realm.lookupGroups([u"GroupTwo", u"nosuchgroup", u"groupone"])),
+            [two, None, one])
+
+
+    def test_listGroupsChanged(self):
+        """
+        L{service.InMemoryWordsRealm.listGroups} describes a group again
+        once users joined or left it, or its metadata was set.
+        """
+        realm = service.InMemoryWordsRealm("realmname")
+        group = self.successResultOf(realm.createGroup(u"somegroup"))
+        user = service.User(u"someuser")
+        user.mind = service.IRCUser()
+        user.mind.name = user.name
+        user.mind.hostname = realm.name
+        user.mind.transport = proto_helpers.StringTransport()
+
+        self.assertEqual(
+            self.successResultOf(realm.listGroups([group])),
+            [(u"somegroup", 0, "")])
+
+        self.successResultOf(user.join(group))
+        self.assertEqual(
+            self.successResultOf(realm.listGroups([group])),
+            [(u"somegroup", 1, "")])
+
+        self.successResultOf(group.setMetadata({"topic": u"the topic"}))
+        self.assertEqual(
+            self.successResultOf(realm.listGroups([group])),
+            [(u"somegroup", 1, u"the topic")])
+
+        self.successResultOf(user.leave(group))
+        self.assertEqual(
+            self.successResultOf(realm.listGroups([group])),
+            [(u"somegroup", 0, u"the topic")])
+
+
     def testEnumeration(self):
         realm = service.InMemoryWordsRealm("realmname")
         self.successResultOf(realm.createGroup(u"groupone"))
@@ -408,6 +482,42 @@ class IRCProtocolTests(unittest.TestCase):
         self.assertEqual(response, event)
 
 
+    def test_partNotJoined(self):
+        """
+        Parting a channel the user is not on is answered with
+        I{ERR_NOTONCHANNEL}, and told to no member.
+        """
+        user = self._loggedInUser(u'useruser')
+        self.successResultOf(self.realm.createGroup(u"somechannel"))
+        other = self._loggedInUser(u'otheruser')
+        other.write('JOIN #somechannel\r\n')
+        user.transport.clear()
+        other.transport.clear()
+
+        user.write('PART #somechannel\r\n')
+
+        self.assertEqual(
+            self._response(user),
+            [('realmname', irc.ERR_NOTONCHANNEL,
+              ['useruser', '#somechannel', "You're not on that channel"])])
+        self.assertEqual(self._response(other), [])
+
+
+    def test_joinTwice(self):
+        """
+        Joining a channel again does not make the user a member twice.
+        """
+        user = self._loggedInUser(u'useruser')
+        self.successResultOf(self.realm.createGroup(u"somechannel"))
+
+        user.write('JOIN #somechannel\r\n')
+        user.write('JOIN #somechannel\r\n')
+
+        self.assertEqual(
+            [group.name for group in user.protocol.avatar.itergroups()],
+            [u'somechannel'])
+
+
     def testGetTopic(self):
         user = self._loggedInUser(u'useruser')
 
@@ -513,6 +623,148 @@ class IRCProtocolTests(unittest.TestCase):
         self.assertEqual(event[0][2], ['#somechannel', 'Hello, world.'])
 
 
+    def test_groupMessageBroadcast(self):
+        """
+        A message to a group is written as the same line to every IRC member
+        but its sender, and other chat clients in the group get it through
+        their C{receive} method.
+        """
+        group = self.successResultOf(self.realm.createGroup(u"somechannel"))
+        users = [self._loggedInUser(name)
+                 for name in (u'useruser', u'otheruser', u'someguy')]
+        for user in users:
+            user.write("JOIN #somechannel\r\n")
+
+        received = []
+        @implementer(iwords.IChatClient)
+        class Client(object):
+            name = u'client'
+            def userJoined(self, group, user):
+                pass
+            def receive(self, sender, recipient, message):
+                received.append((sender.name, recipient, message))
+        self.successResultOf(group.add(Client()))
+        for user in users:
+            user.transport.clear()
+
+        users[0].write('PRIVMSG #somechannel :Hello,\x00 world.\r\n')
+
+        self.assertEqual(users[0].transport.value(), b'')
+        self.assertEqual(
+            users[1].transport.value(),
+            b':useruser!useruser@realmname PRIVMSG #somechannel '
+            b':Hello,\x100 world.\r\n')
+        self.assertEqual(
+            users[2].transport.value(), users[1].transport.value())
+        self.assertEqual(
+            received,
+            [(u'useruser', group, {'text': u'Hello,\x00 world.'})])
+
+
+    def test_receivePrivate(self):
+        """
+        L{service.IRCUser.receive} writes the lines formatted by
+        L{service.IRCUser.formatReceive}: a quoted C{PRIVMSG} for every line
+        of the message.
+        """
+        user = self._loggedInUser(u'useruser')
+        other = self._loggedInUser(u'otheruser')
+        other.transport.clear()
+
+        other.protocol.receive(user.user, other.user,
+                               {'text': u'Hello,\x00 world.\nBye.'})
+
+        self.assertEqual(
+            other.transport.value(),
+            b':useruser!useruser@realmname PRIVMSG otheruser '
+            b':Hello,\x100 world.\r\n'
+            b':useruser!useruser@realmname PRIVMSG otheruser :Bye.\r\n')
+
+
+    def test_joinNotifyFailure(self):
+        """
+        The members of a group which fail to be told that a user joined it,
+        by raising an exception or returning a failed Deferred, are removed
+        from it.
+        """
+        group = self.successResultOf(self.realm.createGroup(u"somechannel"))
+
+        @implementer(iwords.IChatClient)
+        class Client(object):
+            result = None
+            def __init__(self, name):
+                self.name = name
+            def userJoined(self, group, user):
+                if self.result is not None:
+                    return self.result()
+            def userLeft(self, group, user, reason=None):
+                pass
+
+        raising, failing, staying = [
+            Client(name) for name in (u'raising', u'failing', u'staying')]
+        for client in raising, failing, staying:
+            self.successResultOf(group.add(client))
+        raising.result = lambda: 1 // 0
+        failing.result = lambda: defer.fail(ZeroDivisionError())
+
+        self.successResultOf(group.add(Client(u'joining')))
+
+        self.assertEqual(sorted(group.users), [u'joining', u'staying'])
+
+
+    def test_groupMessageAfterReply(self):
+        """
+        A message to a group is written to an IRC member after the lines of
+        a long reply still being written to it.
+        """
+        self.successResultOf(self.realm.createGroup(u"somechannel"))
+        for i in range(4):
+            self.successResultOf(self.realm.createGroup(u"group%d" % (i,)))
+        reader = self._loggedInUser(u'useruser')
+        sender = self._loggedInUser(u'otheruser')
+        reader.write("JOIN #somechannel\r\n")
+        sender.write("JOIN #somechannel\r\n")
+        reader.protocol.replyBatchLines = 2
+        reader.transport.clear()
+
+        reader.write("LIST\r\n")
+        producer = reader.transport.producer
+        self.assertNotIdentical(producer, None)
+        sender.write('PRIVMSG #somechannel :Hello, world.\r\n')
+        self.assertEqual(reader.transport.value(), b'')
+
+        while reader.transport.producer is not None:
+            producer.resumeProducing()
+        r = self._response(reader)
+        self.assertEqual(
+            [resp[1] for resp in r], ['322'] * 5 + ['323', 'PRIVMSG'])
+        self.assertEqual(r[-1][2], ['#somechannel', 'Hello, world.'])
+
+
+    def test_groupMessageBroadcastOverride(self):
+        """
+        IRC members whose protocol overrides how messages are received get
+        them through their C{receive} method.
+        """
+        received = []
+        class IRCUser(service.IRCUser):
+            def receive(self, sender, recipient, message):
+                received.append(message)
+        self.factory.protocol = IRCUser
+
+        self.successResultOf(self.realm.createGroup(u"somechannel"))
+        user = self._loggedInUser(u'useruser')
+        other = self._loggedInUser(u'otheruser')
+        user.write("JOIN #somechannel\r\n")
+        other.write("JOIN #somechannel\r\n")
+        other.transport.clear()
+
+        user.write('PRIVMSG #somechannel :Hello, world.\r\n')
+
+        self.assertEqual(other.transport.value(), b'')
+        self.assertEqual(received, [{'text': u'Hello, world.'}])
+
+
     def testPrivateMessage(self):
         user = self._loggedInUser(u'useruser')
 
@@ -694,6 +946,70 @@ class IRCProtocolTests(unittest.TestCase):
         self.assertEqual(end[1], '323')
 
 
+    def test_listSizes(self):
+        """
+        I{LIST} reports the number of users of plain groups along with the
+        size given by other groups, in the order of the groups.
+        """
+        user = self._loggedInUser(u"someuser")
+        self.successResultOf(self.realm.createGroup(u"plaingroup"))
+        user.write('JOIN #plaingroup\r\n')
+        other = self.successResultOf(self.realm.createGroup(u"othergroup"))
+        size = Deferred()
+        other.size = lambda: size
+        user.transport.clear()
+
+        user.write('LIST #plaingroup,#othergroup\r\n')
+        self.assertEqual(self._response(user), [])
+
+        size.callback(17)
+        r = self._response(user)
+        self.assertEqual(
+            [(resp[1], resp[2][1:3]) for resp in r],
+            [('322', ['plaingroup', '1']),
+             ('322', ['othergroup', '17']),
+             ('323', ['End of /LIST'])])
+
+
+    def test_listChanged(self):
+        """
+        I{LIST} reports the size and the topic a group has since users
+        joined it and its topic was set.
+        """
+        user = self._loggedInUser(u"someuser")
+        self.successResultOf(self.realm.createGroup(u"somegroup"))
+        user.write('LIST\r\n')
+        user.write('JOIN #somegroup\r\n')
+        user.write('TOPIC #somegroup :new topic\r\n')
+        user.transport.clear()
+
+        user.write('LIST\r\n')
+
+        self.assertEqual(
+            [(resp[1], resp[2][1:]) for resp in self._response(user)],
+            [('322', ['somegroup', '1', 'new topic']),
+             ('323', ['End of /LIST'])])
+
+
+    def test_namesChannels(self):
+        """
+        I{NAMES} reports the names of the users of every channel given,
+        and only the end of the names of the channels which do not exist.
+        """
+        user = self._loggedInUser(u"someuser")
+        self.successResultOf(self.realm.createGroup(u"somegroup"))
+        user.write('JOIN #somegroup\r\n')
+        user.transport.clear()
+
+        user.write('NAMES #somegroup,#nosuchgroup\r\n')
+
+        self.assertEqual(
+            [(resp[1], resp[2][1:]) for resp in self._response(user)],
+            [('353', ['=', '#somegroup', 'someuser']),
+             ('366', ['#somegroup', 'End of /NAMES list']),
+             ('366', ['#nosuchgroup', 'End of /NAMES list'])])
+
+
     def testWhois(self):
         user = self._loggedInUser(u'someguy')
 
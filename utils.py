@@ -19,9 +19,16 @@
 # Boston, MA 02111-1307, USA.
 
 import re
+import calendar
+
+URL_REGEX = 'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
+URL_PATTERN = re.compile(URL_REGEX)
+LINE_BREAK_PATTERN = re.compile(u"\r\n|[\r\n\u2029]")  # Line breaks of a GtkTextBuffer
+SERVER_TIME_PATTERN = re.compile(r"(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(\.\d+)?Z$")
+
 
 def get_urls(text):
-    return re.findall('http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', text)
+    return URL_PATTERN.findall(text)
 
 
 def parse_irc(msg, server):
@@ -53,17 +60,53 @@ def parse_irc(msg, server):
     #       as far as we've tested, which seems to be the goal
 
 
-def beep():
-    print "\a"
+def parse_server_time(value):
+    """
+    Returns the seconds since the epoch of the value of an IRCv3
+    server-time tag, like "2016-01-01T12:30:00.000Z", or None if value
+    isn't one.
+    """
+    match = SERVER_TIME_PATTERN.match(value or "")
+    if match is None:
+        return None
+
+    fields = [int(field) for field in match.groups()[:6]]
+    return calendar.timegm(fields) + float(match.group(7) or 0)
+
+
+def to_unicode(text):
+    # Servers relay whatever the clients send, so not every message is UTF-8
+    if isinstance(text, str):
+        return text.decode("utf-8", "replace")
+
+    return text
 
 
-def remove_usertypes(nicknames):
-    newnicks = []
-    for x in range(0, len(nicknames)):
-        if "@" in nicknames[x]:
-            newnicks.append(nicknames[x].split("@")[0])
+def split_lines(segments):
+    """
+    Splits a line of (text, tag) segments at its line breaks, and returns
+    a list of lines which end with a single "\n", so every line takes
+    exactly one line of a GtkTextBuffer.
+    """
+    lines = []
+    line = []
 
-        else:
-            newnicks.append(nicknames[x])
+    for text, tag in segments:
+        parts = LINE_BREAK_PATTERN.split(text)
+        for part in parts[:-1]:
+            line.append((part + u"\n", tag))
+            lines.append(line)
+            line = []
+
+        if parts[-1]:
+            line.append((parts[-1], tag))
+
+    if line:
+        lines.append(line)
+
+    return lines
+
+
+def beep():
+    print "\a"
 
-    return newnicks